@@ -1,8 +1,27 @@
 """
 Assembly code translator for the custom instruction set.
+
+Shifts take the destination and an amount, 'shl RD, R0-R3' or
+'shl RD, 0-15', and shift RD in place as ControlUnit.v decodes them. The
+four-operand form 'shl RD, RS1, imm?, imm' of earlier versions is
+rejected with an error naming the new syntax.
+
+Branches take a label or a signed offset in -512..511, the 10 bits
+ControlUnit.v decodes. Raw 12-bit fields (0..4095) are still accepted
+when they sign-extend bit 9, so they decode to the offset they encode.
 """
 
+import argparse
+import hashlib
+import json
 import os
+import sys
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from FetchTiming import FETCH_PERIOD
 
 op_codes = {
     'add': '0000',
@@ -24,6 +43,8 @@ op_codes = {
 }
 
 
+# Operand types: 'R' register, 'I<n>' n-bit immediate, 'O12' branch label
+# or offset, 'S' shift amount (a register R0-R3 or a 4-bit immediate)
 op_operands = {
     'add': ['R', 'R', 'R'],      # RD, RS1, RS2
     'addi': ['R', 'I8'],          # RD, Immediate
@@ -34,36 +55,321 @@ op_operands = {
     'loadi': ['R', 'I8'],         # RD, Immediate
     'load': ['R', 'R', 'I4'],     # RD, RS1 (Base), Offset
     'store': ['R', 'R', 'I4'],    # RS2 (Source), RS1 (Base), Offset
-    'jmp': ['I12'],                # Offset
-    'brz': ['I12'],                # Offset
-    'brnz': ['I12'],               # Offset
-    'brnn': ['I12'],               # Offset
-    'shl': ['R', 'R', 'I1', 'I3'], # RD, RS1, imm?, imm
-    'shr': ['R', 'R', 'I1', 'I3'], # RD, RS1, imm?, imm
-    'cmp': ['R', 'R']            # RS1, RS2
+    'jmp': ['O12'],                # Label or offset
+    'brz': ['O12'],                # Label or offset
+    'brnz': ['O12'],               # Label or offset
+    'brnn': ['O12'],               # Label or offset
+    'shl': ['R', 'S'],            # RD, shift amount
+    'shr': ['R', 'S'],            # RD, shift amount
+    'cmp': ['R', 'R'],           # RS1, RS2
+    '.word': ['I16'],             # Raw machine word
+}
+
+# Lowest bit of every operand, as src/ControlUnit.v decodes them: rd [11:9],
+# rs1 [8:6], rs2 [5:3], imm8 [7:0], load/store offset [3:0], branch offset
+# [11:0] (only [9:0] decoded), shift amount [5:0]. Bits no operand covers
+# are left at 0.
+operand_shifts = {
+    'add': (9, 6, 3),
+    'addi': (9, 0),
+    'sub': (9, 6, 3),
+    'and': (9, 6, 3),
+    'or': (9, 6, 3),
+    'xor': (9, 6, 3),
+    'loadi': (9, 0),
+    'load': (9, 6, 0),
+    'store': (9, 6, 0),
+    'jmp': (0, ),
+    'brz': (0, ),
+    'brnz': (0, ),
+    'brnn': (0, ),
+    'shl': (9, 0),
+    'shr': (9, 0),
+    'cmp': (9, 6),
+    '.word': (0, ),
 }
 
-# TODO: implement pseudo-instructions to add: nop, shl_r, shl_i, shr_r, shr_i
+# Bump whenever a change alters the output, so that build caches get invalidated
+ASSEMBLER_VERSION = '4'
+BUILD_CACHE_FILE = '.build_cache.json'
+LISTING_EXTENSION = '.lst'
+
+# TODO: implement pseudo-instructions to add: nop
+
+REGISTER_WIDTH = 3
+WORD_WIDTH = 16
+
+# Branch operands ('O12') are a label or a PC-relative offset. The word has
+# 12 bits for it but ControlUnit only decodes branch_offset = [9:0], added
+# to the 10-bit PC: signed offsets and labels must fit in 10 bits and are
+# encoded in two's complement over the 12 bits (-1 is 0xFFF).
+OFFSET_OPERAND = 'O12'
+BRANCH_OFFSET_BITS = 10
+BRANCH_OFFSET_MIN = -(1 << (BRANCH_OFFSET_BITS - 1))
+BRANCH_OFFSET_MAX = (1 << (BRANCH_OFFSET_BITS - 1)) - 1
+PC_MASK = (1 << BRANCH_OFFSET_BITS) - 1
+OFFSET_MASK = 0xFFF
+BRANCH_OPS = ('jmp', 'brz', 'brnz', 'brnn')
+
+# Shift amounts ('S'): with bit 5 set the amount is the immediate in [4:1],
+# otherwise it is the register in [5:3], which bit 5 being clear limits to
+# R0-R3. The operand value is the whole 6-bit field.
+SHIFT_OPERAND = 'S'
+SHIFT_IMMEDIATE = 0x20
+SHIFT_MAX = 15
+SHIFT_REGISTERS = 4
+# Operand count of the shift syntax before the hardware layout: RD, RS1, imm?, imm
+LEGACY_SHIFT_OPERANDS = 4
 
-def remove_comments_and_commas(code):
+# Raw words: '.word 0x1234' emits its operand as is
+WORD_DIRECTIVE = '.word'
+
+# One compact record per source line: the opcode mnemonic, the operand values
+# already parsed to integers, and the 1-based line number for error messages.
+Instruction = namedtuple('Instruction', ['op_code', 'operands', 'line_no'])
+
+def build_encoder_table():
     """
-    Removes comments and unnecessary whitespace from the source code.
-    
-    :param code: The source code as a string.
-    :return: Cleaned source code without comments and excessive whitespace.
+    Precomputes, for every opcode, the base word and the layout of its operands.
+
+    Operands are placed at the bit positions given by operand_shifts, which
+    follow the hardware decoder.
+
+    :return: Dict mapping an opcode to (base_word, fields), where fields is a
+             tuple of (is_register, max_value, shift) for each operand.
     """
-    lines = code.splitlines()
-    cleaned_lines = []
-    
-    for line in lines:
-        # Remove comments
-        line = line.split('#')[0].strip() # Remove Python-style comments
-        line = line.replace('//', '').strip()  # Remove C-style comments  
-        line = line.replace(',', '')  # Remove commas
-        if line:  # Only add non-empty lines
-            cleaned_lines.append(line)
-    
-    return '\n'.join(cleaned_lines)
+    table = {}
+    for op_code, operand_types in op_operands.items():
+        fields = []
+        for operand_type, shift in zip(operand_types, operand_shifts[op_code]):
+            if operand_type == 'R':
+                width = REGISTER_WIDTH
+            elif operand_type == SHIFT_OPERAND:
+                width = 6
+            else:
+                width = int(operand_type[1:])
+            fields.append((operand_type == 'R', (1 << width) - 1, shift))
+        base_word = 0
+        if op_code in op_codes:
+            base_word = int(op_codes[op_code], 2) << (WORD_WIDTH - len(op_codes[op_code]))
+        table[op_code] = (base_word, tuple(fields))
+    return table
+
+ENCODER_TABLE = build_encoder_table()
+_encoder_shifts = {op_code: (base_word, tuple(field[2] for field in fields))
+                   for op_code, (base_word, fields) in ENCODER_TABLE.items()}
+
+# Per operand type, the operand tokens already validated for it and their value.
+# Generated programs reuse the same few operands over and over, so after the
+# first occurrence a line is validated with plain dict lookups.
+_valid_operands = {operand_type: {} for operand_type in set().union(*op_operands.values())}
+_operand_caches = {op_code: tuple(_valid_operands[t] for t in operand_types)
+                   for op_code, operand_types in op_operands.items()}
+
+def parse_operand(operand):
+    """
+    Parses a register or immediate operand to an integer.
+
+    :param operand: Operand token, e.g. 'R3', '42', '0x2A' or '0b101'.
+    :return: (is_register, value), or (None, error message) if malformed.
+    """
+    if operand.startswith('R'):
+        digits = operand[1:]
+        if digits.isdigit():
+            return True, int(digits)
+        return None, f"Invalid register number '{operand}'"
+    if operand.startswith('0b'):
+        digits = operand[2:]
+        if digits and all(c in '01' for c in digits):
+            return False, int(digits, 2)
+        return None, f"Invalid binary immediate '{operand}'"
+    if operand.startswith('0x'):
+        digits = operand[2:]
+        if digits and all(c in '0123456789ABCDEF' for c in digits.upper()):
+            return False, int(digits, 16)
+        return None, f"Invalid hex immediate '{operand}'"
+    if operand.isdigit():
+        return False, int(operand)
+    if operand.startswith('-') and operand[1:].isdigit():
+        return False, -int(operand[1:])
+    return None, f"Expected register or immediate value but got '{operand}'"
+
+def parse_shift_amount(operand):
+    """
+    Parses the operand of 'shl'/'shr' into its 6-bit field.
+
+    :return: The field value, or an error message string.
+    """
+    kind, value = parse_operand(operand)
+    if kind is None:
+        return value
+    if kind:
+        if value >= SHIFT_REGISTERS:
+            return f"Shift register '{operand}' must be one of R0-R{SHIFT_REGISTERS - 1}"
+        return value << 3
+    if not 0 <= value <= SHIFT_MAX:
+        return f"Shift amount '{operand}' must be between 0 and {SHIFT_MAX}"
+    return SHIFT_IMMEDIATE | value << 1
+
+def is_label(name):
+    """ True if name can be a label: an identifier that is neither an opcode nor a register. """
+    return name.isidentifier() and name not in op_codes and parse_operand(name)[0] is None
+
+def strip_comments(line):
+    """ Removes '#' and '//' comments and turns commas into separators. """
+    return line.split('#', 1)[0].split('//', 1)[0].replace(',', ' ')
+
+def parse_line(line, line_no=0):
+    """
+    Tokenizes and validates one source line against the encoder table.
+
+    :param line: A line of source code, comments and commas allowed.
+    :param line_no: Line number reported in error messages.
+    :return: An Instruction, None for blank lines, or an error message string.
+             A branch to a label keeps the label name as its operand.
+    """
+    tokens = strip_comments(line).split()
+    if not tokens:
+        return None
+    line = ' '.join(tokens)
+    op_code = tokens[0]
+    entry = ENCODER_TABLE.get(op_code)
+    if entry is None:
+        return f"Error: Unknown operation '{op_code}' in line {line_no}: {line}"
+    fields = entry[1]
+    if len(tokens) - 1 != len(fields):
+        if op_code in ('shl', 'shr') and len(tokens) - 1 == LEGACY_SHIFT_OPERANDS:
+            return (f"Error: '{op_code} RD, RS1, imm?, imm' is the old shift syntax, write "
+                    f"'{op_code} RD, R0-R{SHIFT_REGISTERS - 1}' or '{op_code} RD, 0-{SHIFT_MAX}' "
+                    f"(RD is shifted in place) in line {line_no}: {line}")
+        return f"Error: Incorrect number of operands for '{op_code}' in line {line_no}: {line}"
+    values = []
+    for idx, operand in enumerate(tokens[1:]):
+        is_register, max_value, _ = fields[idx]
+        operand_type = op_operands[op_code][idx]
+        if operand_type == SHIFT_OPERAND:
+            value = parse_shift_amount(operand)
+            if isinstance(value, str):
+                return f"Error: {value} in line {line_no}: {line}"
+            values.append(value)
+            _operand_caches[op_code][idx][operand] = value
+            continue
+        is_offset = operand_type == OFFSET_OPERAND
+        if is_offset and is_label(operand):
+            # Resolved by parse_code once every label is known
+            values.append(operand)
+            continue
+        kind, value = parse_operand(operand)
+        if kind is None:
+            return f"Error: {value} in line {line_no}: {line}"
+        if is_offset:
+            # Raw 12-bit fields of older sources are kept when bits [11:10]
+            # repeat bit 9: ControlUnit then reads the offset they meant
+            if BRANCH_OFFSET_MAX < value <= OFFSET_MASK:
+                value -= OFFSET_MASK + 1
+            if not BRANCH_OFFSET_MIN <= value <= BRANCH_OFFSET_MAX:
+                return (f"Error: Branch offset '{operand}' does not fit in {BRANCH_OFFSET_BITS} bits "
+                        f"in line {line_no}: {line}")
+            value &= OFFSET_MASK
+        elif value < 0:
+            return f"Error: Negative immediate '{operand}' in line {line_no}: {line}"
+        if kind != is_register:
+            expected = 'register' if is_register else 'immediate value'
+            return (f"Error: Expected {expected} for operand {idx+1} in '{op_code}' "
+                    f"but got '{operand}' in line {line_no}: {line}")
+        if value > max_value:
+            what = 'Register' if is_register else 'Immediate'
+            return f"Error: {what} '{operand}' exceeds expected length in line {line_no}: {line}"
+        values.append(value)
+        _operand_caches[op_code][idx][operand] = value
+    return Instruction(op_code, tuple(values), line_no)
+
+def parse_code(source_code):
+    """
+    Parses the whole source in two passes.
+    The first one is a single linear scan over the lines: it parses the
+    instructions, builds the symbol table from 'label:' definitions and
+    records the branches that reference a label. The second one resolves
+    those references into PC-relative offsets, checked against the 10-bit
+    branch_offset of ControlUnit.
+    Every error is printed, so a bad file reports all of its problems at once.
+
+    :param source_code: The source code as a string.
+    :return: (instructions, ok) where instructions is a list of Instruction.
+    """
+    instructions = []
+    append = instructions.append
+    operand_caches = _operand_caches
+    new_instruction = tuple.__new__
+    symbols = {}
+    references = []
+    ok = True
+    for line_no, line in enumerate(source_code.splitlines(), 1):
+        if ',' in line:
+            line = line.replace(',', ' ')
+        if '#' in line or '/' in line:
+            line = strip_comments(line)
+        if ':' in line:
+            label, _, line = line.partition(':')
+            label = label.strip()
+            if not is_label(label):
+                print(f"Error: Invalid label '{label}' in line {line_no}")
+                ok = False
+            elif label in symbols:
+                print(f"Error: Label '{label}' already defined in line {symbols[label][1]}, "
+                      f"redefined in line {line_no}")
+                ok = False
+            else:
+                symbols[label] = (len(instructions), line_no)
+        tokens = line.split()
+        if not tokens:
+            continue
+        # Fast path: every operand was already validated for this operand slot
+        caches = operand_caches.get(tokens[0])
+        if caches is not None and len(tokens) == len(caches) + 1:
+            try:
+                values = tuple([cache[operand] for cache, operand in zip(caches, tokens[1:])])
+            except KeyError:
+                pass
+            else:
+                append(new_instruction(Instruction, (tokens[0], values, line_no)))
+                continue
+        parsed = parse_line(line, line_no)
+        if isinstance(parsed, str):
+            print(parsed)
+            ok = False
+        elif parsed is not None:
+            if parsed[0] in BRANCH_OPS and isinstance(parsed[1][0], str):
+                references.append(len(instructions))
+            append(parsed)
+
+    for index in references:
+        op_code, (label, ), line_no = instructions[index]
+        symbol = symbols.get(label)
+        if symbol is None:
+            print(f"Error: Undefined label '{label}' in line {line_no}")
+            ok = False
+            continue
+        offset = symbol[0] - index
+        if not BRANCH_OFFSET_MIN <= offset <= BRANCH_OFFSET_MAX:
+            print(f"Error: Branch to '{label}' is {offset} instructions away, beyond the "
+                  f"{BRANCH_OFFSET_BITS}-bit offset range in line {line_no}")
+            ok = False
+            continue
+        instructions[index] = Instruction(op_code, (offset & OFFSET_MASK,), line_no)
+    return instructions, ok
+
+def encode_instruction(instruction):
+    """
+    Encodes a parsed instruction into its 16-bit machine word.
+
+    :param instruction: An Instruction produced by parse_line/parse_code.
+    :return: The machine word as an integer.
+    """
+    word, shifts = _encoder_shifts[instruction[0]]
+    for value, shift in zip(instruction[1], shifts):
+        word |= value << shift
+    return word
 
 def check_formatting(source_code):
     """
@@ -71,158 +377,482 @@ def check_formatting(source_code):
     :param source_code: The source code as a string.
     :return: True if the formatting is correct, False otherwise.
     """
-    to_return = True
-    lines = source_code.splitlines()
-    for line in lines:
-        line = line.strip()
-        op_code = line.split()[0]
-        if not check_opcode(op_code, line):
-            to_return = False
-            continue
-        if not check_operands(op_code, line):
-            to_return = False
-    return to_return
-
-def check_opcode(op_code, line):
-    if op_code not in op_codes:
-        print(f"Error: Unknown operation '{op_code}' in line: {line}")
-        return False
-    return True
-
-def check_operands(op_code, line):
-    operands = line.split()[1:]
-    expected = op_operands[op_code]
-    if len(operands) != len(expected):
-        print(f"Error: Incorrect number of operands for '{op_code}' in line: {line}")
-        return False
-    for i, operand in enumerate(operands):
-        if not check_operand_type(expected[i], operand, i, op_code, line):
-            return False
-    return True
-
-def check_operand_type(expected_type, operand, idx, op_code, line):
-    if expected_type == 'R':
-        return check_register_operand(operand, idx, op_code, line)
-    else:
-        exepcted_immediate_length = expected_type[1:]
-        exepcted_immediate_length = int(exepcted_immediate_length)
-        return check_immediate_operand(operand, idx, op_code, line, exepcted_immediate_length)
-    return True
-
-def check_register_operand(operand, idx, op_code, line):
-    if not operand.startswith('R'):
-        print(f"Error: Expected register for operand {idx+1} in '{op_code}' but got '{operand}' in line: {line}")
-        return False
-    if not operand[1:].isdigit() or int(operand[1:]) < 0 or int(operand[1:]) > 15:
-        print(f"Error: Invalid register number '{operand}' in line: {line}")
-        return False
-    return True
-
-def check_immediate_operand(operand, idx, op_code, line, exepcted_length):
-    # exepcted_length is the number of bits expected for the immediate value
-    if not (operand.isdigit() or operand.startswith('0b') or operand.startswith('0x')):
-        print(f"Error: Expected immediate value for operand {idx+1} in '{op_code}' but got '{operand}' in line: {line}")
-        return False
-    if operand.startswith('0b'):
-        return check_binary_immediate(operand, line, exepcted_length)
-    elif operand.startswith('0x'):
-        return check_hex_immediate(operand, line, exepcted_length)
-    else:
-        return check_decimal_immediate(operand, line, exepcted_length)
-
-def check_val_fits_in_bits(value, expected_length):
-    # The value must be an integer
-    if not isinstance(value, int):
-        print(f"Error: Value '{value}' is not an integer.")
-        return False
-    # Check if the value fits in the expected number of bits
-    val_bin = bin(value)[2:]  # Get binary representation without '0b'
-    return len(val_bin) <= expected_length
-
-def check_binary_immediate(operand, line, expected_length):
-    if not all(c in '01' for c in operand[2:]) or not check_val_fits_in_bits(int(operand[2:], 2), expected_length):
-        print(f"Error: Invalid binary immediate '{operand}' in line: {line}")
-        return False
-    return True
-
-def check_hex_immediate(operand, line, expected_length):
-    if not all(c in '0123456789ABCDEF' for c in operand[2:].upper()):
-        print(f"Error: Invalid hex immediate '{operand}' in line: {line}")
-        return False
-    # Check if number as binary fits in expected length
-    if not check_val_fits_in_bits(int(operand[2:], 16), expected_length):
-        print(f"Error: Hex immediate '{operand}' exceeds expected length in line: {line}")
-        return False
-    return True
-
-def check_decimal_immediate(operand, line, exepcted_length):
-    if not operand.isdigit() or int(operand) < 0:
-        print(f"Error: Invalid decimal immediate '{operand}' in line: {line}")
-        return False
-    # Check if number as binary fits in expected length
-    if not check_val_fits_in_bits(int(operand), exepcted_length):  # Assuming 4 bits per digit
-        print(f"Error: Decimal immediate '{operand}' exceeds expected length in line: {line}")
-        return False
-    return True
+    return parse_code(source_code)[1]
 
 def translate_line(line):
-    op_code = line.split()[0]
-    operands = line.split()[1:]
-    output = op_codes[op_code] # Start with the opcode
+    """
+    Translates a single, valid source line into its binary string.
+
+    :param line: A line of source code.
+    :return: The instruction as a 16 character string of '0'/'1'.
+    """
+    return format(encode_instruction(parse_line(line)), '016b')
 
-    operands_types = op_operands[op_code]
+# ----------------------------------------------------------------------------
+# Peephole optimizer
+# ----------------------------------------------------------------------------
+
+ALU_OPS = ('add', 'sub', 'and', 'or', 'xor')
+# Flags are only read by conditional branches, which test Z and S
+FLAGS = 'flags'
+
+OptimizationReport = namedtuple('OptimizationReport', ['before', 'after', 'dead_writes', 'folded',
+                                                       'compares', 'threaded', 'static_cycles_saved'])
+
+def instruction_effects(instruction):
+    """
+    Registers and flags an instruction reads and writes.
 
-    for i, operand in enumerate(operands):
-        if operands_types[i] == 'R':
-            # Register operand
-            reg_num = int(operand[1:])
-            output += format(reg_num, '04b')
+    :return: (reads, written_register, sets_flags, has_side_effect); reads
+             holds register numbers and FLAGS, written_register is None
+             when no register is written.
+    """
+    op_code, operands = instruction[0], instruction[1]
+    if op_code in ALU_OPS:
+        return {operands[1], operands[2]}, operands[0], True, False
+    if op_code == 'addi':
+        return {operands[0]}, operands[0], True, False
+    if op_code == 'loadi':
+        return set(), operands[0], False, False
+    if op_code == 'load':
+        return {operands[1]}, operands[0], False, False
+    if op_code == 'store':
+        return {operands[0], operands[1]}, None, False, True
+    if op_code in ('shl', 'shr'):
+        amount = operands[1]
+        reads = {operands[0]} if amount & SHIFT_IMMEDIATE else {operands[0], amount >> 3}
+        return reads, operands[0], True, False
+    if op_code == 'cmp':
+        return {operands[0], operands[1]}, None, True, False
+    if op_code == WORD_DIRECTIVE:
+        # Opaque: may read anything, write anything or branch
+        return set(_ALL_LIVE), None, True, True
+    return (set() if op_code == 'jmp' else {FLAGS}), None, False, True
+
+_ALL_LIVE = frozenset(range(1, 1 << REGISTER_WIDTH)) | {FLAGS}
+
+def branch_targets(instructions):
+    """ Absolute target of every branch (None for other instructions), wrapped to the 10-bit PC. """
+    return [(index + instruction[1][0]) & PC_MASK if instruction[0] in BRANCH_OPS else None
+            for index, instruction in enumerate(instructions)]
+
+def find_leaders(instructions, targets):
+    """ Indices that start a basic block: 0, branch targets and the instruction after a branch. """
+    leaders = {0}
+    for index, target in enumerate(targets):
+        if target is not None:
+            leaders.add(target)
+            leaders.add(index + 1)
+    return leaders
+
+def _live_after(instructions, leaders):
+    """
+    Backward liveness inside each basic block, everything being live at the
+    end of a block.
+
+    :return: For every instruction, the set of registers (and FLAGS) read
+             before being written again, or None when everything is live.
+    """
+    live_after = [None] * len(instructions)
+    live = None
+    for index in range(len(instructions) - 1, -1, -1):
+        if index + 1 in leaders or instructions[index][0] in BRANCH_OPS:
+            live = None
+        live_after[index] = live
+        reads, written, sets_flags, _ = instruction_effects(instructions[index])
+        if live is None:
+            # Only what this instruction kills can become dead before it
+            live = _ALL_LIVE - ({written} if written else set()) - ({FLAGS} if sets_flags else set())
         else:
-            target_length = int(operands_types[i][1:])
-            imm_as_int = 0
-            if operand.startswith('0b'):
-                imm_as_int = int(operand[2:], 2)
-            elif operand.startswith('0x'):
-                imm_as_int = int(operand[2:], 16)
-            else:
-                imm_as_int = int(operand)
-            output += format(imm_as_int, f'0{target_length}b')
+            live = live - ({written} if written else set()) - ({FLAGS} if sets_flags else set())
+        live = live | reads
+        if live >= _ALL_LIVE:
+            live = None
+    return live_after
 
 
-    return output
+def _is_live(live, item):
+    return live is None or item in live
 
-def translate_code(source_code):
-    source_code = remove_comments_and_commas(source_code)
-    if not check_formatting(source_code):
-        return "Error: Formatting issues found."
+def _remove(instructions, targets, index):
+    """ Deletes an instruction, branches to it now reach the one that follows. """
+    del instructions[index]
+    del targets[index]
+    for position, target in enumerate(targets):
+        if target is not None and target > index:
+            targets[position] = target - 1
+
+def _thread_jumps(instructions, targets):
+    """ Retargets branches that land on an unconditional jump to that jump's target. """
+    threaded = 0
+    for index, target in enumerate(targets):
+        if target is None:
+            continue
+        final = target
+        seen = {index}
+        while final < len(instructions) and instructions[final][0] == 'jmp' \
+                and targets[final] != final and final not in seen:
+            seen.add(final)
+            final = targets[final]
+        # A branch to itself halts the CPU: never create one
+        if final != target and final != index:
+            targets[index] = final
+            threaded += 1
+    return threaded
+
+def _fold_loadi(instructions, targets, leaders, live_after):
+    """ Folds 'loadi Rd, a' followed by 'addi Rd, b' into 'loadi Rd, a+b' when the addi flags are dead. """
+    for index in range(len(instructions) - 1):
+        first, second = instructions[index], instructions[index + 1]
+        if first[0] == 'loadi' and second[0] == 'addi' and first[1][0] == second[1][0] \
+                and index + 1 not in leaders and not _is_live(live_after[index + 1], FLAGS):
+            value = (first[1][1] + second[1][1]) & 0xFF
+            instructions[index] = Instruction('loadi', (first[1][0], value), first[2])
+            _remove(instructions, targets, index + 1)
+            return True
+    return False
+
+def _drop_compare(instructions, targets, leaders):
+    """
+    Drops 'cmp Ra, R0' when the last flag-setting instruction of the block
+    was an ALU operation writing Ra: Z and S, the only flags branches test,
+    are then already those of Ra.
+    """
+    for index, instruction in enumerate(instructions):
+        if instruction[0] != 'cmp' or instruction[1][1] != 0 or instruction[1][0] == 0 \
+                or index in leaders:
+            continue
+        register = instruction[1][0]
+        previous = index - 1
+        while previous >= 0:
+            reads, written, sets_flags, _ = instruction_effects(instructions[previous])
+            if sets_flags or instructions[previous][0] in BRANCH_OPS:
+                if instructions[previous][0] in ALU_OPS + ('addi',) and written == register:
+                    _remove(instructions, targets, index)
+                    return True
+                break
+            if written == register or previous in leaders:
+                break
+            previous -= 1
+    return False
 
-    assembly_code = []
-    lines = source_code.splitlines()
-    output_lines = []
-    for line in lines:
-        translated = translate_line(line)
-        if translated:
-            output_lines.append(translated)
+def _drop_dead_writes(instructions, targets, live_after):
+    """ Removes instructions whose register and flag results are never read. """
+    for index in range(len(instructions) - 1, -1, -1):
+        _, written, sets_flags, side_effect = instruction_effects(instructions[index])
+        if side_effect:
+            continue
+        live = live_after[index]
+        if written and _is_live(live, written):
+            continue
+        if sets_flags and _is_live(live, FLAGS):
+            continue
+        _remove(instructions, targets, index)
+        return True
+    return False
+
+def optimize_instructions(instructions):
+    """
+    Peephole optimizer run between parsing and encoding.
 
-    return '\n'.join(output_lines)
+    Removes dead writes (writes to R0, results overwritten before being
+    read), folds loadi+addi chains, drops compares against R0 that repeat
+    the flags of the previous ALU operation and threads branches to
+    unconditional jumps. Everything is local to basic blocks, whose ends
+    keep every register and flag live, so the program behaves the same.
+    Programs containing '.word' are returned unchanged.
 
-def translate_file(source_file, output_file):
+    :param instructions: List of Instruction, as returned by parse_code.
+    :return: (instructions, report) with a new list and an OptimizationReport.
+    """
+    instructions = list(instructions)
+    before = len(instructions)
+    if any(instruction[0] == WORD_DIRECTIVE for instruction in instructions):
+        # A raw word may be a branch: offsets around it cannot be maintained
+        return instructions, OptimizationReport(before, before, 0, 0, 0, 0, 0)
+    targets = branch_targets(instructions)
+    counts = {'dead_writes': 0, 'folded': 0, 'compares': 0}
+    threaded = _thread_jumps(instructions, targets)
+    changed = True
+    while changed:
+        leaders = find_leaders(instructions, targets)
+        live_after = _live_after(instructions, leaders)
+        if _fold_loadi(instructions, targets, leaders, live_after):
+            counts['folded'] += 1
+        elif _drop_compare(instructions, targets, leaders):
+            counts['compares'] += 1
+        elif _drop_dead_writes(instructions, targets, live_after):
+            counts['dead_writes'] += 1
+        else:
+            changed = False
+    threaded += _thread_jumps(instructions, targets)
+
+    # Re-encode branch offsets, keeping the original ones that still reach
+    # the same target (only bits [9:0] are decoded)
+    for index, target in enumerate(targets):
+        if target is None:
+            continue
+        op_code, operands, line_no = instructions[index]
+        offset = (target - index) & OFFSET_MASK
+        if (operands[0] - offset) & PC_MASK:
+            instructions[index] = Instruction(op_code, (offset,), line_no)
+
+    after = len(instructions)
+    # Every fetch costs a full SPI read. Counted once per removed instruction
+    # and threaded jump: each run of a loop body saves this again
+    static_cycles_saved = (before - after + threaded) * FETCH_PERIOD
+    return instructions, OptimizationReport(before, after, threaded=threaded,
+                                            static_cycles_saved=static_cycles_saved, **counts)
+
+def format_optimization(report):
+    removed = report.before - report.after
+    return (f"{removed} instruction(s) removed ({report.dead_writes} dead, {report.folded} folded, "
+            f"{report.compares} cmp), {report.threaded} jump(s) threaded, "
+            f"{report.static_cycles_saved:,} cycles saved per pass (static)")
+
+def assemble(source_code, optimize=False):
+    """
+    Assembles source code, optionally through the peephole optimizer.
+
+    :return: (words, report): an array('H') of machine words, or None if the
+             source has errors, and an OptimizationReport or None.
+    """
+    instructions, ok = parse_code(source_code)
+    if not ok:
+        return None, None
+    report = None
+    if optimize:
+        instructions, report = optimize_instructions(instructions)
+    return array('H', map(encode_instruction, instructions)), report
+
+def assemble_code(source_code, optimize=False):
+    """
+    Assembles source code into packed 16-bit machine words.
+
+    :param source_code: The source code as a string.
+    :param optimize: Run the peephole optimizer before encoding.
+    :return: An array('H') of machine words, or None if the source has errors.
+    """
+    return assemble(source_code, optimize)[0]
+
+# Output formats of translate_file, with the extension main() gives them:
+#   bits   : one '0'/'1' string per word (historic .asm format)
+#   hex    : one 4-digit hex word per line, loadable with $readmemh
+#   bin    : raw big-endian words, the order ProgramMemory_SPI shifts them in
+#   bin-le : raw little-endian words
+OUTPUT_FORMATS = {
+    'bits': '.asm',
+    'hex': '.hex',
+    'bin': '.bin',
+    'bin-le': '.bin',
+}
+
+def format_words(words, output_format='bits'):
+    """
+    Serializes machine words in one of the OUTPUT_FORMATS.
+
+    :param words: Sequence of 16-bit machine words.
+    :param output_format: Key of OUTPUT_FORMATS.
+    :return: A str for the text formats, bytes for the binary ones.
+    """
+    if output_format == 'bits':
+        return '\n'.join(map('{:016b}'.format, words))
+    if output_format == 'hex':
+        return ''.join(map('{:04X}\n'.format, words))
+    if output_format in ('bin', 'bin-le'):
+        packed = array('H', words)
+        if (output_format == 'bin') != (sys.byteorder == 'big'):
+            packed.byteswap()
+        return packed.tobytes()
+    raise ValueError(f"Unknown output format '{output_format}'")
+
+def translate_code(source_code, optimize=False):
+    words = assemble_code(source_code, optimize)
+    if words is None:
+        return "Error: Formatting issues found."
+
+    return format_words(words)
+
+def translate_file(source_file, output_file, output_format='bits', optimize=False):
     """
     Translates a source file into assembly code and writes it to an output file.
-    
+    On errors, the 'bits' format writes the error message as it always did,
+    the other formats leave the output file untouched.
+
     :param source_file: Path to the source file containing the custom instruction set code.
     :param output_file: Path to the output file where the assembly code will be written.
+    :param output_format: Key of OUTPUT_FORMATS.
+    :param optimize: Run the peephole optimizer before encoding.
+    :return: True if the file was assembled successfully, False otherwise.
     """
+    return _translate_file(source_file, output_file, output_format, optimize)[0]
+
+def _translate_file(source_file, output_file, output_format, optimize):
+    """ translate_file, also returning the OptimizationReport (or None). """
     with open(source_file, 'r') as infile:
         source_code = infile.read()
-    
-    assembly_code = translate_code(source_code)
-    
-    with open(output_file, 'w') as outfile:
-        outfile.write(assembly_code)
+
+    words, report = assemble(source_code, optimize)
+    if words is None:
+        if output_format == 'bits':
+            with open(output_file, 'w') as outfile:
+                outfile.write("Error: Formatting issues found.")
+        return False, None
+
+    output = format_words(words, output_format)
+    with open(output_file, 'wb' if isinstance(output, bytes) else 'w') as outfile:
+        outfile.write(output)
+    return True, report
+
+def source_fingerprint(source_bytes, output_format, optimize=False):
+    """
+    Fingerprints a source for the incremental build: its content, the
+    assembler version, the output format and the optimizer all affect the
+    output file.
+    """
+    options = f'{output_format}-O' if optimize else output_format
+    digest = hashlib.sha256(f'{ASSEMBLER_VERSION}\0{options}\0'.encode())
+    digest.update(source_bytes)
+    return digest.hexdigest()
+
+def load_build_cache(output_dir):
+    try:
+        with open(os.path.join(output_dir, BUILD_CACHE_FILE), 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def save_build_cache(output_dir, cache):
+    cache_file = os.path.join(output_dir, BUILD_CACHE_FILE)
+    with open(cache_file + '.tmp', 'w') as outfile:
+        json.dump(cache, outfile, indent=1, sort_keys=True)
+    os.replace(cache_file + '.tmp', cache_file)
+
+def _build_job(job):
+    """ Process pool entry point: assembles and fingerprints one file, timing it. """
+    source_file, output_file, output_format, optimize, listing = job
+    start = time.perf_counter()
+    ok, report = _translate_file(source_file, output_file, output_format, optimize)
+    with open(source_file, 'rb') as infile:
+        source_bytes = infile.read()
+    fingerprint = source_fingerprint(source_bytes, output_format, optimize)
+    if ok and listing:
+        write_listing(source_file, output_file, source_bytes.decode(), optimize)
+    return ok, fingerprint, time.perf_counter() - start, report
+
+def listing_path(output_file):
+    return os.path.splitext(output_file)[0] + LISTING_EXTENSION
+
+def write_listing(source_file, output_file, source_code, optimize=False):
+    """ Writes the static fetch-cost listing of a source next to its output file. """
+    # Imported here: CycleAnalyzer itself imports this module
+    import CycleAnalyzer
+    listing, _ = CycleAnalyzer.listing_for_source(os.path.basename(source_file), source_code, optimize)
+    with open(listing_path(output_file), 'w') as outfile:
+        outfile.write(listing)
+
+def build_directory(source_dir, output_dir, output_format='bits', jobs=None, force=False, optimize=False,
+                    listing=False):
+    """
+    Incrementally assembles every .txt file of source_dir into output_dir.
+
+    A file is skipped when its output exists and the cache in output_dir
+    holds the same fingerprint for it. Unchanged size and mtime are trusted
+    without re-hashing, so a no-op rebuild only stats the sources.
+    Stale files are spread over a process pool.
+
+    :param source_dir: Directory holding the .txt sources.
+    :param output_dir: Directory receiving the outputs and the build cache.
+    :param output_format: Key of OUTPUT_FORMATS.
+    :param jobs: Number of worker processes, defaults to the CPU count.
+    :param force: Rebuild every file regardless of the cache.
+    :param optimize: Run the peephole optimizer and report its savings per file.
+    :param listing: Also write the CycleAnalyzer listing of every file as a .lst.
+    :return: (built, skipped, failed) lists of source file names.
+    """
+    start = time.perf_counter()
+    cache = {} if force else load_build_cache(output_dir)
+    extension = OUTPUT_FORMATS[output_format]
+
+    stale = []
+    skipped = []
+    for filename in sorted(os.listdir(source_dir)):
+        if not filename.endswith('.txt'):
+            continue
+        source_file = os.path.join(source_dir, filename)
+        output_name = filename[:-len('.txt')] + extension
+        output_file = os.path.join(output_dir, output_name)
+        stat = os.stat(source_file)
+        source_stat = [stat.st_size, stat.st_mtime_ns]
+        entry = cache.get(output_name)
+        if entry is not None and os.path.exists(output_file) \
+                and (not listing or os.path.exists(listing_path(output_file))):
+            if entry['source_stat'] == source_stat and entry['format'] == output_format \
+                    and entry['version'] == ASSEMBLER_VERSION and entry.get('optimize', False) == optimize:
+                skipped.append(filename)
+                continue
+            with open(source_file, 'rb') as infile:
+                fingerprint = source_fingerprint(infile.read(), output_format, optimize)
+            if entry['fingerprint'] == fingerprint:
+                entry['source_stat'] = source_stat
+                skipped.append(filename)
+                continue
+        stale.append((filename, source_file, output_file, output_name, source_stat))
+
+    jobs = jobs or os.cpu_count() or 1
+    job_args = [(source_file, output_file, output_format, optimize, listing) for _, source_file, output_file, _, _ in stale]
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(stale))) as pool:
+            results = list(pool.map(_build_job, job_args, chunksize=max(1, len(stale) // (jobs * 4))))
+    else:
+        results = [_build_job(job) for job in job_args]
+
+    built = []
+    failed = []
+    removed = static_cycles_saved = 0
+    for (filename, _, _, output_name, source_stat), (ok, fingerprint, seconds, report) in zip(stale, results):
+        line = f"{'Translated' if ok else 'FAILED    '} {filename} ({seconds * 1000:.1f} ms)"
+        if report is not None:
+            line += ": " + format_optimization(report)
+            removed += report.before - report.after
+            static_cycles_saved += report.static_cycles_saved
+        print(line)
+        if not ok:
+            failed.append(filename)
+            cache.pop(output_name, None)
+            continue
+        built.append(filename)
+        cache[output_name] = {
+            'fingerprint': fingerprint,
+            'source_stat': source_stat,
+            'format': output_format,
+            'version': ASSEMBLER_VERSION,
+            'optimize': optimize,
+        }
+
+    save_build_cache(output_dir, cache)
+    print(f"\n{len(built)} translated, {len(skipped)} up to date, {len(failed)} failed "
+          f"in {time.perf_counter() - start:.3f} s")
+    if optimize and built:
+        print(f"Optimizer: {removed} instruction(s) removed, {static_cycles_saved:,} cycles saved "
+              f"per pass over the code (static, not weighted by loop trips)")
+    return built, skipped, failed
 
 def main():
-    """ Translates all the files in /Source, and outputs them to /Assembly as .txt files. """
+    """ Translates all the files in /Source, and outputs them to /Output in the chosen format. """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='bits',
+                        help="output format (default: bits, written as .asm)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="worker processes for stale files (default: CPU count)")
+    parser.add_argument('--force', action='store_true',
+                        help="rebuild every file, ignoring the build cache")
+    parser.add_argument('--optimize', '-O', action='store_true',
+                        help="run the peephole optimizer and report the fetches it saves")
+    parser.add_argument('--listing', action='store_true',
+                        help="also write a .lst listing annotated with the predicted cycles of every block")
+    args = parser.parse_args()
+
     source_dir = 'Compiler/Source'
     output_dir = 'Compiler/Output'
 
@@ -235,13 +865,9 @@ def main():
     if not os.path.isdir(source_dir):
         print("Source directory does not exist...\n")
         return
-    
-    for filename in os.listdir(source_dir):
-        if filename.endswith('.txt'):
-            print(f"Translating {filename}...")
-            source_file = os.path.join(source_dir, filename)
-            output_file = os.path.join(output_dir, filename).replace('.txt', '.asm')
-            translate_file(source_file, output_file)
+
+    build_directory(source_dir, output_dir, args.format, args.jobs, args.force, args.optimize,
+                    args.listing)
     
     print("Translation complete.")
 
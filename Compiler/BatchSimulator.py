@@ -0,0 +1,307 @@
+"""
+NumPy batch simulator: runs many lanes of the CPU in lockstep.
+
+Each lane has its own registers, flags, PC and data memory, and either
+shares one program with the other lanes or runs its own. Every step
+executes one instruction in every lane through the same datapath as
+tt_um_cpu: the control signals of each word are looked up in a decode
+table, and disabled writes go to sink columns instead of being masked,
+so lanes that diverge on brz/brnz/brnn need no special handling.
+Semantics match InstructionSimulator.Simulator.
+"""
+
+import numpy as np
+
+from InstructionSimulator import (
+    BRANCH_CONDITIONS, DATA_MEMORY_SIZE, FLAG_Z, OP_ADD, OP_ADDI, OP_CMP,
+    OP_L, OP_LI, OP_SHL, OP_SHR, OP_ST, OP_SUB, PC_MASK, PROGRAM_SIZE,
+    R0_SINK, REGISTER_COUNT, alu_table,
+)
+
+# Columns of the control-signal table, one row per 16-bit word
+(SIG_ALU_OP, SIG_A_SEL, SIG_B_SEL, SIG_USE_IMM, SIG_IMM, SIG_DEST, SIG_FLAG_WRITE,
+ SIG_MEM_READ, SIG_STORE_SEL, SIG_BRANCH, SIG_BRANCH_MASK, SIG_BRANCH_EXPECTED,
+ SIG_OFFSET) = range(13)
+SIGNAL_COUNT = 13
+
+# Above this many distinct PCs, diverged lanes gather their signals one by one
+MAX_PC_GROUPS = 8
+
+# Data memory column receiving the writes of instructions that do not store
+MEMORY_SINK = DATA_MEMORY_SIZE
+
+_control_table = None
+_control_columns = None
+_alu_lookup = None
+
+def control_table():
+    """
+    Returns the (65536, SIGNAL_COUNT) table of control signals, mirroring
+    the outputs of ControlUnit.v for every possible instruction word.
+    """
+    global _control_table
+    if _control_table is not None:
+        return _control_table
+    word = np.arange(1 << 16, dtype=np.int32)
+    opcode = word >> 12
+    rd = (word >> 9) & 7
+    rs1 = (word >> 6) & 7
+    rs2 = (word >> 3) & 7
+    signals = np.zeros((1 << 16, SIGNAL_COUNT), dtype=np.int32)
+
+    # Defaults: R-type ALU op with RS1/RS2, written to RD
+    signals[:, SIG_ALU_OP] = opcode
+    signals[:, SIG_A_SEL] = rs1
+    signals[:, SIG_B_SEL] = rs2
+    signals[:, SIG_DEST] = np.where(rd == 0, R0_SINK, rd)
+    signals[:, SIG_FLAG_WRITE] = 1
+    signals[:, SIG_STORE_SEL] = rd
+
+    is_imm_shift = np.isin(opcode, (OP_SHL, OP_SHR)) & ((word & 0x20) != 0)
+    is_shift = np.isin(opcode, (OP_SHL, OP_SHR))
+    is_branch = np.isin(opcode, list(BRANCH_CONDITIONS))
+    no_write = is_branch | (opcode == OP_ST) | (opcode == OP_CMP)
+    no_flags = is_branch | np.isin(opcode, (OP_LI, OP_L, OP_ST))
+
+    signals[:, SIG_ALU_OP] = np.where(np.isin(opcode, (OP_ADDI, OP_LI, OP_L, OP_ST)), OP_ADD, opcode)
+    signals[opcode == OP_CMP, SIG_ALU_OP] = OP_SUB
+    signals[:, SIG_A_SEL] = np.where((opcode == OP_ADDI) | is_shift | (opcode == OP_CMP), rd, rs1)
+    signals[opcode == OP_LI, SIG_A_SEL] = 0
+    signals[opcode == OP_CMP, SIG_B_SEL] = rs1[opcode == OP_CMP]
+    signals[:, SIG_USE_IMM] = np.isin(opcode, (OP_ADDI, OP_LI, OP_L, OP_ST)) | is_imm_shift
+    signals[:, SIG_IMM] = np.where(np.isin(opcode, (OP_ADDI, OP_LI)), word & 0xFF,
+                                   np.where(is_imm_shift, (word >> 1) & 0xF, word & 0xF))
+    signals[no_write, SIG_DEST] = R0_SINK
+    signals[no_flags, SIG_FLAG_WRITE] = 0
+    signals[:, SIG_MEM_READ] = opcode == OP_L
+    signals[opcode != OP_ST, SIG_STORE_SEL] = -1
+    signals[:, SIG_BRANCH] = is_branch
+    for branch_opcode, (mask, expected) in BRANCH_CONDITIONS.items():
+        signals[opcode == branch_opcode, SIG_BRANCH_MASK] = mask
+        signals[opcode == branch_opcode, SIG_BRANCH_EXPECTED] = expected
+    signals[:, SIG_OFFSET] = np.where(is_branch, word & PC_MASK, 1)
+
+    _control_table = signals
+    return signals
+
+def control_columns():
+    """ Returns control_table() transposed to (SIGNAL_COUNT, 65536), contiguous. """
+    global _control_columns
+    if _control_columns is None:
+        _control_columns = np.ascontiguousarray(control_table().T)
+    return _control_columns
+
+def alu_lookup():
+    """ Returns the ALU tables of InstructionSimulator as a (16, 65536) array. """
+    global _alu_lookup
+    if _alu_lookup is None:
+        _alu_lookup = np.array([alu_table(operation) for operation in range(16)], dtype=np.int32)
+    return _alu_lookup
+
+class BatchSimulator:
+    """
+    Lockstep simulator of `lanes` independent CPUs.
+
+    registers (lanes, 8), flags (lanes,), pc (lanes,) and memory (lanes, 32)
+    are NumPy views that can be preloaded before running and read after.
+
+    State is stored register-major, (register, lane), so that while every
+    lane of a shared program sits at the same PC, a step is a handful of
+    whole-row operations with the decoded signals as plain integers. Once
+    a branch splits the lanes, each distinct PC runs on its own lanes and
+    blends its results into the rows; past MAX_PC_GROUPS distinct PCs, or
+    with one program per lane, every lane gathers its own signals.
+    """
+
+    def __init__(self, programs, lanes=None):
+        """
+        :param programs: One program shared by every lane (sequence of words),
+                         or one program per lane as a (lanes, n) array.
+        :param lanes: Number of lanes when a single program is shared.
+        """
+        programs = np.asarray(programs, dtype=np.int64)
+        if programs.ndim == 1:
+            if lanes is None:
+                raise ValueError("lanes is required when a single program is shared")
+            shared = np.zeros(PROGRAM_SIZE, dtype=np.int64)
+            shared[:len(programs)] = programs & 0xFFFF
+            self.program = shared
+            self.shared = True
+        else:
+            lanes = programs.shape[0]
+            if programs.shape[1] > PROGRAM_SIZE:
+                raise ValueError(f"Programs exceed the {PROGRAM_SIZE}-word program memory")
+            per_lane = np.zeros((lanes, PROGRAM_SIZE), dtype=np.int64)
+            per_lane[:, :programs.shape[1]] = programs & 0xFFFF
+            self.program = per_lane
+            self.shared = False
+        self.lanes = lanes
+        self.lane_index = np.arange(lanes)
+        self.signals = control_table()
+        self.alu = alu_lookup()
+        # Column-major signals for the per-lane gathers of diverged steps:
+        # per PC for a shared program, per word otherwise
+        self._word_signals = control_columns()
+        if self.shared:
+            self._pc_signals = np.ascontiguousarray(self.signals[self.program].T)
+        self._program_base = self.lane_index * PROGRAM_SIZE
+        self.reset()
+
+    def reset(self):
+        """ Puts every lane in the post-reset state of Simulator.reset. """
+        self._registers = np.zeros((REGISTER_COUNT + 1, self.lanes), dtype=np.int32)
+        self._memory = np.zeros((DATA_MEMORY_SIZE + 1, self.lanes), dtype=np.uint8)
+        self.registers = self._registers[:REGISTER_COUNT].T
+        self.memory = self._memory[:DATA_MEMORY_SIZE].T
+        self.flags = np.full(self.lanes, FLAG_Z, dtype=np.int32)
+        self._pc = np.zeros(self.lanes, dtype=np.int64)
+        # PC shared by every lane while they have not diverged, else None
+        self._uniform_pc = 0 if self.shared else None
+        self.halted = np.zeros(self.lanes, dtype=bool)
+        self.steps = 0
+
+    @property
+    def pc(self):
+        if self._uniform_pc is not None:
+            return np.full(self.lanes, self._uniform_pc, dtype=np.int64)
+        return self._pc
+
+    @pc.setter
+    def pc(self, value):
+        self._pc = np.broadcast_to(np.asarray(value, dtype=np.int64), (self.lanes,)).copy()
+        self._uniform_pc = None
+
+    def step(self):
+        """ Executes one instruction in every lane. Halted lanes spin on their 'jmp 0'. """
+        if self._uniform_pc is not None:
+            self._execute(self._uniform_pc)
+        elif self.shared:
+            pcs = np.flatnonzero(np.bincount(self._pc, minlength=PROGRAM_SIZE))
+            if len(pcs) == 1:
+                self._uniform_pc = int(pcs[0])
+                self._execute(self._uniform_pc)
+            elif len(pcs) <= MAX_PC_GROUPS:
+                # Few distinct PCs: run each one on its lanes with whole-row blends
+                masks = [(self._pc == pc).view(np.int8) for pc in pcs.tolist()]
+                for pc, mask in zip(pcs.tolist(), masks):
+                    self._execute(pc, mask)
+            else:
+                self._step_diverged()
+        else:
+            self._step_diverged()
+        self.steps += 1
+
+    def _execute(self, pc, mask=None):
+        """
+        Executes the instruction at a PC shared by every lane, or only by the
+        lanes selected by an int8 mask, blending the results into the others.
+        """
+        (alu_op, a_sel, b_sel, use_imm, imm, dest, flag_write, mem_read, store_sel,
+         branch, branch_mask, branch_expected, offset) = self.signals[self.program[pc]].tolist()
+        regs = self._registers
+        lanes = self.lanes
+
+        if branch:
+            taken = (self.flags & branch_mask) == branch_expected
+            if mask is not None:
+                taken &= mask.view(bool)
+                if offset == 0:
+                    self.halted |= taken
+                self._pc += mask + taken * (offset - 1)
+                self._pc &= PC_MASK
+            elif taken.all():
+                if offset == 0:
+                    self.halted[:] = True
+                self._uniform_pc = (pc + offset) & PC_MASK
+            elif not taken.any():
+                self._uniform_pc = (pc + 1) & PC_MASK
+            else:
+                if offset == 0:
+                    self.halted |= taken
+                self._pc = (pc + np.where(taken, offset, 1)) & PC_MASK
+                self._uniform_pc = None
+            return
+
+        index = regs[a_sel] << 8
+        index |= imm if use_imm else regs[b_sel]
+        value = self.alu[alu_op].take(index)
+        if flag_write:
+            flags = value >> 8
+            if mask is not None:
+                flags -= self.flags
+                flags *= mask
+                flags += self.flags
+            self.flags = flags
+        if store_sel >= 0:
+            address = value & (DATA_MEMORY_SIZE - 1)
+            if mask is not None:
+                # Unselected lanes store into the sink row instead
+                address -= MEMORY_SINK
+                address *= mask
+                address += MEMORY_SINK
+            self._memory.ravel()[address * lanes + self.lane_index] = regs[store_sel]
+        else:
+            if mem_read:
+                address = value & (DATA_MEMORY_SIZE - 1)
+                result = self._memory.ravel().take(address * lanes + self.lane_index).astype(np.int32)
+            else:
+                result = value & 0xFF
+            if mask is not None:
+                result -= regs[dest]
+                result *= mask
+                result += regs[dest]
+            regs[dest] = result
+        if mask is None:
+            self._uniform_pc = (pc + 1) & PC_MASK
+        else:
+            self._pc += mask
+            self._pc &= PC_MASK
+
+    def _step_diverged(self):
+        lanes = self.lane_index
+        lane_count = self.lanes
+        regs = self._registers.ravel()
+        memory = self._memory.ravel()
+        pc = self._pc
+        if self.shared:
+            table, index = self._pc_signals, pc
+        else:
+            table, index = self._word_signals, self.program.ravel().take(self._program_base + pc)
+
+        def signal(column):
+            return table[column].take(index)
+
+        operand1 = regs.take(signal(SIG_A_SEL) * lane_count + lanes)
+        operand2 = np.where(signal(SIG_USE_IMM) != 0, signal(SIG_IMM),
+                            regs.take(signal(SIG_B_SEL) * lane_count + lanes))
+        value = self.alu.ravel().take((signal(SIG_ALU_OP) << 16) | (operand1 << 8) | operand2)
+        address = (value & (DATA_MEMORY_SIZE - 1)) * lane_count + lanes
+
+        store = signal(SIG_STORE_SEL)
+        is_store = store >= 0
+        store_data = regs.take(np.where(is_store, store, R0_SINK) * lane_count + lanes)
+        write_data = np.where(signal(SIG_MEM_READ) != 0, memory.take(address), value & 0xFF)
+        self.flags = np.where(signal(SIG_FLAG_WRITE) != 0, value >> 8, self.flags)
+        regs[signal(SIG_DEST) * lane_count + lanes] = write_data
+        memory[np.where(is_store, address, MEMORY_SINK * lane_count + lanes)] = store_data
+
+        taken = (self.flags & signal(SIG_BRANCH_MASK)) == signal(SIG_BRANCH_EXPECTED)
+        offset = np.where(taken, signal(SIG_OFFSET), 1)
+        self.halted |= (signal(SIG_BRANCH) != 0) & taken & (offset == 0)
+        self._pc = (pc + offset) & PC_MASK
+
+    def run(self, max_steps=10000, check_every=32):
+        """
+        Steps every lane until all of them halted or max_steps were taken.
+
+        :param check_every: Steps between two checks for all lanes halted.
+        :return: Number of steps taken.
+        """
+        taken = 0
+        while taken < max_steps:
+            for _ in range(min(check_every, max_steps - taken)):
+                self.step()
+                taken += 1
+            if self.halted.all():
+                break
+        return taken
@@ -0,0 +1,244 @@
+"""
+Benchmark of the single-pass assembler core against the previous
+split-validate-split-again implementation, on a generated 100k-line program,
+then of label resolution on programs of growing size. The previous
+implementation encoded an older layout, so the output is checked by a
+round trip through the disassembler.
+
+Usage: python Compiler/Benchmarks/AssemblerBenchmark.py [line_count]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import AssemblyTranslator
+import Disassembler
+from AssemblyTranslator import op_codes, op_operands
+
+# ============================================================================
+# PREVIOUS IMPLEMENTATION (verbatim, error printing removed)
+# ============================================================================
+
+# Operand table the previous implementation packed from the MSB, with 4-bit
+# registers; the current one encodes the ControlUnit layout instead
+legacy_op_operands = {
+    'add': ['R', 'R', 'R'], 'addi': ['R', 'I8'], 'sub': ['R', 'R', 'R'], 'and': ['R', 'R', 'R'],
+    'or': ['R', 'R', 'R'], 'xor': ['R', 'R', 'R'], 'loadi': ['R', 'I8'], 'load': ['R', 'R', 'I4'],
+    'store': ['R', 'R', 'I4'], 'jmp': ['I12'], 'brz': ['I12'], 'brnz': ['I12'], 'brnn': ['I12'],
+    'shl': ['R', 'R', 'I1', 'I3'], 'shr': ['R', 'R', 'I1', 'I3'], 'cmp': ['R', 'R'],
+}
+
+def legacy_remove_comments_and_commas(code):
+    lines = code.splitlines()
+    cleaned_lines = []
+
+    for line in lines:
+        line = line.split('#')[0].strip() # Remove Python-style comments
+        line = line.replace('//', '').strip()
+        line = line.replace(',', '')
+        if line:
+            cleaned_lines.append(line)
+
+    return '\n'.join(cleaned_lines)
+
+def legacy_check_formatting(source_code):
+    to_return = True
+    lines = source_code.splitlines()
+    for line in lines:
+        line = line.strip()
+        op_code = line.split()[0]
+        if not legacy_check_opcode(op_code, line):
+            to_return = False
+            continue
+        if not legacy_check_operands(op_code, line):
+            to_return = False
+    return to_return
+
+def legacy_check_opcode(op_code, line):
+    if op_code not in op_codes:
+        return False
+    return True
+
+def legacy_check_operands(op_code, line):
+    operands = line.split()[1:]
+    expected = legacy_op_operands[op_code]
+    if len(operands) != len(expected):
+        return False
+    for i, operand in enumerate(operands):
+        if not legacy_check_operand_type(expected[i], operand, i, op_code, line):
+            return False
+    return True
+
+def legacy_check_operand_type(expected_type, operand, idx, op_code, line):
+    if expected_type == 'R':
+        return legacy_check_register_operand(operand, idx, op_code, line)
+    else:
+        exepcted_immediate_length = expected_type[1:]
+        exepcted_immediate_length = int(exepcted_immediate_length)
+        return legacy_check_immediate_operand(operand, idx, op_code, line, exepcted_immediate_length)
+    return True
+
+def legacy_check_register_operand(operand, idx, op_code, line):
+    if not operand.startswith('R'):
+        return False
+    if not operand[1:].isdigit() or int(operand[1:]) < 0 or int(operand[1:]) > 15:
+        return False
+    return True
+
+def legacy_check_immediate_operand(operand, idx, op_code, line, exepcted_length):
+    if not (operand.isdigit() or operand.startswith('0b') or operand.startswith('0x')):
+        return False
+    if operand.startswith('0b'):
+        return legacy_check_binary_immediate(operand, line, exepcted_length)
+    elif operand.startswith('0x'):
+        return legacy_check_hex_immediate(operand, line, exepcted_length)
+    else:
+        return legacy_check_decimal_immediate(operand, line, exepcted_length)
+
+def legacy_check_val_fits_in_bits(value, expected_length):
+    if not isinstance(value, int):
+        return False
+    val_bin = bin(value)[2:]
+    return len(val_bin) <= expected_length
+
+def legacy_check_binary_immediate(operand, line, expected_length):
+    if not all(c in '01' for c in operand[2:]) or not legacy_check_val_fits_in_bits(int(operand[2:], 2), expected_length):
+        return False
+    return True
+
+def legacy_check_hex_immediate(operand, line, expected_length):
+    if not all(c in '0123456789ABCDEF' for c in operand[2:].upper()):
+        return False
+    if not legacy_check_val_fits_in_bits(int(operand[2:], 16), expected_length):
+        return False
+    return True
+
+def legacy_check_decimal_immediate(operand, line, exepcted_length):
+    if not operand.isdigit() or int(operand) < 0:
+        return False
+    if not legacy_check_val_fits_in_bits(int(operand), exepcted_length):
+        return False
+    return True
+
+def legacy_translate_line(line):
+    op_code = line.split()[0]
+    operands = line.split()[1:]
+    output = op_codes[op_code] # Start with the opcode
+
+    operands_types = legacy_op_operands[op_code]
+
+    for i, operand in enumerate(operands):
+        if operands_types[i] == 'R':
+            reg_num = int(operand[1:])
+            output += format(reg_num, '04b')
+        else:
+            target_length = int(operands_types[i][1:])
+            imm_as_int = 0
+            if operand.startswith('0b'):
+                imm_as_int = int(operand[2:], 2)
+            elif operand.startswith('0x'):
+                imm_as_int = int(operand[2:], 16)
+            else:
+                imm_as_int = int(operand)
+            output += format(imm_as_int, f'0{target_length}b')
+
+    return output
+
+def legacy_translate_code(source_code):
+    source_code = legacy_remove_comments_and_commas(source_code)
+    if not legacy_check_formatting(source_code):
+        return "Error: Formatting issues found."
+
+    assembly_code = []
+    lines = source_code.splitlines()
+    output_lines = []
+    for line in lines:
+        translated = legacy_translate_line(line)
+        if translated:
+            output_lines.append(translated)
+
+    return '\n'.join(output_lines)
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def random_operand(operand_type, rng):
+    if operand_type == 'R':
+        return f'R{rng.randrange(8)}'
+    if operand_type == 'S':
+        return rng.choice((f'R{rng.randrange(4)}', str(rng.randrange(16))))
+    value = rng.randrange(1 << int(operand_type[1:]))
+    return rng.choice((str(value), hex(value), bin(value)))
+
+def generate_program(line_count, seed=0, operand_types=op_operands):
+    """ Builds a random but valid program, with comments sprinkled in. """
+    rng = random.Random(seed)
+    mnemonics = list(op_codes)
+    lines = []
+    for i in range(line_count):
+        op_code = rng.choice(mnemonics)
+        operands = ', '.join(random_operand(t, rng) for t in operand_types[op_code])
+        line = f'{op_code} {operands}'
+        if i % 10 == 0:
+            line += '  # comment'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def generate_labelled_program(line_count, seed=0):
+    """ Builds a program with a label every 4 lines and branches to labels up to 500 lines away. """
+    rng = random.Random(seed)
+    lines = []
+    for i in range(line_count):
+        line = f'add R{i % 8}, R1, R2'
+        if i % 4 == 0:
+            line = f'L{i}: {line}'
+        elif i % 4 == 2:
+            target = min(max(i + rng.randrange(-500, 500), 0), line_count - 1) & ~3
+            line = f'{rng.choice(("jmp", "brz", "brnz", "brnn"))} L{target}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def time_it(function, source_code, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(source_code)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    source_code = generate_program(line_count)
+
+    # Same opcodes and comments, operands in the syntax of each implementation
+    legacy_time, legacy_output = time_it(legacy_translate_code,
+                                         generate_program(line_count, operand_types=legacy_op_operands), 3)
+    new_time, new_output = time_it(AssemblyTranslator.translate_code, source_code, 3)
+    assert len(legacy_output.splitlines()) == len(new_output.splitlines()) == line_count
+
+    # The layouts differ, so check the new output against the disassembler instead
+    words = [int(word, 2) for word in new_output.splitlines()]
+    reassembled, _ = AssemblyTranslator.assemble(Disassembler.disassemble_program(words))
+    assert list(reassembled) == words, "Disassembly does not assemble back to the same words"
+
+    print(f"Lines assembled : {line_count}")
+    print(f"Previous        : {line_count / legacy_time:12,.0f} lines/s ({legacy_time:.3f} s)")
+    print(f"Single-pass     : {line_count / new_time:12,.0f} lines/s ({new_time:.3f} s)")
+    print(f"Speedup         : {legacy_time / new_time:.2f}x")
+
+    # Resolution is one dict lookup per reference: the rate must not drop
+    # as the number of labels grows
+    print()
+    for count in (line_count // 4, line_count, line_count * 4):
+        labelled_time, _ = time_it(AssemblyTranslator.translate_code, generate_labelled_program(count), 3)
+        print(f"Labelled {count:>8,} lines ({count // 4:>7,} labels): "
+              f"{count / labelled_time:12,.0f} lines/s ({labelled_time:.3f} s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark of the NumPy batch simulator against a scalar loop over the
+instruction simulator, checking ALU and branch behaviour over the whole
+8-bit operand space (every R1, R2 pair: 65536 runs).
+
+Usage: python Compiler/Benchmarks/BatchSimulatorBenchmark.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+import BatchSimulator
+import InstructionSimulator
+
+PROGRAMS = {
+    # Straight-line ALU checks: every lane stays on the same PC
+    'alu': [
+        0x0650,  # ADD R3, R1, R2
+        0x2850,  # SUB R4, R1, R2
+        0x5A50,  # XOR R5, R1, R2
+        0x3C50,  # AND R6, R1, R2
+        0x4E50,  # OR R7, R1, R2
+        0xF280,  # CMP R1, R2
+        0x9000,  # JMP 0
+    ],
+    # Data-dependent branches: lanes diverge and meet again
+    'alu+branches': [
+        0x0650,  # ADD R3, R1, R2
+        0x2850,  # SUB R4, R1, R2
+        0x5A50,  # XOR R5, R1, R2
+        0xF280,  # CMP R1, R2
+        0xA002,  # BRZ +2
+        0x6C01,  # LOADI R6, 1
+        0xC002,  # BRNS +2
+        0x6E01,  # LOADI R7, 1
+        0x9000,  # JMP 0
+    ],
+}
+
+def run_batch(program, operand1, operand2):
+    batch = BatchSimulator.BatchSimulator(program, lanes=len(operand1))
+    batch.registers[:, 1] = operand1
+    batch.registers[:, 2] = operand2
+    batch.run(len(program) + 1)
+    return batch.registers, batch.flags
+
+def run_scalar(program, operand1, operand2):
+    simulator = InstructionSimulator.Simulator(program)
+    registers = np.zeros((len(operand1), 8), dtype=np.int32)
+    flags = np.zeros(len(operand1), dtype=np.int32)
+    executed = 0
+    for lane, (value1, value2) in enumerate(zip(operand1.tolist(), operand2.tolist())):
+        simulator.reset()
+        simulator.registers[1] = value1
+        simulator.registers[2] = value2
+        executed += simulator.run(len(program) + 1)
+        registers[lane] = simulator.get_registers()
+        flags[lane] = simulator.flags
+    return registers, flags, executed
+
+def main():
+    operand1, operand2 = np.divmod(np.arange(1 << 16), 256)
+    # Decode and ALU tables are built once per process, keep them out of the timings
+    InstructionSimulator.decode_table()
+    BatchSimulator.control_columns()
+    BatchSimulator.alu_lookup()
+
+    for name, program in PROGRAMS.items():
+        start = time.perf_counter()
+        batch_registers, batch_flags = run_batch(program, operand1, operand2)
+        batch_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scalar_registers, scalar_flags, executed = run_scalar(program, operand1, operand2)
+        scalar_time = time.perf_counter() - start
+
+        assert np.array_equal(batch_registers, scalar_registers), f"{name}: registers differ"
+        assert np.array_equal(batch_flags, scalar_flags), f"{name}: flags differ"
+
+        print(f"{name} ({1 << 16} lanes, {executed} instructions)")
+        print(f"  Scalar loop     : {executed / scalar_time:14,.0f} instr/s ({scalar_time:.3f} s)")
+        print(f"  Batch simulator : {executed / batch_time:14,.0f} instr/s ({batch_time:.3f} s)")
+        print(f"  Speedup         : {scalar_time / batch_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
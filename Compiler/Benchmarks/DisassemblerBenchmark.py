@@ -0,0 +1,50 @@
+"""
+Benchmark of the table-driven disassembler: building the 65536-entry
+tables, the full round trip of every word through the assembler, then
+scalar lookups against the vectorized path on a few million fetched words.
+
+Usage: python Compiler/Benchmarks/DisassemblerBenchmark.py [word_count]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import AssemblyTranslator
+import Disassembler
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 4000000
+
+    (text, exact, canonical), elapsed = timed(Disassembler.tables)
+    print(f"Tables            : {elapsed * 1000:12.1f} ms ({sum(canonical):,} canonical words of 65,536)")
+    _, elapsed = timed(Disassembler.arrays)
+    print(f"NumPy tables      : {elapsed * 1000:12.1f} ms")
+
+    # Every word, labels included, must assemble back to itself
+    every_word = list(range(1 << 16))
+    (words, _), elapsed = timed(AssemblyTranslator.assemble, Disassembler.disassemble_program(every_word))
+    assert list(words) == every_word, "Round trip through the assembler changed some words"
+    print(f"Round trip        : {elapsed * 1000:12.1f} ms for all 65,536 words")
+
+    fetched = np.random.default_rng(0).integers(0, 1 << 16, count, dtype=np.uint16)
+    sample = fetched[:count // 10].tolist()
+    _, elapsed = timed(lambda: [Disassembler.disassemble(word) for word in sample])
+    print(f"Scalar            : {len(sample) / elapsed:12,.0f} words/s")
+    texts, elapsed = timed(Disassembler.disassemble_array, fetched)
+    assert texts[123] == text[fetched[123]]
+    print(f"Vectorized text   : {count / elapsed:12,.0f} words/s")
+    _, elapsed = timed(Disassembler.decode_array, fetched)
+    print(f"Vectorized fields : {count / elapsed:12,.0f} words/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Load test of the execution server: concurrent clients submit batches of
+fuzzer programs and source snippets, each one waiting for its request to
+complete before sending the next. Reports requests and programs per
+second, latency percentiles per request, and the cost of one cold
+InstructionSimulator process per program for comparison.
+
+Without --socket, a server with --workers model workers is started in
+this process; the rtl backend needs a server started with --rtl-workers.
+
+Usage: python Compiler/Benchmarks/ExecutionServerBenchmark.py [--clients N] [--requests N] [--batch N]
+           [--workers N] [--socket PATH] [--backend model|rtl] [--cold N]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import AssemblyTranslator
+import ExecutionServer
+import ProgramFuzzer
+
+# Executed instructions allowed per program: fuzzer programs may loop forever
+MAX_INSTRUCTIONS = 2000
+
+SOURCE = """
+    loadi R1, {count}
+    loadi R2, {step}
+loop:
+    add R3, R3, R2
+    store R3, R0, 1
+    addi R1, 255
+    brnz loop
+    jmp 0
+"""
+
+def make_programs(count, seed=1):
+    """ Half fuzzer words, half assembly source: both paths of the workers. """
+    rng = random.Random(seed)
+    programs = []
+    for index in range(count):
+        if index % 2:
+            programs.append(SOURCE.format(count=rng.randrange(1, 64), step=rng.randrange(256)))
+        else:
+            programs.append({'words': ProgramFuzzer.generate_program(rng)})
+    return programs
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+async def client(path, batches, options, latencies, statuses):
+    reader, writer = await asyncio.open_unix_connection(path, limit=ExecutionServer.LINE_LIMIT)
+    try:
+        for request_id, programs in enumerate(batches):
+            start = time.perf_counter()
+            writer.write(json.dumps(dict(options, id=request_id, programs=programs)).encode() + b'\n')
+            await writer.drain()
+            while True:
+                message = json.loads(await reader.readline())
+                if 'error' in message:
+                    raise ExecutionServer.ExecutionError(message['error'])
+                if message.get('done'):
+                    break
+                statuses[message['status']] += 1
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+async def load_test(path, args):
+    programs = make_programs(args.clients * args.requests * args.batch)
+    options = {'backend': args.backend, 'max_instructions': MAX_INSTRUCTIONS, 'timeout': args.timeout}
+    clients = []
+    for index in range(args.clients):
+        mine = programs[index * args.requests * args.batch:(index + 1) * args.requests * args.batch]
+        clients.append([mine[start:start + args.batch] for start in range(0, len(mine), args.batch)])
+    latencies, statuses = [], Counter()
+    start = time.perf_counter()
+    await asyncio.gather(*(client(path, batches, options, latencies, statuses) for batches in clients))
+    return time.perf_counter() - start, latencies, statuses
+
+async def run(args):
+    if args.socket:
+        return await load_test(args.socket, args)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'exec.sock')
+        ready = asyncio.Event()
+        server = asyncio.ensure_future(ExecutionServer.serve(path, args.workers, ready=ready))
+        waiter = asyncio.ensure_future(ready.wait())
+        await asyncio.wait({server, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        if server.done():
+            waiter.cancel()
+            server.result()
+        try:
+            return await load_test(path, args)
+        finally:
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+
+def cold_start(count):
+    """ Seconds per program for one InstructionSimulator process each. """
+    simulator = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'InstructionSimulator.py')
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index, program in enumerate(make_programs(count)):
+            if isinstance(program, str):
+                path, text = os.path.join(directory, f'{index}.txt'), program
+            else:
+                path = os.path.join(directory, f'{index}.hex')
+                text = AssemblyTranslator.format_words(program['words'], 'hex')
+            with open(path, 'w') as outfile:
+                outfile.write(text)
+            paths.append(path)
+        start = time.perf_counter()
+        for path in paths:
+            subprocess.run([sys.executable, simulator, path, '--max-instructions', str(MAX_INSTRUCTIONS)],
+                           check=True, stdout=subprocess.DEVNULL)
+        return (time.perf_counter() - start) / count
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the execution server")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent connections")
+    parser.add_argument('--requests', type=int, default=50, help="requests per client")
+    parser.add_argument('--batch', type=int, default=16, help="programs per request")
+    parser.add_argument('--workers', '-j', type=int, default=os.cpu_count() or 1,
+                        help="model workers of the in-process server")
+    parser.add_argument('--socket', default=None, help="existing server to load instead of an in-process one")
+    parser.add_argument('--backend', choices=('model', 'rtl'), default='model')
+    parser.add_argument('--timeout', type=float, default=ExecutionServer.DEFAULT_TIMEOUT, help="per-request timeout")
+    parser.add_argument('--cold', type=int, default=20, help="programs run as cold processes (0: skip)")
+    args = parser.parse_args()
+
+    elapsed, latencies, statuses = asyncio.run(run(args))
+    programs = sum(statuses.values())
+    print(f"{args.clients} clients x {args.requests} requests x {args.batch} programs, backend {args.backend}")
+    print(f"  Requests/s      : {len(latencies) / elapsed:10,.1f}")
+    print(f"  Programs/s      : {programs / elapsed:10,.1f}")
+    print(f"  Latency p50     : {percentile(latencies, 0.50) * 1e3:10.2f} ms")
+    print(f"  Latency p99     : {percentile(latencies, 0.99) * 1e3:10.2f} ms")
+    print(f"  Latency max     : {max(latencies) * 1e3:10.2f} ms")
+    print("  Statuses        : " + ', '.join(f"{status} {count}" for status, count in statuses.most_common()))
+    if args.cold:
+        per_program = cold_start(args.cold)
+        print(f"  Cold process    : {1 / per_program:10,.1f} programs/s ({per_program * 1e3:.1f} ms each)")
+        print(f"  Speedup         : {programs / elapsed * per_program:.1f}x")
+
+if __name__ == "__main__":
+    main()
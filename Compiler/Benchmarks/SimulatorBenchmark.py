@@ -0,0 +1,63 @@
+"""
+Benchmark of the instruction simulator on tight loops, with and without
+the basic-block translation cache, and with a profile attached.
+
+Usage: python Compiler/Benchmarks/SimulatorBenchmark.py [instruction_count]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import InstructionSimulator
+import Profiler
+
+PROGRAMS = {
+    # Count R4 down from 255, forever: addi/cmp/brnz loop
+    'countdown': [
+        0x68FF,  # LOADI R4, 255
+        0x18FF,  # ADDI R4, -1
+        0xF800,  # CMP R4, R0
+        0xBFFE,  # BRNZ -2
+        0x9FFC,  # JMP -4
+    ],
+    # Fibonacci in R1/R2 with a memory round trip, forever
+    'fibonacci': [
+        0x6200,  # LOADI R1, 0
+        0x6401,  # LOADI R2, 1
+        0x0650,  # ADD R3, R1, R2
+        0x0210,  # ADD R1, R0, R2
+        0x04D8,  # ADD R2, R3, R3  (keeps values moving)
+        0x8601,  # STORE R3, [R0+1]
+        0x7A01,  # LOAD R5, [R0+1]
+        0xFA00,  # CMP R5, R0
+        0xBFFA,  # BRNZ -6
+        0x9FF7,  # JMP -9
+    ],
+}
+
+def measure(program, instruction_count, jit, profile=False):
+    simulator = InstructionSimulator.Simulator(program, jit=jit)
+    if profile:
+        simulator.attach_profile(Profiler.Profile(simulator))
+    start = time.perf_counter()
+    executed = simulator.run(instruction_count)
+    return executed / (time.perf_counter() - start), simulator
+
+def main():
+    instruction_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    InstructionSimulator.decode_table()
+    for name, program in PROGRAMS.items():
+        interpreted, reference = measure(program, instruction_count, jit=False)
+        compiled, simulator = measure(program, instruction_count, jit=True)
+        profiled, _ = measure(program, instruction_count, jit=True, profile=True)
+        assert (simulator.pc, simulator.flags, simulator.registers[:8], simulator.memory) == \
+            (reference.pc, reference.flags, reference.registers[:8], reference.memory), f"{name}: states differ"
+        print(f"{name:12s}: {interpreted:14,.0f} instr/s interpreted, "
+              f"{compiled:14,.0f} instr/s with blocks ({compiled / interpreted:.1f}x), "
+              f"{profiled:14,.0f} instr/s profiled")
+
+if __name__ == "__main__":
+    main()
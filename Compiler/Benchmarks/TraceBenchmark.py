@@ -0,0 +1,69 @@
+"""
+Benchmark of the binary execution-trace format: per-record appends from
+the simulator loop, bulk writes, then a memory-mapped diff of two traces
+that differ in their last record.
+
+Usage: python Compiler/Benchmarks/TraceBenchmark.py [record_count]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ExecutionTrace
+import InstructionSimulator
+from SimulatorBenchmark import PROGRAMS
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def synthetic_records(count, seed=0):
+    """ Random records with increasing cycles, as a long run would produce. """
+    rng = np.random.default_rng(seed)
+    records = np.zeros(count, dtype=ExecutionTrace.RECORD_DTYPE)
+    records['cycle'] = np.arange(2, count + 2, dtype=np.uint64) * 83 - 2
+    for name in ExecutionTrace.RECORD_DTYPE.names[1:]:
+        records[name] = rng.integers(0, 256, count, dtype=np.uint8)
+    return records
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000000
+    with tempfile.TemporaryDirectory() as directory:
+        path_a = os.path.join(directory, 'a.trace')
+        path_b = os.path.join(directory, 'b.trace')
+
+        simulator = InstructionSimulator.Simulator(PROGRAMS['fibonacci'], jit=False)
+        with ExecutionTrace.TraceWriter(path_a) as writer:
+            executed, elapsed = timed(ExecutionTrace.run_traced, simulator, writer, 500000)
+        print(f"Simulator + trace : {executed / elapsed:12,.0f} records/s")
+
+        records = synthetic_records(count)
+        for path in (path_a, path_b):
+            with ExecutionTrace.TraceWriter(path) as writer:
+                _, elapsed = timed(writer.write_records, records)
+        size = os.path.getsize(path_a)
+        print(f"Bulk write        : {count / elapsed:12,.0f} records/s ({size / 1e6:,.0f} MB, "
+              f"{ExecutionTrace.RECORD_DTYPE.itemsize} bytes/record)")
+
+        trace_b = ExecutionTrace.read_trace(path_b, 'r+')
+        trace_b['value'][-1] ^= 1
+        trace_b.flush()
+        del trace_b
+
+        (trace_a, trace_b), elapsed = timed(lambda: (ExecutionTrace.read_trace(path_a),
+                                                     ExecutionTrace.read_trace(path_b)))
+        print(f"Open (memmap)     : {elapsed * 1000:12.2f} ms")
+        result, elapsed = timed(ExecutionTrace.diff, trace_a, trace_b)
+        assert result == (count - 1, ['value']), result
+        print(f"Diff              : {count / elapsed:12,.0f} records/s ({elapsed:.2f} s, "
+              f"{2 * size / elapsed / 1e9:.2f} GB/s), mismatch at record {result[0]:,}")
+
+if __name__ == "__main__":
+    main()
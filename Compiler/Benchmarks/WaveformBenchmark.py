@@ -0,0 +1,97 @@
+"""
+Benchmark of the indexed waveform reader on a synthetic CPU dump: one
+first-pass indexing, one reopen from the sidecar index, then value,
+edge and trace queries.
+
+Usage: python Compiler/Benchmarks/WaveformBenchmark.py [size_mb]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import WaveformReader
+
+HEADER = """$timescale 1ps $end
+$scope module tb $end
+$var reg 1 ! clk $end
+$scope module user_project $end
+$var wire 1 " mem_ready $end
+$var wire 10 # pc_current [9:0] $end
+$var wire 16 $ instruction [15:0] $end
+$var wire 1 % spi_sck $end
+$var wire 1 & spi_cs $end
+$upscope $end
+$upscope $end
+$enddefinitions $end
+"""
+
+HALF_PERIOD = 10000
+FETCH_PERIOD = 83
+
+def write_dump(path, size):
+    """ Writes a dump of about size bytes where the CPU fetches PC 0, 1, 2... every 83 cycles. """
+    with open(path, 'w') as outfile:
+        outfile.write(HEADER)
+        outfile.write("$dumpvars\n0!\n0\"\nb0 #\nb0 $\n0%\n1&\n$end\n")
+        cycle = 0
+        pc = 0
+        while outfile.tell() < size:
+            lines = []
+            for phase in range(FETCH_PERIOD):
+                now = cycle * 2 * HALF_PERIOD
+                lines.append(f"#{now}\n1!\n")
+                if phase == 0:
+                    lines.append("0&\n")
+                elif phase < 81:
+                    lines.append(f"{phase & 1}%\n")
+                if phase == 80:
+                    lines.append(f"1\"\n1&\nb{(0x6000 | pc & 0xFFF):b} $\n")
+                elif phase == 81:
+                    lines.append("0\"\n")
+                elif phase == 82:
+                    pc = (pc + 1) & 0x3FF
+                    lines.append(f"b{pc:b} #\n")
+                lines.append(f"#{now + HALF_PERIOD}\n0!\n")
+                cycle += 1
+            outfile.write(''.join(lines))
+    return cycle
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cpu.vcd')
+        cycles, elapsed = timed(write_dump, path, int(size_mb * 1e6))
+        size = os.path.getsize(path)
+        print(f"Dump: {size / 1e6:.0f} MB, {cycles:,} cycles (written in {elapsed / 1000:.1f} s)")
+
+        waveform, elapsed = timed(WaveformReader.Waveform, path)
+        print(f"First pass (index build): {elapsed / 1000:.2f} s, {size / 1e6 / (elapsed / 1000):.0f} MB/s")
+        waveform.close()
+        waveform, elapsed = timed(WaveformReader.Waveform, path)
+        print(f"Reopen from index        : {elapsed:.1f} ms "
+              f"({os.path.getsize(path + WaveformReader.INDEX_SUFFIX) / 1e3:.0f} kB index)")
+
+        end = (cycles - 1) * 2 * HALF_PERIOD
+        with waveform:
+            for when in (0, end // 3, end // 2, end - 1):
+                value, elapsed = timed(waveform.value_at, 'user_project.pc_current', when)
+                print(f"pc_current @ {when:>14,}: {WaveformReader.to_int(value):>4}  {elapsed:6.2f} ms")
+            window = (end // 2, end // 2 + 100 * FETCH_PERIOD * 2 * HALF_PERIOD)
+            edges, elapsed = timed(waveform.edges, 'spi_cs', *window)
+            print(f"spi_cs edges in a 100-fetch window: {len(edges)} in {elapsed:.2f} ms")
+            trace, elapsed = timed(waveform.retired_instructions, None, *window)
+            print(f"Retired trace in the same window  : {len(trace)} instructions in {elapsed:.2f} ms")
+            edges, elapsed = timed(waveform.edges, 'mem_ready')
+            print(f"All mem_ready edges               : {len(edges):,} in {elapsed:.0f} ms")
+
+if __name__ == "__main__":
+    main()
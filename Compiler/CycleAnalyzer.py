@@ -0,0 +1,274 @@
+"""
+Static cycle and fetch-cost analysis of assembled programs.
+
+Every instruction costs one ProgramMemory_SPI_RAM read (CMD, ADDR and DATA
+shifted out two edges per bit), the single-cycle execute of tt_um_cpu and
+the PC update (see FetchTiming). The analyzer splits a program into basic
+blocks, finds loops from their back edges and, where a loop is controlled
+by a counter set with 'loadi' and stepped with 'addi', infers its trip
+count. Blocks are then weighted by the trip counts of the loops around
+them to rank hot spots and estimate the run time without simulating.
+
+Usage: python Compiler/CycleAnalyzer.py [--budget-us N] source.txt...
+"""
+
+import argparse
+import os
+import sys
+from collections import namedtuple
+
+import AssemblyTranslator
+import FetchTiming
+from AssemblyTranslator import (
+    BRANCH_OPS, OFFSET_OPERAND, PC_MASK, SHIFT_OPERAND, branch_targets, find_leaders, instruction_effects,
+    op_codes, op_operands,
+)
+from Disassembler import format_shift
+from InstructionSimulator import BRANCH_CONDITIONS, FLAG_S, FLAG_Z
+
+CMD_CYCLES = FetchTiming.CMD_BITS * FetchTiming.EDGES_PER_BIT
+ADDR_CYCLES = FetchTiming.ADDR_BITS * FetchTiming.EDGES_PER_BIT
+DATA_CYCLES = FetchTiming.DATA_BITS * FetchTiming.EDGES_PER_BIT
+EXECUTE_CYCLES = FetchTiming.FETCH_LATENCY - FetchTiming.SPI_CYCLES
+INSTRUCTION_CYCLES = FetchTiming.FETCH_PERIOD
+
+# Weight given to loops whose trip count cannot be inferred
+DEFAULT_TRIP_COUNT = 10
+# An 8-bit counter that has not reached its exit value after this many
+# steps never will
+MAX_TRIP_COUNT = 256
+HOT_SPOTS = 5
+
+Block = namedtuple('Block', ['start', 'end', 'cycles', 'weight'])
+# head..tail inclusive; trips is None when unknown, counter describes how it was inferred
+Loop = namedtuple('Loop', ['head', 'tail', 'trips', 'counter', 'depth'])
+Analysis = namedtuple('Analysis', ['blocks', 'loops', 'cycles', 'weighted_cycles'])
+
+def _counter_init(instructions, leaders, head, register):
+    """
+    Constant loaded into register on the straight-line path that falls
+    into the loop head, or None.
+    """
+    if register == 0:
+        return 0
+    index = head - 1
+    while index >= 0 and instructions[index][0] not in BRANCH_OPS:
+        op_code, operands = instructions[index][0], instructions[index][1]
+        if instruction_effects(instructions[index])[1] == register:
+            return operands[1] if op_code == 'loadi' else None
+        if index in leaders:
+            break
+        index -= 1
+    return None
+
+def infer_trip_count(instructions, targets, leaders, head, tail):
+    """
+    Number of times the loop head..tail runs, for counter loops.
+
+    The loop must be controlled by a single conditional branch: the back
+    edge at tail (the loop continues when it is taken) or an exit to past
+    the tail (it continues when it is not). Its flags must come from
+    'addi Rc, step' or 'cmp Rc, Rx', where Rc is written only by that addi
+    inside the loop, Rx not at all, and both start from a constant.
+
+    :return: (trips, description) or (None, reason).
+    """
+    # Only the fall-through and branches from inside the loop may enter it
+    for index, target in enumerate(targets):
+        if target == head and not head <= index <= tail:
+            return None, "entered from outside"
+    if instructions[tail][0] != 'jmp':
+        branch, continue_if_taken = tail, True
+    else:
+        exits = [index for index in range(head, tail)
+                 if targets[index] is not None and instructions[index][0] != 'jmp' and targets[index] > tail]
+        if len(exits) != 1:
+            return None, "no single exit branch"
+        branch, continue_if_taken = exits[0], False
+
+    setter = branch - 1
+    while setter >= head and not instruction_effects(instructions[setter])[2]:
+        setter -= 1
+    if setter < head:
+        return None, "flags set outside the loop"
+    op_code, operands = instructions[setter][0], instructions[setter][1]
+    if op_code not in ('addi', 'cmp'):
+        return None, f"flags from '{op_code}'"
+    register = operands[0]
+    limit_register = operands[1] if op_code == 'cmp' else None
+
+    writes = [index for index in range(head, tail + 1) if instruction_effects(instructions[index])[1] == register]
+    if len(writes) != 1 or instructions[writes[0]][0] != 'addi':
+        return None, f"R{register} is not a counter"
+    step_index = writes[0]
+    step = instructions[step_index][1][1]
+    if limit_register is not None and limit_register != 0 and any(
+            instruction_effects(instructions[index])[1] == limit_register for index in range(head, tail + 1)):
+        return None, f"R{limit_register} changes in the loop"
+
+    value = _counter_init(instructions, leaders, head, register)
+    limit = 0 if limit_register is None else _counter_init(instructions, leaders, head, limit_register)
+    if value is None or limit is None:
+        return None, "counter not initialized by loadi"
+
+    mask, expected = BRANCH_CONDITIONS[int(op_codes[instructions[branch][0]], 2)]
+    start = value
+    checked_before_step = setter < step_index
+    for trips in range(1, MAX_TRIP_COUNT + 1):
+        if checked_before_step:
+            result = (value - limit) & 0xFF
+            value = (value + step) & 0xFF
+        else:
+            value = (value + step) & 0xFF
+            result = (value - limit) & 0xFF
+        flags = (FLAG_Z if result == 0 else 0) | (FLAG_S if result & 0x80 else 0)
+        if (flags & mask == expected) != continue_if_taken:
+            return trips, f"R{register} from {start} step {step - 256 if step > 127 else step}"
+    return None, "counter never exits"
+
+def find_loops(instructions, targets, leaders):
+    """ Loops from back edges, outermost first, with their nesting depth and trip count. """
+    spans = {}
+    for index, target in enumerate(targets):
+        # A branch to itself halts the CPU rather than looping
+        if target is not None and target < index:
+            spans[target] = max(spans.get(target, index), index)
+    loops = []
+    for head, tail in sorted(spans.items(), key=lambda span: (span[0], -span[1])):
+        depth = sum(1 for loop in loops if loop.head <= head and tail <= loop.tail)
+        trips, counter = infer_trip_count(instructions, targets, leaders, head, tail)
+        loops.append(Loop(head, tail, trips, counter, depth))
+    return loops
+
+def analyze(instructions):
+    """
+    Splits a program into weighted basic blocks.
+
+    A block's weight is the product of the trip counts of the loops that
+    contain it (DEFAULT_TRIP_COUNT when unknown), so weighted_cycles
+    assumes every block of a loop body runs on every iteration.
+    """
+    targets = branch_targets(instructions)
+    leaders = find_leaders(instructions, targets)
+    loops = find_loops(instructions, targets, leaders)
+    starts = sorted(leader for leader in leaders if leader < len(instructions))
+    blocks = []
+    for start, end in zip(starts, starts[1:] + [len(instructions)]):
+        weight = 1
+        for loop in loops:
+            if loop.head <= start <= loop.tail:
+                weight *= loop.trips if loop.trips is not None else DEFAULT_TRIP_COUNT
+        blocks.append(Block(start, end, (end - start) * INSTRUCTION_CYCLES, weight))
+    cycles = len(instructions) * INSTRUCTION_CYCLES
+    weighted = sum(block.cycles * block.weight for block in blocks)
+    return Analysis(blocks, loops, cycles, weighted)
+
+def format_instruction(instruction, address):
+    """ Canonical text of an instruction; branches show their signed offset and target. """
+    op_code, operands = instruction[0], instruction[1]
+    texts = []
+    for operand_type, value in zip(op_operands[op_code], operands):
+        if operand_type == 'R':
+            texts.append(f"R{value}")
+        elif operand_type == OFFSET_OPERAND:
+            offset = value & PC_MASK
+            offset -= (PC_MASK + 1) if offset > PC_MASK >> 1 else 0
+            texts.append(f"{offset:+d} -> {(address + offset) & PC_MASK:03X}")
+        elif operand_type == SHIFT_OPERAND:
+            texts.append(format_shift(value))
+        else:
+            texts.append(str(value))
+    return f"{op_code} {', '.join(texts)}"
+
+def format_listing(name, instructions, words, analysis, clock_hz=None, budget_us=None):
+    """ Annotated listing: every instruction with its cycles, per block and per loop. """
+    clock_hz = clock_hz or FetchTiming.read_clock_hz()
+    lines = [
+        f"; {name}: static fetch-cost listing",
+        f"; {INSTRUCTION_CYCLES} cycles per instruction = SPI CMD {CMD_CYCLES} + ADDR {ADDR_CYCLES} "
+        f"+ DATA {DATA_CYCLES}, execute {EXECUTE_CYCLES}, PC update {FetchTiming.PC_UPDATE_CYCLES}",
+        ";",
+    ]
+    loop_heads = {loop.head: loop for loop in analysis.loops}
+    loop_tails = {}
+    for loop in analysis.loops:
+        loop_tails.setdefault(loop.tail, []).append(loop)
+    for number, block in enumerate(analysis.blocks):
+        lines.append(f"; B{number} [{block.start:03X}-{block.end - 1:03X}] {block.end - block.start} instr, "
+                     f"{block.cycles:,} cycles x{block.weight:,} = {block.cycles * block.weight:,}")
+        for address in range(block.start, block.end):
+            loop = loop_heads.get(address)
+            if loop is not None:
+                trips = f"{loop.trips} trips" if loop.trips is not None else \
+                    f"? trips (assumed {DEFAULT_TRIP_COUNT})"
+                lines.append(f";   {'  ' * loop.depth}loop [{loop.head:03X}-{loop.tail:03X}] {trips}: {loop.counter}")
+            instruction = instructions[address]
+            lines.append(f"  {address:03X}  {words[address]:04X}  {INSTRUCTION_CYCLES:>4}  "
+                         f"{INSTRUCTION_CYCLES * block.weight:>9,}  "
+                         f"{format_instruction(instruction, address):<28} ; line {instruction[2]}")
+            for loop in loop_tails.get(address, ()):
+                lines.append(f";   {'  ' * loop.depth}end of loop [{loop.head:03X}-{loop.tail:03X}]")
+
+    seconds = analysis.weighted_cycles / clock_hz
+    lines += [
+        ";",
+        f"; Straight line : {len(instructions)} instructions, {analysis.cycles:,} cycles",
+        f"; Loop-weighted : {analysis.weighted_cycles:,} cycles, {seconds * 1e6:,.2f} us at {clock_hz / 1e6:g} MHz",
+    ]
+    if budget_us is not None:
+        verdict = "OVER BUDGET" if seconds * 1e6 > budget_us else "within budget"
+        lines.append(f"; Budget        : {budget_us:g} us, {verdict}")
+    hot = sorted(enumerate(analysis.blocks), key=lambda item: item[1].cycles * item[1].weight, reverse=True)
+    lines.append("; Hot spots     :")
+    for number, block in hot[:HOT_SPOTS]:
+        share = block.cycles * block.weight / analysis.weighted_cycles if analysis.weighted_cycles else 0
+        lines.append(f";   B{number} [{block.start:03X}-{block.end - 1:03X}] "
+                     f"{block.cycles * block.weight:>12,} cycles {100 * share:5.1f}%")
+    return '\n'.join(lines) + '\n'
+
+def listing_for_source(name, source_code, optimize=False, clock_hz=None, budget_us=None):
+    """
+    Assembles source_code and returns (listing, analysis), or (None, None)
+    if it has errors.
+    """
+    instructions, ok = AssemblyTranslator.parse_code(source_code)
+    if not ok:
+        return None, None
+    if optimize:
+        instructions = AssemblyTranslator.optimize_instructions(instructions)[0]
+    words = [AssemblyTranslator.encode_instruction(instruction) for instruction in instructions]
+    analysis = analyze(instructions)
+    return format_listing(name, instructions, words, analysis, clock_hz, budget_us), analysis
+
+def main():
+    parser = argparse.ArgumentParser(description="Static fetch-cost listing of assembly sources")
+    parser.add_argument('sources', nargs='+', help=".txt source files")
+    parser.add_argument('--optimize', '-O', action='store_true', help="analyze the peephole-optimized program")
+    parser.add_argument('--clock-hz', type=int, default=None, help="clock (default: info.yaml)")
+    parser.add_argument('--budget-us', type=float, default=None,
+                        help="flag programs whose loop-weighted estimate exceeds this time")
+    parser.add_argument('--output-dir', default=None, help="write NAME.lst files instead of printing")
+    args = parser.parse_args()
+
+    clock_hz = args.clock_hz or FetchTiming.read_clock_hz()
+    status = 0
+    for path in args.sources:
+        with open(path, 'r') as infile:
+            source_code = infile.read()
+        name = os.path.basename(path)
+        listing, analysis = listing_for_source(name, source_code, args.optimize, clock_hz, args.budget_us)
+        if listing is None:
+            status = 1
+            continue
+        if args.output_dir:
+            with open(os.path.join(args.output_dir, os.path.splitext(name)[0] + '.lst'), 'w') as outfile:
+                outfile.write(listing)
+        else:
+            print(listing)
+        if args.budget_us is not None and analysis.weighted_cycles / clock_hz * 1e6 > args.budget_us:
+            print(f"{name}: over the {args.budget_us:g} us budget")
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
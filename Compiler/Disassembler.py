@@ -0,0 +1,198 @@
+"""
+Table-driven disassembler for the custom instruction set.
+
+Every one of the 65536 machine words is decoded once, with the field layout
+of src/ControlUnit.v (the one AssemblyTranslator encodes), into two tables:
+    text    the instruction the hardware executes, don't-care bits dropped
+    exact   the same text when AssemblyTranslator encodes it back to the
+            very same word, '.word 0x....' otherwise
+so disassemble_program() output always assembles back byte for byte.
+Both are also kept as NumPy arrays, next to a table of the decoded
+fields, so that disassemble_array() and decode_array() annotate millions
+of fetched words (traces, VCD dumps) with a single indexing operation.
+
+Usage: python Compiler/Disassembler.py program.hex|program.asm [--no-labels]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from AssemblyTranslator import (
+    ENCODER_TABLE, OFFSET_MASK, OFFSET_OPERAND, PC_MASK, SHIFT_IMMEDIATE, SHIFT_OPERAND, WORD_DIRECTIVE,
+    encode_instruction, op_codes, op_operands,
+)
+
+MNEMONICS = tuple(sorted(op_codes, key=lambda op_code: int(op_codes[op_code], 2)))
+BRANCH_OPCODES = tuple(int(op_codes[op_code], 2) for op_code in ('jmp', 'brz', 'brnz', 'brnn'))
+
+_OFFSET_SIGN = 1 << 9
+
+# Per-word fields of decode_array(); imm is the 8-bit immediate of
+# addi/loadi, the 4-bit offset of load/store or the immediate shift
+# amount, offset the sign-extended 10-bit branch offset
+FIELDS_DTYPE = np.dtype([
+    ('opcode', 'u1'),
+    ('rd', 'u1'),          # [11:9]
+    ('rs1', 'u1'),         # [8:6]
+    ('rs2', 'u1'),         # [5:3]
+    ('imm', 'u1'),
+    ('offset', '<i2'),
+    ('canonical', '?'),    # no don't-care bit set
+])
+
+def branch_offset(word):
+    """ Signed branch offset, from the 10 bits ControlUnit decodes. """
+    return ((word & PC_MASK) ^ _OFFSET_SIGN) - _OFFSET_SIGN
+
+def format_shift(value):
+    """ Text of a 6-bit shift amount field: 'R0'-'R3' or the immediate. """
+    if value & SHIFT_IMMEDIATE:
+        return str(value >> 1 & 0xF)
+    return f"R{value >> 3 & 3}"
+
+def decode_operands(word):
+    """
+    Fields of a word as the hardware decodes them.
+
+    :return: (op_code, operand values), the values being what
+             AssemblyTranslator.parse_line produces for the canonical text.
+    """
+    op_code = MNEMONICS[word >> 12]
+    values = []
+    for operand_type, (_, max_value, shift) in zip(op_operands[op_code], ENCODER_TABLE[op_code][1]):
+        value = word >> shift & max_value
+        if operand_type == SHIFT_OPERAND:
+            value &= 0x3E if value & SHIFT_IMMEDIATE else 0x18
+        elif operand_type == OFFSET_OPERAND:
+            # Bits [11:10] are not decoded: canonical offsets sign-extend bit 9
+            value = branch_offset(word) & OFFSET_MASK
+        values.append(value)
+    return op_code, tuple(values)
+
+def format_instruction(op_code, values):
+    texts = []
+    for operand_type, value in zip(op_operands[op_code], values):
+        if operand_type == 'R':
+            texts.append(f"R{value}")
+        elif operand_type == OFFSET_OPERAND:
+            texts.append(str(branch_offset(value)))
+        elif operand_type == SHIFT_OPERAND:
+            texts.append(format_shift(value))
+        else:
+            texts.append(str(value))
+    return f"{op_code} {', '.join(texts)}"
+
+_tables = None
+
+def tables():
+    """ Returns the (text, exact, canonical) lists over all 65536 words, built on first use. """
+    global _tables
+    if _tables is None:
+        text, exact, canonical = [], [], []
+        for word in range(1 << 16):
+            op_code, values = decode_operands(word)
+            line = format_instruction(op_code, values)
+            same = encode_instruction((op_code, values, 0)) == word
+            text.append(line)
+            exact.append(line if same else f"{WORD_DIRECTIVE} 0x{word:04X}")
+            canonical.append(same)
+        _tables = text, exact, canonical
+    return _tables
+
+def _decode_fields(words, canonical):
+    opcode = (words >> 12).astype(np.uint8)
+    fields = np.empty(words.shape, dtype=FIELDS_DTYPE)
+    fields['opcode'] = opcode
+    fields['rd'] = words >> 9 & 7
+    fields['rs1'] = words >> 6 & 7
+    fields['rs2'] = words >> 3 & 7
+    imm = np.where(np.isin(opcode, (1, 6)), words & 0xFF, words & 0xF)
+    shifts = np.isin(opcode, (13, 14))
+    imm = np.where(shifts, np.where(words & SHIFT_IMMEDIATE, words >> 1 & 0xF, 0), imm)
+    fields['imm'] = np.where(np.isin(opcode, (1, 6, 7, 8)) | shifts, imm, 0)
+    fields['offset'] = np.where(np.isin(opcode, BRANCH_OPCODES), branch_offset(words.astype(np.int16)), 0)
+    fields['canonical'] = canonical
+    return fields
+
+_arrays = None
+
+def arrays():
+    """ NumPy tables over all 65536 words, built on first use: (text, exact, FIELDS_DTYPE fields). """
+    global _arrays
+    if _arrays is None:
+        text, exact, canonical = tables()
+        fields = _decode_fields(np.arange(1 << 16, dtype=np.uint16), np.array(canonical, dtype=bool))
+        _arrays = np.array(text), np.array(exact), fields
+    return _arrays
+
+def disassemble(word, exact=False):
+    """
+    Text of one machine word.
+
+    :param exact: Emit '.word' for words with don't-care bits set, so that
+                  the text assembles back to the same word.
+    """
+    return tables()[1 if exact else 0][word]
+
+def disassemble_array(words, exact=False):
+    """ Vectorized disassemble(): an array of instruction texts, shaped like words. """
+    return arrays()[1 if exact else 0][np.asarray(words, dtype=np.uint16)]
+
+def decode_array(words):
+    """ Vectorized field extraction: a FIELDS_DTYPE array shaped like words. """
+    return arrays()[2][np.asarray(words, dtype=np.uint16)]
+
+def disassemble_program(words, labels=True, addresses=True):
+    """
+    Source text of a whole program that assembles back to the same words.
+
+    :param labels: Turn branches whose target lies inside the program into
+                   'Lxxx' labels, xxx being the hexadecimal address.
+    :param addresses: Comment every line with its address and word.
+    """
+    text, exact, canonical = tables()
+    size = len(words)
+    targets = {}
+    if labels:
+        for pc, word in enumerate(words):
+            if word >> 12 in BRANCH_OPCODES and canonical[word]:
+                target = pc + branch_offset(word)
+                if 0 <= target < size:
+                    targets[pc] = target
+    label_names = {target: f"L{target:03X}" for target in targets.values()}
+    lines = []
+    for pc, word in enumerate(words):
+        if pc in label_names:
+            lines.append(f"{label_names[pc]}:")
+        if pc in targets:
+            line = f"{MNEMONICS[word >> 12]} {label_names[targets[pc]]}"
+        else:
+            line = exact[word]
+        comment = []
+        if addresses:
+            comment.append(f"{pc:03X} {word:04X}")
+        if not canonical[word]:
+            comment.append(text[word])
+        if comment:
+            line = f"{line:<24} # {' '.join(comment)}"
+        lines.append(f"    {line}")
+    return '\n'.join(lines) + '\n'
+
+def main():
+    import InstructionSimulator
+
+    parser = argparse.ArgumentParser(description="Disassembles a program back to source")
+    parser.add_argument('program', help=".hex, .asm or .txt")
+    parser.add_argument('--no-labels', action='store_true', help="keep branch offsets numeric")
+    parser.add_argument('--no-addresses', action='store_true', help="do not comment lines with addresses")
+    args = parser.parse_args()
+    words = InstructionSimulator.read_program(args.program)
+    if words is None:
+        return 1
+    sys.stdout.write(disassemble_program(words, labels=not args.no_labels, addresses=not args.no_addresses))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,556 @@
+"""
+Local program-execution service backed by a pool of warm workers.
+
+Test generators and notebooks that run thousands of short programs pay for
+each one the interpreter start, the imports and the decode tables of the
+simulator. This server keeps worker processes that paid for all of that
+once and hands them programs through a Unix socket.
+
+Protocol: newline-delimited JSON on the server socket. A request is
+
+    {"id": 7, "programs": [...], "backend": "model", "max_instructions": 100000,
+     "max_cycles": 200000, "timeout": 10.0}
+
+where every program is assembly source (a string or {"source": ...}),
+machine words ({"words": [25098, ...]}) or a $readmemh image
+({"hex": "620A 6414 ..."}); only "programs" is required. The server
+streams back one line per program, in completion order:
+
+    {"id": 7, "index": 0, "status": "halted", "pc": 9, "registers": [...],
+     "flags": 1, "memory": [...], "instructions": 9, "fetches": 10,
+     "cycles": 828, "seconds": 0.0001}
+
+status is halted, stopped (max_instructions reached in the model,
+max_cycles on the RTL), timeout or error (with a "message"); the RTL
+reports halted as soon as the CPU settles, the way the cocotb tests stop
+(see run_until_settled in test/test.py). The last line of a request is
+{"id": 7, "done": true, "programs": n}. A malformed request gets
+{"id": 7, "error": "..."} and the connection stays open.
+
+Backends:
+    model  InstructionSimulator, cycles from the SPI model of FetchTiming
+    rtl    the testbench of test/ in a simulator that stays up between
+           programs (test/exec_worker.py), cycles measured on the RTL
+
+Backpressure: programs wait in a bounded queue per backend, and a
+connection has at most --max-in-flight programs queued or running. While
+either is full, or while the client does not read its results, the server
+stops reading that connection, so a client that submits faster than the
+workers run blocks in its own writes.
+
+Timeouts: "timeout" is the time a request has from its arrival. Programs
+still queued at the deadline are not run, a model worker stops a program
+at the deadline by itself, and a worker that has not answered KILL_GRACE
+seconds after it is killed and replaced.
+
+Usage: python Compiler/ExecutionServer.py [--socket PATH] [--workers N] [--rtl-workers N] [--sim icarus|verilator]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import AssemblyTranslator
+import FetchTiming
+from InstructionSimulator import PROGRAM_SIZE, Simulator, decode_table
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'tiny-exec.sock')
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_INSTRUCTIONS = 1000000
+DEFAULT_MAX_CYCLES = 200000
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_MAX_IN_FLIGHT = 64
+# Time a worker gets past the deadline to answer before it is killed
+KILL_GRACE = 2.0
+# Time for a worker to connect back; an RTL worker may have to build the testbench first
+START_TIMEOUT = {'model': 30.0, 'rtl': 600.0}
+# Instructions run between two checks of the deadline
+DEADLINE_CHECK_INSTRUCTIONS = 20000
+# Longest JSON line: a batch of full 1024-word programs
+LINE_LIMIT = 64 * 1024 * 1024
+# Assembled sources kept per worker, generators often resubmit the same ones
+SOURCE_CACHE_SIZE = 1024
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test')
+
+class ExecutionError(Exception):
+    pass
+
+# ----------------------------------------------------------------------------
+# Worker side
+# ----------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=SOURCE_CACHE_SIZE)
+def assemble_source(source):
+    """ Assembles source code; the errors the assembler prints become the message. """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        words = AssemblyTranslator.assemble_code(source)
+    if words is None:
+        raise ExecutionError(output.getvalue().strip() or "assembly errors")
+    return tuple(words)
+
+def decode_program(program):
+    """
+    Machine words of a program as sent by a client: assembly source, or a
+    dict with one of 'source', 'words' or 'hex'.
+
+    :raises ExecutionError: If the program is malformed or does not assemble.
+    """
+    if isinstance(program, str):
+        return assemble_source(program)
+    if not isinstance(program, dict):
+        raise ExecutionError("a program is a source string or a {'source'|'words'|'hex': ...} object")
+    if 'source' in program:
+        if not isinstance(program['source'], str):
+            raise ExecutionError("'source' must be a string")
+        return assemble_source(program['source'])
+    if 'words' in program:
+        words = program['words']
+    elif 'hex' in program:
+        try:
+            words = [int(token, 16) for token in program['hex'].split() if not token.startswith('//')]
+        except (AttributeError, ValueError):
+            raise ExecutionError("'hex' must be hexadecimal words separated by white space") from None
+    else:
+        raise ExecutionError("a program object needs 'source', 'words' or 'hex'")
+    if not isinstance(words, list) or not all(isinstance(word, int) and 0 <= word <= 0xFFFF for word in words):
+        raise ExecutionError("words must be integers in 0..0xFFFF")
+    if len(words) > PROGRAM_SIZE:
+        raise ExecutionError(f"{len(words)} words exceed the {PROGRAM_SIZE}-word program memory")
+    return words
+
+def run_model(job, clock_hz):
+    """ Runs one job in the ISA model; see the module docstring for the result. """
+    start = time.perf_counter()
+    deadline = start + job['timeout']
+    # Compiling basic blocks costs more than interpreting a short program
+    simulator = Simulator(decode_program(job['program']), jit=False)
+    remaining = job['max_instructions']
+    timed_out = False
+    while remaining and not simulator.halted:
+        remaining -= simulator.run(min(remaining, DEADLINE_CHECK_INSTRUCTIONS))
+        simulator.jit = True
+        if time.perf_counter() > deadline:
+            timed_out = not simulator.halted
+            break
+    timing = FetchTiming.estimate(simulator, clock_hz)
+    return {
+        'status': 'halted' if simulator.halted else 'timeout' if timed_out else 'stopped',
+        'pc': simulator.pc,
+        'registers': simulator.get_registers(),
+        'flags': simulator.flags,
+        'memory': list(simulator.memory),
+        'instructions': simulator.executed,
+        'fetches': timing.fetches,
+        'cycles': timing.cycles,
+        'seconds': time.perf_counter() - start,
+    }
+
+def error_result(message):
+    return {'status': 'error', 'message': message}
+
+def connect_worker(socket_path, token):
+    """ Connects a worker to its pool; returns the file object of the connection. """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    stream = connection.makefile('rwb')
+    stream.write(json.dumps({'token': token}).encode() + b'\n')
+    stream.flush()
+    return stream
+
+def model_worker(socket_path, token):
+    """ Main loop of a model worker process: one job line in, one result line out. """
+    # Everything a job needs is imported and built before the first one
+    decode_table()
+    clock_hz = FetchTiming.read_clock_hz()
+    stream = connect_worker(socket_path, token)
+    for line in stream:
+        job = json.loads(line)
+        try:
+            result = run_model(job, clock_hz)
+        except ExecutionError as error:
+            result = error_result(str(error))
+        except Exception as error:
+            # A bad program must not cost a worker restart
+            result = error_result(f"{type(error).__name__}: {error}")
+        stream.write(json.dumps(result).encode() + b'\n')
+        stream.flush()
+
+# ----------------------------------------------------------------------------
+# Server side
+# ----------------------------------------------------------------------------
+
+def worker_command(backend, socket_path, token, simulator='icarus'):
+    if backend == 'model':
+        return [sys.executable, os.path.abspath(__file__), '--worker', socket_path, token]
+    return [sys.executable, os.path.join(TEST_DIR, 'exec_worker.py'),
+            '--sim', simulator, '--socket', socket_path, '--token', token]
+
+class Worker:
+    """ A worker process and its connection, which carries one job at a time. """
+
+    def __init__(self, process, reader, writer):
+        self.process = process
+        self.reader = reader
+        self.writer = writer
+
+    async def call(self, job, timeout):
+        """
+        :raises asyncio.TimeoutError: If the worker does not answer in time.
+        :raises ConnectionError: If the worker died.
+        """
+        self.writer.write(json.dumps(job).encode() + b'\n')
+        await self.writer.drain()
+        line = await asyncio.wait_for(self.reader.readline(), timeout)
+        if not line:
+            raise ConnectionError("worker closed its connection")
+        return json.loads(line)
+
+    def kill(self):
+        self.writer.close()
+        if self.process.returncode is None:
+            # The whole session: an RTL worker runs the simulator in a child process
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self.process.pid, signal.SIGKILL)
+
+class WorkerPool:
+    """
+    Worker processes of one backend. Workers connect back to a Unix
+    socket of their own, private to the pool, and introduce themselves
+    with the token they were started with.
+    """
+
+    def __init__(self, backend, size, simulator='icarus'):
+        self.backend = backend
+        self.size = size
+        self.simulator = simulator
+        self.idle = asyncio.Queue()
+        self.workers = set()
+        self.directory = None
+        self.path = None
+        self._server = None
+        self._connecting = {}
+        self._tokens = itertools.count()
+        self._replacements = set()
+
+    async def start(self):
+        self.directory = tempfile.mkdtemp(prefix=f'tiny-{self.backend}-')
+        self.path = os.path.join(self.directory, 'workers.sock')
+        self._server = await asyncio.start_unix_server(self._connected, path=self.path, limit=LINE_LIMIT)
+        workers = await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        for worker in workers:
+            self.idle.put_nowait(worker)
+
+    async def _connected(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+            future = self._connecting.pop(hello['token'])
+        except (ValueError, KeyError, TypeError):
+            writer.close()
+            return
+        if not future.done():
+            future.set_result((reader, writer))
+
+    async def _spawn(self):
+        token = f'{self.backend}-{next(self._tokens)}'
+        future = asyncio.get_running_loop().create_future()
+        self._connecting[token] = future
+        process = await asyncio.create_subprocess_exec(
+            *worker_command(self.backend, self.path, token, self.simulator),
+            stdin=asyncio.subprocess.DEVNULL, start_new_session=True)
+        exited = asyncio.ensure_future(process.wait())
+        try:
+            done, _ = await asyncio.wait({future, exited}, timeout=START_TIMEOUT[self.backend],
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            exited.cancel()
+            self._connecting.pop(token, None)
+        if future not in done:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+            reason = f"exited with {process.returncode}" if process.returncode is not None else "did not connect"
+            raise ExecutionError(f"{self.backend} worker {reason}")
+        worker = Worker(process, *future.result())
+        self.workers.add(worker)
+        return worker
+
+    def _replace(self, worker):
+        worker.kill()
+        self.workers.discard(worker)
+
+        async def replace():
+            try:
+                self.idle.put_nowait(await self._spawn())
+            except ExecutionError as error:
+                print(f"Error: {error}", file=sys.stderr)
+
+        task = asyncio.ensure_future(replace())
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    async def run(self, job, timeout):
+        """ Runs a job on the next idle worker; a worker that hangs or dies is replaced. """
+        worker = await self.idle.get()
+        try:
+            result = await worker.call(job, timeout + KILL_GRACE)
+        except asyncio.TimeoutError:
+            self._replace(worker)
+            return {'status': 'timeout'}
+        except (ConnectionError, ValueError):
+            self._replace(worker)
+            return error_result(f"{self.backend} worker died")
+        except BaseException:
+            # Cancelled mid-job: the worker may still answer, do not reuse it
+            self._replace(worker)
+            raise
+        self.idle.put_nowait(worker)
+        return result
+
+    async def close(self):
+        for task in list(self._replacements):
+            task.cancel()
+        for worker in self.workers:
+            worker.kill()
+        await asyncio.gather(*(worker.process.wait() for worker in self.workers))
+        self.workers.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class ExecutionServer:
+    """ Accepts client connections and feeds their programs to the worker pools. """
+
+    def __init__(self, pools, queue_size=DEFAULT_QUEUE_SIZE, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.pools = {pool.backend: pool for pool in pools}
+        self.queues = {backend: asyncio.Queue(queue_size) for backend in self.pools}
+        self.max_in_flight = max_in_flight
+        self._dispatchers = []
+        self._server = None
+
+    async def start(self, path):
+        for backend, pool in self.pools.items():
+            await pool.start()
+            # One dispatcher per worker: a job leaves the queue only when a worker can take it
+            self._dispatchers += [asyncio.ensure_future(self._dispatch(pool, self.queues[backend]))
+                                  for _ in range(pool.size)]
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._client, path=path, limit=LINE_LIMIT)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        for pool in self.pools.values():
+            await pool.close()
+
+    async def _dispatch(self, pool, queue):
+        while True:
+            # The job sent to the worker, the request deadline and the callback that gets the result
+            job, deadline, reply = await queue.get()
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                reply({'status': 'timeout'})
+                continue
+            job['timeout'] = timeout
+            reply(await pool.run(job, timeout))
+
+    def parse_request(self, request):
+        """
+        Validates a request.
+
+        :return: (programs, backend, job options)
+        :raises ExecutionError: If a field is missing or out of range.
+        """
+        if not isinstance(request, dict):
+            raise ExecutionError("a request is a JSON object")
+        programs = request.get('programs')
+        if not isinstance(programs, list):
+            raise ExecutionError("'programs' must be a list")
+        backend = request.get('backend', 'model')
+        if backend not in self.pools:
+            raise ExecutionError(f"backend '{backend}' is not running (available: {', '.join(self.pools)})")
+        options = {}
+        # Limits count instructions and cycles, only the timeout may be fractional
+        for key, default, types, kind in (
+                ('max_instructions', DEFAULT_MAX_INSTRUCTIONS, int, "integer"),
+                ('max_cycles', DEFAULT_MAX_CYCLES, int, "integer"),
+                ('timeout', DEFAULT_TIMEOUT, (int, float), "number")):
+            value = request.get(key, default)
+            if isinstance(value, bool) or not isinstance(value, types) or value <= 0:
+                raise ExecutionError(f"'{key}' must be a positive {kind}")
+            options[key] = value
+        return programs, backend, options
+
+    async def _client(self, reader, writer):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        def send(message):
+            if not writer.is_closing():
+                writer.write(json.dumps(message).encode() + b'\n')
+
+        try:
+            while True:
+                # Results the client has not read yet hold up its next requests
+                await writer.drain()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    send({'error': f"request longer than {LINE_LIMIT} bytes"})
+                    break
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    send({'id': None, 'error': f"invalid JSON: {error}"})
+                    continue
+                if isinstance(request, dict):
+                    request_id = request.get('id')
+                try:
+                    programs, backend, options = self.parse_request(request)
+                except ExecutionError as error:
+                    send({'id': request_id, 'error': str(error)})
+                    continue
+                await self._submit(request_id, programs, backend, options, in_flight, send, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _submit(self, request_id, programs, backend, options, in_flight, send, writer):
+        """ Queues the programs of a request, waiting whenever the client or the queue is full. """
+        deadline = time.monotonic() + options['timeout']
+        remaining = len(programs)
+        if not remaining:
+            send({'id': request_id, 'done': True, 'programs': 0})
+            return
+
+        def reply(index, result):
+            nonlocal remaining
+            in_flight.release()
+            result['id'] = request_id
+            result['index'] = index
+            send(result)
+            remaining -= 1
+            if not remaining:
+                send({'id': request_id, 'done': True, 'programs': len(programs)})
+
+        queue = self.queues[backend]
+        for index, program in enumerate(programs):
+            await in_flight.acquire()
+            await writer.drain()
+            job = dict(options, program=program)
+            await queue.put((job, deadline, functools.partial(reply, index)))
+
+async def serve(path, workers, rtl_workers=0, simulator='icarus', queue_size=DEFAULT_QUEUE_SIZE,
+                max_in_flight=DEFAULT_MAX_IN_FLIGHT, ready=None, stop=None):
+    """
+    Runs the server until cancelled, or until the stop event is set.
+
+    :param ready: Optional asyncio.Event set once the workers are up and the socket listens.
+    """
+    pools = [WorkerPool('model', workers)]
+    if rtl_workers:
+        pools.append(WorkerPool('rtl', rtl_workers, simulator))
+    server = ExecutionServer(pools, queue_size, max_in_flight)
+    try:
+        start = time.perf_counter()
+        await server.start(path)
+        print(f"Listening on {path}: " + ', '.join(f"{pool.size} {pool.backend} worker(s)" for pool in pools)
+              + f", started in {time.perf_counter() - start:.2f} s", flush=True)
+        if ready is not None:
+            ready.set()
+        await (stop or asyncio.Event()).wait()
+    finally:
+        await server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+# ----------------------------------------------------------------------------
+# Client
+# ----------------------------------------------------------------------------
+
+async def submit(path, programs, request_id=0, **options):
+    """
+    Sends one request and yields its results as they arrive.
+
+    :param options: backend, max_instructions, max_cycles, timeout.
+    :raises ExecutionError: If the server rejects the request.
+    """
+    reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+    try:
+        writer.write(json.dumps(dict(options, id=request_id, programs=list(programs))).encode() + b'\n')
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ExecutionError("server closed the connection")
+            message = json.loads(line)
+            if 'error' in message:
+                raise ExecutionError(message['error'])
+            if message.get('done'):
+                return
+            yield message
+    finally:
+        writer.close()
+
+def run_programs(programs, path=DEFAULT_SOCKET, **options):
+    """ Blocking client for scripts and notebooks: the results in program order. """
+
+    async def collect():
+        results = [None] * len(programs)
+        async for result in submit(path, programs, **options):
+            results[result['index']] = result
+        return results
+
+    return asyncio.run(collect())
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--worker':
+        model_worker(sys.argv[2], sys.argv[3])
+        return 0
+    parser = argparse.ArgumentParser(description="Program-execution service with warm workers")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"Unix socket to listen on (default: {DEFAULT_SOCKET})")
+    parser.add_argument('--workers', '-j', type=int, default=os.cpu_count() or 1, help="model workers (default: CPU count)")
+    parser.add_argument('--rtl-workers', type=int, default=0,
+                        help="simulators kept up for the 'rtl' backend (default: 0, backend off)")
+    parser.add_argument('--sim', choices=('icarus', 'verilator'), default='icarus', help="simulator of the rtl backend")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help="programs queued per backend")
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="programs queued or running per connection")
+    args = parser.parse_args()
+
+    async def run():
+        # SIGTERM too: the workers and the socket go away with the server
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        await serve(args.socket, args.workers, args.rtl_workers, args.sim, args.queue_size,
+                    args.max_in_flight, stop=stop)
+
+    try:
+        asyncio.run(run())
+    except ExecutionError as error:
+        print(f"Error: {error}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
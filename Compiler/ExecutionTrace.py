@@ -0,0 +1,285 @@
+"""
+Binary execution traces: one fixed-width record per retired instruction.
+
+A trace file is a 16-byte header (magic, version, record size) followed by
+packed little-endian records of RECORD_DTYPE. Writers fill a bytearray in
+large chunks and hand it to the OS in one write; readers map the file with
+np.memmap and get a structured array without parsing anything, so a
+reference-model trace and an RTL trace of the same program can be compared
+field by field at memory bandwidth.
+
+Usage:
+    python Compiler/ExecutionTrace.py record program.txt out.trace [--max-instructions N]
+    python Compiler/ExecutionTrace.py show out.trace [--start N] [--count N] [--op MNEMONIC]
+    python Compiler/ExecutionTrace.py diff model.trace rtl.trace
+"""
+
+import argparse
+import struct
+import sys
+
+import numpy as np
+
+import Disassembler
+import FetchTiming
+import InstructionSimulator
+from InstructionSimulator import KIND_ALU, KIND_ALU_IMM, KIND_LI, KIND_LOAD, KIND_STORE, R0_SINK
+
+MAGIC = b'CPUTRACE'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4x')
+
+# access bits
+REG_WRITE = 1
+MEM_READ = 2
+MEM_WRITE = 4
+
+RECORD_DTYPE = np.dtype([
+    ('cycle', '<u8'),      # clock cycle at which the instruction was written back
+    ('pc', '<u2'),
+    ('word', '<u2'),       # instruction word
+    ('rd', 'u1'),          # register written, valid with REG_WRITE
+    ('value', 'u1'),       # value written to rd
+    ('flags', 'u1'),       # Z | S << 1 | C << 2 | O << 3 after the instruction
+    ('mem_addr', 'u1'),    # DataMemory address, valid with MEM_READ / MEM_WRITE
+    ('mem_value', 'u1'),   # byte loaded or stored
+    ('access', 'u1'),      # REG_WRITE | MEM_READ | MEM_WRITE
+])
+RECORD = struct.Struct('<QHHBBBBBB')
+assert RECORD.size == RECORD_DTYPE.itemsize
+
+# Records buffered by a writer before each write() call
+CHUNK_RECORDS = 1 << 16
+# Records compared at a time by diff(), to bound memory use
+DIFF_CHUNK = 1 << 22
+
+class TraceError(Exception):
+    pass
+
+class TraceWriter:
+    """
+    Buffered writer of trace records.
+
+    append() packs one record into the current chunk; write_records()
+    takes a whole RECORD_DTYPE array. Use it as a context manager, or call
+    close() to flush the last chunk.
+    """
+
+    def __init__(self, path, chunk_records=CHUNK_RECORDS):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.buffer = bytearray(chunk_records * RECORD.size)
+        self.offset = 0
+        self.count = 0
+        self._pack_into = RECORD.pack_into
+
+    def append(self, cycle, pc, word, rd=0, value=0, flags=0, mem_addr=0, mem_value=0, access=0):
+        self._pack_into(self.buffer, self.offset, cycle, pc, word, rd, value, flags, mem_addr, mem_value, access)
+        self.offset += RECORD.size
+        self.count += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def write_records(self, records):
+        """ Appends a RECORD_DTYPE array as is. """
+        self.flush()
+        self.file.write(np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes())
+        self.count += len(records)
+
+    def flush(self):
+        if self.offset:
+            self.file.write(memoryview(self.buffer)[:self.offset])
+            self.offset = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_trace(path, mode='r'):
+    """
+    Maps a trace file as a RECORD_DTYPE array, without copying it.
+
+    :raises TraceError: If the file is not a trace of this version.
+    """
+    with open(path, 'rb') as infile:
+        header = infile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise TraceError(f"{path}: truncated header")
+    magic, version, record_size = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise TraceError(f"{path}: not a version {VERSION} execution trace")
+    with open(path, 'rb') as infile:
+        size = infile.seek(0, 2) - HEADER.size
+    if size == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode=mode, offset=HEADER.size,
+                     shape=(size // RECORD_DTYPE.itemsize,))
+
+def instruction_effects(decoded, registers):
+    """
+    What an instruction writes, from its decoded form and the registers
+    before it runs.
+
+    :return: (rd, mem_addr, access); rd is the architectural register
+             number, R0 included.
+    """
+    kind, rd, a, _, imm, _ = decoded
+    if kind == KIND_STORE:
+        return 0, (registers[a] + imm) & 0x1F, MEM_WRITE
+    if kind == KIND_LOAD:
+        return (0 if rd == R0_SINK else rd), (registers[a] + imm) & 0x1F, REG_WRITE | MEM_READ
+    if kind in (KIND_ALU, KIND_ALU_IMM, KIND_LI):
+        return (0 if rd == R0_SINK else rd), 0, REG_WRITE
+    return 0, 0, 0
+
+def make_record(writer, retired, pc, word, decoded, registers_before, registers, flags, memory, cycle=None):
+    """
+    Appends the record of one retired instruction given the state around it.
+    The cycle defaults to the FetchTiming write-back cycle of the retired-th
+    instruction.
+    """
+    rd, mem_addr, access = instruction_effects(decoded, registers_before)
+    if decoded[0] == KIND_STORE:
+        mem_value = registers_before[decoded[3]]
+    else:
+        mem_value = memory[mem_addr] if access & MEM_READ else 0
+    value = registers[rd] if access & REG_WRITE and rd else 0
+    if cycle is None:
+        cycle = (retired + 1) * FetchTiming.FETCH_PERIOD - FetchTiming.PC_UPDATE_CYCLES
+    writer.append(cycle, pc, word, rd, value, flags, mem_addr, mem_value, access)
+
+def run_traced(simulator, writer, max_instructions=1000000):
+    """
+    Runs a Simulator one instruction at a time, tracing every retired one.
+    The halting branch is not traced, like Simulator.executed.
+
+    :return: Number of instructions executed.
+    """
+    program = simulator._predecoded
+    words = simulator.program
+    registers = simulator.registers
+    executed = 0
+    while executed < max_instructions:
+        pc = simulator.pc
+        before = registers[:]
+        if not simulator._interpret(1):
+            break
+        executed += 1
+        make_record(writer, simulator.executed, pc, words[pc], program[pc], before, registers,
+                    simulator.flags, simulator.memory)
+    return executed
+
+# Everything after the cycle, seen as two integers so that diff() compares
+# 10 bytes per record with two vectorized operations
+_PAYLOAD_DTYPE = np.dtype({'names': ['low', 'high'], 'formats': ['<u8', '<u2'],
+                           'offsets': [8, 16], 'itemsize': RECORD_DTYPE.itemsize})
+
+def diff(trace_a, trace_b, fields=None):
+    """
+    Compares two traces record by record, chunk by chunk.
+
+    :param fields: Fields to compare; defaults to every field but cycle.
+    :return: (index, differing field names) of the first mismatch,
+             (shorter length, ['length']) if one trace is a prefix of the
+             other, or None if they match.
+    """
+    if fields is None:
+        fields = [name for name in RECORD_DTYPE.names if name != 'cycle']
+        view_a, view_b = trace_a.view(_PAYLOAD_DTYPE), trace_b.view(_PAYLOAD_DTYPE)
+        columns = _PAYLOAD_DTYPE.names
+    else:
+        view_a, view_b, columns = trace_a, trace_b, fields
+    length = min(len(trace_a), len(trace_b))
+    for start in range(0, length, DIFF_CHUNK):
+        end = min(start + DIFF_CHUNK, length)
+        mismatch = np.zeros(end - start, dtype=bool)
+        for name in columns:
+            mismatch |= view_a[name][start:end] != view_b[name][start:end]
+        if mismatch.any():
+            index = start + int(np.argmax(mismatch))
+            return index, [name for name in fields if trace_a[name][index] != trace_b[name][index]]
+    if len(trace_a) != len(trace_b):
+        return length, ['length']
+    return None
+
+def format_record(index, record, instruction=None):
+    """ One line per record; instruction defaults to the disassembly of its word. """
+    access = int(record['access'])
+    word = int(record['word'])
+    if instruction is None:
+        instruction = Disassembler.disassemble(word)
+    text = (f"{index:>10} cycle {int(record['cycle']):>12} PC {int(record['pc']):03X} "
+            f"{word:04X} {instruction:<18} flags {int(record['flags']):04b}")
+    if access & REG_WRITE:
+        text += f"  R{int(record['rd'])}={int(record['value'])}"
+    if access & MEM_READ:
+        text += f"  mem[{int(record['mem_addr'])}]->{int(record['mem_value'])}"
+    if access & MEM_WRITE:
+        text += f"  mem[{int(record['mem_addr'])}]<-{int(record['mem_value'])}"
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary execution traces")
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help="trace a program in the ISA simulator")
+    record.add_argument('program', help=".txt source, .hex or .asm")
+    record.add_argument('output')
+    record.add_argument('--max-instructions', type=int, default=1000000)
+    show = commands.add_parser('show', help="print records")
+    show.add_argument('trace')
+    show.add_argument('--start', type=int, default=0)
+    show.add_argument('--count', type=int, default=20)
+    show.add_argument('--op', choices=Disassembler.MNEMONICS, default=None,
+                      help="only records of this instruction")
+    compare = commands.add_parser('diff', help="first mismatch between two traces, cycles ignored")
+    compare.add_argument('trace_a')
+    compare.add_argument('trace_b')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        program = InstructionSimulator.read_program(args.program)
+        if program is None:
+            return 1
+        simulator = InstructionSimulator.Simulator(program, jit=False)
+        with TraceWriter(args.output) as writer:
+            executed = run_traced(simulator, writer, args.max_instructions)
+        print(f"{executed:,} records written to {args.output}")
+        return 0
+
+    try:
+        if args.command == 'show':
+            trace = read_trace(args.trace)
+            if args.op is None:
+                indices = np.arange(args.start, min(args.start + args.count, len(trace)))
+            else:
+                opcode = Disassembler.MNEMONICS.index(args.op)
+                indices = np.flatnonzero(trace['word'] >> 12 == opcode)
+                indices = indices[indices >= args.start][:args.count]
+            instructions = Disassembler.disassemble_array(trace['word'][indices])
+            for index, instruction in zip(indices, instructions):
+                print(format_record(int(index), trace[index], instruction))
+            return 0
+        trace_a, trace_b = read_trace(args.trace_a), read_trace(args.trace_b)
+    except TraceError as error:
+        print(f"Error: {error}")
+        return 1
+    result = diff(trace_a, trace_b)
+    if result is None:
+        print(f"Traces match ({len(trace_a):,} records)")
+        return 0
+    index, fields = result
+    print(f"First mismatch at record {index:,}: {', '.join(fields)}")
+    if fields != ['length']:
+        print("  A " + format_record(index, trace_a[index]))
+        print("  B " + format_record(index, trace_b[index]))
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
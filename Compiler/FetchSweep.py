@@ -0,0 +1,301 @@
+"""
+Design-space sweep of instruction-fetch strategies for ProgramMemory_SPI_RAM.
+
+Every program is run once in the ISA model to record the address of each
+fetch; the same address stream is then replayed through every strategy,
+in a pool of worker processes. A strategy only decides how many cycles
+separate the IDLE edge that sees a new PC from the word being ready; the
+single-cycle execute and the PC update of tt_um_cpu come on top, as in
+FetchTiming:
+
+    spi           the current RTL: 0x03 command, 16-bit address and 16 data
+                  bits for every fetch
+    burst         spi_cs stays low after a read, so the next sequential
+                  word only needs its 16 data bits; a jump restarts a read
+    prefetch-N    burst that keeps clocking sequential words into an
+                  N-word buffer while the core executes
+    icache-N      direct-mapped N-word cache in front of single reads
+    dual-io       0xBB fast read: address, mode and data bits on two lines
+    dual-io-burst dual I/O with spi_cs kept low between sequential words
+
+A strategy is a FetchStrategy subclass listed in STRATEGIES with its
+parameters; the table gives the CPI of each strategy on each program and
+its speedup over 'spi'. A program that reaches --max-instructions without
+halting runs on into the zeros past its end, so its rows are marked and
+left out of the geometric means.
+
+Usage: python Compiler/FetchSweep.py [programs...] [--strategies NAME...] [--jobs N]
+"""
+
+import argparse
+import functools
+import glob
+import math
+import os
+import sys
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import FetchTiming
+from FetchTiming import ADDR_BITS, CMD_BITS, DATA_BITS, EDGES_PER_BIT, FETCH_PERIOD, PC_UPDATE_CYCLES
+from InstructionSimulator import PC_MASK, Simulator, read_program
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Source')
+DEFAULT_MAX_INSTRUCTIONS = 200000
+BASELINE = 'spi'
+
+# Cycles of every fetch spent outside of the fetch unit: instr_stable and
+# write-back, pc_current update, IDLE seeing the new address
+CORE_CYCLES = FETCH_PERIOD - CMD_BITS * EDGES_PER_BIT - ADDR_BITS * EDGES_PER_BIT - DATA_BITS * EDGES_PER_BIT
+# Dual I/O fast read: command on one line, 8 mode bits with the address on two
+DUAL_IO_MODE_BITS = 8
+# Cache lookup of a hit, from the IDLE edge to ready
+CACHE_HIT_CYCLES = 1
+
+SweepResult = namedtuple('SweepResult', ['program', 'strategy', 'instructions', 'cycles', 'cpi', 'hits', 'halted'])
+
+def spi_cycles(bits, lines=1):
+    """ Clock edges to shift bits over the given number of data lines. """
+    return -(-bits // lines) * EDGES_PER_BIT
+
+class FetchStrategy:
+    """
+    Plugin interface of the sweep: how long the fetch unit takes to
+    deliver the word at an address.
+
+    fetch() gets the cycle at which IDLE sees the new address and returns
+    the cycles until the word is ready. It is called once per fetch, in
+    order, and the core comes back CORE_CYCLES after the word is ready, so
+    a strategy may keep working in between (see PrefetchBuffer).
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+
+    def fetch(self, address, now):
+        raise NotImplementedError
+
+class SingleRead(FetchStrategy):
+    """ A complete read command for every fetch, on one or two data lines. """
+
+    def __init__(self, lines=1):
+        self.lines = lines
+        if lines == 1:
+            self.read_cycles = spi_cycles(CMD_BITS) + spi_cycles(ADDR_BITS) + spi_cycles(DATA_BITS)
+        else:
+            self.read_cycles = (spi_cycles(CMD_BITS) + spi_cycles(ADDR_BITS + DUAL_IO_MODE_BITS, lines)
+                                + spi_cycles(DATA_BITS, lines))
+        super().__init__()
+
+    def fetch(self, address, now):
+        return self.read_cycles
+
+class PrefetchBuffer(SingleRead):
+    """
+    Sequential burst read that stays open across fetches.
+
+    After a read command the flash streams consecutive words for as long
+    as spi_cs stays low, DATA_BITS per word. With depth 0 (plain burst)
+    the clock only runs for a requested word; otherwise the controller
+    clocks in up to depth words ahead of the PC and pauses when they fill
+    the buffer. Any other address closes the burst and starts a new read.
+    """
+
+    def __init__(self, depth=0, lines=1):
+        self.depth = depth
+        super().__init__(lines)
+        self.word_cycles = spi_cycles(DATA_BITS, lines)
+
+    def reset(self):
+        super().reset()
+        # Address expected next from the burst, None while no burst is open
+        self.head = None
+        # Completion cycles of the words head, head + 1... clocked in ahead
+        self.queue = deque()
+        # Cycle at which the controller may start shifting the next word
+        self.next_start = 0
+
+    def fetch(self, address, now):
+        queue = self.queue
+        while len(queue) < self.depth and self.next_start <= now:
+            self.next_start += self.word_cycles
+            queue.append(self.next_start)
+        if address != self.head:
+            ready = now + self.read_cycles
+            self.next_start = ready
+            queue.clear()
+        elif queue:
+            ready = max(queue.popleft(), now + 1)
+            self.hits += 1
+            if len(queue) + 1 == self.depth:
+                # The buffer was full: the clock resumes once a word leaves it
+                self.next_start = max(self.next_start, ready)
+        else:
+            ready = now + self.word_cycles
+            self.next_start = ready
+            self.hits += 1
+        self.head = (address + 1) & PC_MASK
+        return ready - now
+
+class DirectMappedCache(SingleRead):
+    """ entries words indexed by the low bits of the address; a miss is a single read. """
+
+    def __init__(self, entries=16, lines=1):
+        self.entries = entries
+        super().__init__(lines)
+
+    def reset(self):
+        super().reset()
+        self.tags = [None] * self.entries
+
+    def fetch(self, address, now):
+        index = address % self.entries
+        if self.tags[index] == address:
+            self.hits += 1
+            return CACHE_HIT_CYCLES
+        self.tags[index] = address
+        return self.read_cycles
+
+# Sweep registry: name -> (strategy class, constructor arguments)
+STRATEGIES = {
+    'spi': (SingleRead, {}),
+    'burst': (PrefetchBuffer, {'depth': 0}),
+    'prefetch-2': (PrefetchBuffer, {'depth': 2}),
+    'prefetch-4': (PrefetchBuffer, {'depth': 4}),
+    'icache-8': (DirectMappedCache, {'entries': 8}),
+    'icache-32': (DirectMappedCache, {'entries': 32}),
+    'dual-io': (SingleRead, {'lines': 2}),
+    'dual-io-burst': (PrefetchBuffer, {'depth': 0, 'lines': 2}),
+}
+
+def make_strategy(name):
+    cls, kwargs = STRATEGIES[name]
+    return cls(**kwargs)
+
+@functools.lru_cache(maxsize=None)
+def fetch_stream(path, max_instructions=DEFAULT_MAX_INSTRUCTIONS):
+    """
+    Addresses fetched by a program: one per retired instruction plus the
+    last fetch, the halting branch or the instruction after the last one.
+    Cached per worker process, which replays it through every strategy.
+
+    :return: (addresses as array('H'), retired instructions, whether the
+             program halted before max_instructions)
+    """
+    try:
+        program = read_program(path)
+    except ValueError as error:
+        raise ValueError(f"{path}: {error}") from None
+    if program is None:
+        raise ValueError(f"{path}: assembly errors")
+    simulator = Simulator(program, jit=False)
+    addresses = array('H')
+    append = addresses.append
+    interpret = simulator._interpret
+    while simulator.executed < max_instructions:
+        pc = simulator.pc
+        if not interpret(1):
+            break
+        append(pc)
+    append(simulator.pc)
+    return addresses, simulator.executed, simulator.halted
+
+def replay(strategy, addresses):
+    """
+    Cycles from the first edge after reset to the write-back of the last
+    retired instruction, like FetchTiming.estimate().
+    """
+    strategy.reset()
+    now = 0
+    fetch = strategy.fetch
+    for address in addresses:
+        now += fetch(address, now) + CORE_CYCLES
+    return now - PC_UPDATE_CYCLES
+
+def _sweep_job(job):
+    """ Process pool entry point: one program under one strategy. """
+    path, name, max_instructions = job
+    addresses, instructions, halted = fetch_stream(path, max_instructions)
+    strategy = make_strategy(name)
+    cycles = replay(strategy, addresses)
+    return SweepResult(os.path.basename(path), name, instructions, cycles,
+                       cycles / instructions if instructions else float('inf'), strategy.hits / len(addresses),
+                       halted)
+
+def sweep(paths, names=None, jobs=None, max_instructions=DEFAULT_MAX_INSTRUCTIONS):
+    """
+    Runs every program under every strategy across a process pool.
+
+    :return: List of SweepResult, programs outer, strategies in STRATEGIES order.
+    """
+    names = list(names or STRATEGIES)
+    job_args = [(path, name, max_instructions) for path in paths for name in names]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(job_args) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(job_args))) as pool:
+            # One program per chunk: its fetch stream is recorded once per worker
+            return list(pool.map(_sweep_job, job_args, chunksize=len(names)))
+    return [_sweep_job(job) for job in job_args]
+
+def format_table(results, clock_hz=None):
+    clock_hz = clock_hz or FetchTiming.read_clock_hz()
+    baseline = {result.program: result.cycles for result in results if result.strategy == BASELINE}
+    lines = [f"{'Program':<20} {'Strategy':<14} {'Instructions':>12} {'Cycles':>12} {'CPI':>7} "
+             f"{'Speedup':>8} {'Hits':>6} {'Runtime (us)':>13}"]
+    speedups = {}
+    stopped = sorted({result.program for result in results if not result.halted})
+    for result in results:
+        reference = baseline.get(result.program)
+        speedup = reference / result.cycles if reference and result.cycles else None
+        if speedup and result.halted:
+            speedups.setdefault(result.strategy, []).append(speedup)
+        program = result.program if result.halted else result.program + '*'
+        lines.append(f"{program:<20} {result.strategy:<14} {result.instructions:>12,} "
+                     f"{result.cycles:>12,} {result.cpi:>7.2f} "
+                     f"{f'{speedup:.2f}x' if speedup else '-':>8} {result.hits:>6.0%} "
+                     f"{result.cycles / clock_hz * 1e6:>13,.1f}")
+    if stopped:
+        lines.append("")
+        lines.append("* stopped at --max-instructions without halting (JMP 0): past its last word a program")
+        lines.append("  fetches zeros (add R0, R0, R0), so these rows may not describe it; not in the means")
+    if len(set(baseline) - set(stopped)) > 1:
+        lines.append("")
+        lines.append("Geometric mean speedup over " + BASELINE + ":")
+        for name, values in speedups.items():
+            mean = math.exp(sum(map(math.log, values)) / len(values))
+            lines.append(f"  {name:<14} {mean:.2f}x")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="CPI of every program under every fetch strategy")
+    parser.add_argument('programs', nargs='*',
+                        help=".txt, .hex or .asm programs (default: every .txt of Compiler/Source)")
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES, default=None,
+                        help="strategies to sweep (default: all)")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--max-instructions', type=int, default=DEFAULT_MAX_INSTRUCTIONS,
+                        help="instructions run per program, for programs that do not halt")
+    parser.add_argument('--clock-hz', type=int, default=None, help="default: clock_hz from info.yaml")
+    args = parser.parse_args()
+
+    paths = args.programs or sorted(glob.glob(os.path.join(SOURCE_DIR, '*.txt')))
+    names = args.strategies or list(STRATEGIES)
+    if BASELINE not in names:
+        names.insert(0, BASELINE)
+    try:
+        results = sweep(paths, names, args.jobs, args.max_instructions)
+    except ValueError as error:
+        print(f"Error: {error}")
+        return 1
+    print(format_table(results, args.clock_hz))
+    if not args.programs and not any(result.halted for result in results):
+        print(f"\nWARNING: no program of {SOURCE_DIR} halts (JMP 0) within {args.max_instructions:,} "
+              f"instructions: the sweep measures empty flash, not real programs")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Cycle model of the SPI instruction fetch path (src/ProgramMemory_SPI.v).
+
+The CPU has no cache: ProgramMemory_SPI_RAM leaves IDLE whenever the PC
+differs from the last fetched address and clocks out a READ command
+(8 bits), a 16-bit address and reads a 16-bit word, two clock edges per
+bit. Counting the edges after the one where IDLE sees address != last_addr:
+
+    80 cycles  CMD + ADDR + DATA, ready is raised on the last one
+    1 cycle    instr_stable latches the word and the previous instruction
+               writes back (register file, flags and memory are gated
+               by mem_ready), ready_q follows ready
+    1 cycle    pc_current <= next_pc
+    1 cycle    IDLE sees the new address and starts the next fetch
+
+so a new fetch starts every 83 cycles and an instruction is retired on
+the edge after the next fetch completes. A branch to itself ('jmp 0')
+never leaves IDLE again, which is how the CPU halts.
+"""
+
+import os
+import re
+from collections import namedtuple
+
+CMD_BITS = 8
+ADDR_BITS = 16
+DATA_BITS = 16
+EDGES_PER_BIT = 2
+
+SPI_CYCLES = (CMD_BITS + ADDR_BITS + DATA_BITS) * EDGES_PER_BIT
+# Up to the edge that latches instr_stable
+FETCH_LATENCY = SPI_CYCLES + 1
+# pc_current update, then the IDLE edge that starts the next fetch
+PC_UPDATE_CYCLES = 2
+FETCH_PERIOD = FETCH_LATENCY + PC_UPDATE_CYCLES
+
+INFO_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'info.yaml')
+DEFAULT_CLOCK_HZ = 50000000
+
+TimingReport = namedtuple('TimingReport', ['instructions', 'fetches', 'cycles',
+                                           'stall_cycles', 'cpi', 'seconds'])
+
+def read_clock_hz(path=INFO_YAML):
+    """ Returns project.clock_hz from info.yaml, or DEFAULT_CLOCK_HZ if it cannot be read. """
+    try:
+        with open(path, 'r') as infile:
+            match = re.search(r'^\s*clock_hz:\s*(\d+)', infile.read(), re.MULTILINE)
+    except OSError:
+        return DEFAULT_CLOCK_HZ
+    return int(match.group(1)) if match else DEFAULT_CLOCK_HZ
+
+def make_report(instructions, fetches, cycles, clock_hz):
+    # The core itself needs a single edge per instruction: everything else
+    # is spent waiting for the SPI fetch.
+    return TimingReport(instructions, fetches, cycles, cycles - instructions,
+                        cycles / instructions if instructions else float('inf'),
+                        cycles / clock_hz)
+
+def estimate(simulator, clock_hz=None):
+    """
+    Timing of what a Simulator has executed since its last reset.
+
+    Every instruction moves the PC except a halting branch to itself, so
+    each retired instruction costs exactly one fetch and the model reduces
+    to a closed form; the simulator run loop is left untouched. cycles
+    counts from the first edge after reset to the write-back of the last
+    retired instruction, which is what the cocotb harness measures up to
+    the last falling edge of mem_ready.
+    """
+    fetches = simulator.executed + 1
+    cycles = fetches * FETCH_PERIOD - PC_UPDATE_CYCLES
+    return make_report(simulator.executed, fetches, cycles, clock_hz or read_clock_hz())
+
+def format_report(report, clock_hz=None):
+    clock_hz = clock_hz or read_clock_hz()
+    return (f"Cycles   : {report.cycles:,} ({report.fetches:,} fetches, "
+            f"{report.stall_cycles:,} stall cycles, CPI {report.cpi:.2f})\n"
+            f"Runtime  : {report.seconds * 1e6:,.2f} us at {clock_hz / 1e6:g} MHz")
@@ -0,0 +1,498 @@
+"""
+Cycle-free architectural simulator for the custom instruction set.
+
+Decodes machine words exactly like src/ControlUnit.v and executes them with
+the semantics of the RTL: 8-bit registers with R0 hard-wired to zero,
+Z/S/C/O flags as stored by FlagRegister.v, a 32-byte DataMemory and a
+10-bit PC where branch offsets are relative to the branch itself.
+"""
+
+import argparse
+import sys
+import time
+
+import AssemblyTranslator
+
+PC_MASK = 0x3FF
+PROGRAM_SIZE = PC_MASK + 1
+DATA_MEMORY_SIZE = 32
+REGISTER_COUNT = 8
+
+# Bit positions in stored_flags, as wired in tt_um_cpu: {overflow, carry, negative, zero}
+FLAG_Z = 1
+FLAG_S = 2
+FLAG_C = 4
+FLAG_O = 8
+
+OP_ADD, OP_ADDI, OP_SUB, OP_AND, OP_OR, OP_XOR, OP_LI, OP_L, \
+    OP_ST, OP_JMP, OP_BRZ, OP_BRNZ, OP_BRNS, OP_SHL, OP_SHR, OP_CMP = range(16)
+
+# Decoded instruction kinds, in the order the run loop tests them
+KIND_ALU = 0      # rd <- alu(R[a], R[b]), flags
+KIND_ALU_IMM = 1  # rd <- alu(R[a], imm), flags
+KIND_LI = 2       # rd <- imm
+KIND_LOAD = 3     # rd <- mem[R[a] + imm]
+KIND_STORE = 4    # mem[R[a] + imm] <- R[b]
+KIND_BRANCH = 5   # pc <- pc + offset if condition
+KIND_CMP = 6      # flags <- R[a] - R[b]
+
+# Branch taken when stored_flags & mask == expected, as in BranchUnit.v
+BRANCH_CONDITIONS = {
+    OP_JMP: (0, 0),
+    OP_BRZ: (FLAG_Z, FLAG_Z),
+    OP_BRNZ: (FLAG_Z, 0),
+    OP_BRNS: (FLAG_S, 0),
+}
+
+# Register index that receives writes to R0: the register list has one
+# extra slot past R7 that is never read, so R0 stays zero without a test.
+R0_SINK = REGISTER_COUNT
+
+def alu(operation, operand1, operand2):
+    """
+    Reference model of ALU.v.
+
+    :return: (result, flags) with flags packed as FLAG_Z | FLAG_S | FLAG_C | FLAG_O.
+    """
+    flags = 0
+    if operation in (OP_ADD, OP_SUB):
+        b_inv = operand2 ^ 0xFF if operation == OP_SUB else operand2
+        total = operand1 + b_inv + (operation == OP_SUB)
+        result = total & 0xFF
+        if total >> 8:
+            flags |= FLAG_C
+        if (operand1 >> 7) == (b_inv >> 7) and (result >> 7) != (operand1 >> 7):
+            flags |= FLAG_O
+    elif operation == OP_SHL:
+        result = (operand1 << (operand2 & 0xF)) & 0xFF
+    elif operation == OP_SHR:
+        result = operand1 >> (operand2 & 0xF)
+    elif operation == OP_AND:
+        result = operand1 & operand2
+    elif operation == OP_OR:
+        result = operand1 | operand2
+    elif operation == OP_XOR:
+        result = operand1 ^ operand2
+    else:
+        result = (operand1 + operand2) & 0xFF
+    if result == 0:
+        flags |= FLAG_Z
+    if result & 0x80:
+        flags |= FLAG_S
+    return result, flags
+
+_alu_tables = {}
+
+def alu_table(operation):
+    """
+    Returns the 65536-entry table of an ALU operation, indexed by
+    operand1 << 8 | operand2, holding result | flags << 8.
+    Tables are built on first use and shared by every simulator.
+    """
+    table = _alu_tables.get(operation)
+    if table is None:
+        table = []
+        for operand1 in range(256):
+            for operand2 in range(256):
+                result, flags = alu(operation, operand1, operand2)
+                table.append(result | flags << 8)
+        _alu_tables[operation] = table
+    return table
+
+def _sink(register):
+    return register if register else R0_SINK
+
+def decode(word):
+    """
+    Decodes a machine word into (kind, rd, a, b, imm, extra), following ControlUnit.v.
+
+    For ALU kinds extra is the ALU table, for branches it is the opcode and
+    the condition is stored as flags & a == rd.
+    Register destinations of R0 are redirected to R0_SINK.
+    """
+    opcode = word >> 12
+    rd = (word >> 9) & 7
+    rs1 = (word >> 6) & 7
+    rs2 = (word >> 3) & 7
+    if opcode in (OP_ADD, OP_SUB, OP_AND, OP_OR, OP_XOR):
+        return (KIND_ALU, _sink(rd), rs1, rs2, 0, alu_table(opcode))
+    if opcode == OP_ADDI:
+        return (KIND_ALU_IMM, _sink(rd), rd, 0, word & 0xFF, alu_table(OP_ADD))
+    if opcode == OP_LI:
+        return (KIND_LI, _sink(rd), 0, 0, word & 0xFF, None)
+    if opcode == OP_L:
+        return (KIND_LOAD, _sink(rd), rs1, 0, word & 0xF, None)
+    if opcode == OP_ST:
+        return (KIND_STORE, 0, rs1, rd, word & 0xF, None)
+    if opcode in (OP_JMP, OP_BRZ, OP_BRNZ, OP_BRNS):
+        mask, expected = BRANCH_CONDITIONS[opcode]
+        return (KIND_BRANCH, expected, mask, 0, word & PC_MASK, opcode)
+    if opcode in (OP_SHL, OP_SHR):
+        if word & 0x20:  # Immediate shift amount in bits [4:1]
+            return (KIND_ALU_IMM, _sink(rd), rd, 0, (word >> 1) & 0xF, alu_table(opcode))
+        return (KIND_ALU, _sink(rd), rd, rs2, 0, alu_table(opcode))
+    return (KIND_CMP, 0, rd, rs1, 0, alu_table(OP_SUB))
+
+_decode_table = None
+
+def decode_table():
+    """ Returns the 65536-entry decode table, built on first use. """
+    global _decode_table
+    if _decode_table is None:
+        _decode_table = [decode(word) for word in range(1 << 16)]
+    return _decode_table
+
+# Longest straight-line run compiled into a single block
+BLOCK_LIMIT = 256
+
+
+def _alu_name(table):
+    """ Name under which an ALU table is visible to compiled blocks. """
+    for operation in range(16):
+        if alu_table(operation) is table:
+            return f'ALU{operation}'
+    raise ValueError("Unknown ALU table")
+
+def _register(index):
+    return '0' if index == 0 else f'regs[{index}]'
+
+def compile_block(predecoded, start, profile=None):
+    """
+    Compiles the basic block starting at a PC into a Python function.
+
+    The block runs up to and including the first branch (or BLOCK_LIMIT
+    instructions). Register reads of R0 become constants, writes to R0
+    vanish and only the last flag update of the block is kept, since
+    nothing inside the block reads flags but the final branch.
+    Program memory cannot be written by the CPU, so blocks never go stale.
+
+    :param predecoded: Decoded program, as Simulator keeps it.
+    :param start: PC of the first instruction of the block.
+    :param profile: Profiler.Profile to instrument the block for. The hooks
+           only exist in blocks compiled for a profile, the plain ones stay
+           exactly as fast.
+    :return: (function, length) where function(regs, memory, flags)
+             returns (next_pc, flags, halted).
+    """
+    instructions = []
+    pc = start
+    while len(instructions) < BLOCK_LIMIT:
+        instructions.append((pc, predecoded[pc]))
+        if predecoded[pc][0] == KIND_BRANCH or pc == PC_MASK:
+            break
+        pc += 1
+
+    last_flag_write = max((i for i, (_, decoded) in enumerate(instructions)
+                           if decoded[0] in (KIND_ALU, KIND_ALU_IMM, KIND_CMP)), default=-1)
+    namespace = {}
+    body = []
+    if profile is not None:
+        namespace['block_count'] = profile.block_counter(start, len(instructions))
+        namespace['taken'] = profile.taken
+        namespace['reads'] = profile.memory_reads
+        namespace['writes'] = profile.memory_writes
+        body.append('block_count[0] += 1')
+    for i, (pc, (kind, rd, a, b, imm, extra)) in enumerate(instructions):
+        if extra is not None and kind != KIND_BRANCH:
+            name = _alu_name(extra)
+            namespace[name] = extra
+        if kind in (KIND_ALU, KIND_ALU_IMM, KIND_CMP):
+            operand2 = str(imm) if kind == KIND_ALU_IMM else _register(b)
+            index = f'({_register(a)} << 8 | {operand2})'
+            writes_register = kind != KIND_CMP and rd != R0_SINK
+            if writes_register or i == last_flag_write:
+                body.append(f'v = {name}[{index}]')
+            if writes_register:
+                body.append(f'regs[{rd}] = v & 255')
+            if i == last_flag_write:
+                body.append('flags = v >> 8')
+        elif kind == KIND_LI:
+            if rd != R0_SINK:
+                body.append(f'regs[{rd}] = {imm}')
+        elif kind == KIND_LOAD:
+            if profile is not None:
+                body.append(f'address = ({_register(a)} + {imm}) & 31')
+                body.append('reads[address] += 1')
+            if rd != R0_SINK:
+                body.append(f'regs[{rd}] = memory[({_register(a)} + {imm}) & 31]')
+        elif kind == KIND_STORE:
+            body.append(f'memory[({_register(a)} + {imm}) & 31] = {_register(b)}')
+            if profile is not None:
+                body.append(f'writes[({_register(a)} + {imm}) & 31] += 1')
+        else:
+            target = (pc + imm) & PC_MASK
+            halts = imm == 0
+            exit_branch = f'return {target}, flags, {halts}'
+            if profile is not None:
+                exit_branch = f'taken[{pc}] += 1; ' + exit_branch
+            if a == 0:
+                body.append(exit_branch)
+            else:
+                body.append(f'if flags & {a} == {rd}: {exit_branch}')
+    if instructions[-1][1][0] != KIND_BRANCH or instructions[-1][1][2] != 0:
+        body.append(f'return {(instructions[-1][0] + 1) & PC_MASK}, flags, False')
+
+    source = f'def block_{start}(regs, memory, flags):\n    ' + '\n    '.join(body) + '\n'
+    exec(compile(source, f'<block {start}>', 'exec'), namespace)
+    return namespace[f'block_{start}'], len(instructions)
+
+class Simulator:
+    """
+    Architectural state and run loop of the CPU.
+
+    registers, flags, memory and pc are plain attributes so that the
+    simulator can be inspected or preloaded as a golden reference model.
+    With jit enabled, run() executes compiled basic blocks cached by start
+    PC and interprets only what is left when a block would overshoot
+    max_instructions.
+    Profiling is opt-in through attach_profile(): while no profile is
+    attached, run() uses the uninstrumented blocks and interpreter.
+    """
+
+    def __init__(self, program=(), jit=True):
+        self.jit = jit
+        self.profile = None
+        self.decoded = decode_table()
+        self.program = [0] * PROGRAM_SIZE
+        self.load_program(program)
+        self.reset()
+
+    def reset(self):
+        """ Puts the CPU in its post-reset state; the program is kept. """
+        self.registers = [0] * (REGISTER_COUNT + 1)
+        self.memory = bytearray(DATA_MEMORY_SIZE)
+        self.pc = 0
+        # instr_stable resets to 0x0000 (add R0, R0, R0), which the RTL commits
+        # with the first fetch: Z is therefore set before the program starts.
+        self.flags = FLAG_Z
+        self.executed = 0
+        self.halted = False
+
+    def load_program(self, words, start=0):
+        """
+        Writes machine words into program memory.
+
+        :param words: Iterable of 16-bit machine words, or a {address: word} dict.
+        :param start: Address of the first word when words is a sequence.
+        """
+        items = words.items() if isinstance(words, dict) else enumerate(words, start)
+        for address, word in items:
+            if not 0 <= address < PROGRAM_SIZE:
+                raise IndexError(f"Program address {address} outside of the {PROGRAM_SIZE}-word memory")
+            self.program[address] = word & 0xFFFF
+        self._predecoded = [self.decoded[word] for word in self.program]
+        self._blocks = {}
+        if self.profile is not None:
+            self.profile.blocks.clear()
+
+    def attach_profile(self, profile):
+        """
+        Starts collecting execution statistics into a Profiler.Profile, or
+        stops with None. Instrumented blocks are compiled and cached apart
+        from the plain ones.
+        """
+        if profile is not None:
+            profile.blocks.clear()
+        self.profile = profile
+
+    def get_flags(self):
+        """ Returns the flags as a {'Z', 'S', 'C', 'O'} dict, like test.py's get_flags. """
+        flags = self.flags
+        return {'Z': flags & 1, 'S': (flags >> 1) & 1, 'C': (flags >> 2) & 1, 'O': (flags >> 3) & 1}
+
+    def get_registers(self):
+        """ Returns the values of R0-R7. """
+        return self.registers[:REGISTER_COUNT]
+
+    def step(self):
+        """ Executes a single instruction. """
+        return self.run(1)
+
+    def run(self, max_instructions=1000000):
+        """
+        Executes instructions until the CPU halts or max_instructions ran.
+        The CPU halts on a taken branch to itself (e.g. 'jmp 0'), where
+        the RTL stops fetching for good.
+
+        :return: Number of instructions executed by this call.
+        """
+        if self.halted:
+            return 0
+        profile = self.profile
+        if not self.jit:
+            if profile is not None:
+                return profile.interpret(self, max_instructions)
+            return self._interpret(max_instructions)
+        blocks = self._blocks if profile is None else profile.blocks
+        regs = self.registers
+        memory = self.memory
+        pc = self.pc
+        flags = self.flags
+        remaining = max_instructions
+        while True:
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = compile_block(self._predecoded, pc, profile)
+            function, length = block
+            if length > remaining:
+                break
+            pc, flags, halted = function(regs, memory, flags)
+            if halted:
+                remaining -= length - 1
+                self.halted = True
+                break
+            remaining -= length
+        self.pc = pc
+        self.flags = flags
+        executed = max_instructions - remaining
+        self.executed += executed
+        if remaining and not self.halted:
+            if profile is not None:
+                executed += profile.interpret(self, remaining)
+            else:
+                executed += self._interpret(remaining)
+        return executed
+
+    def _interpret(self, max_instructions):
+        """ Executes instructions one by one; same contract as run(). """
+        program = self._predecoded
+        regs = self.registers
+        memory = self.memory
+        pc = self.pc
+        flags = self.flags
+        remaining = max_instructions
+        while remaining:
+            remaining -= 1
+            kind, rd, a, b, imm, extra = program[pc]
+            if kind == KIND_ALU:
+                value = extra[regs[a] << 8 | regs[b]]
+                regs[rd] = value & 0xFF
+                flags = value >> 8
+                pc = (pc + 1) & PC_MASK
+            elif kind == KIND_ALU_IMM:
+                value = extra[regs[a] << 8 | imm]
+                regs[rd] = value & 0xFF
+                flags = value >> 8
+                pc = (pc + 1) & PC_MASK
+            elif kind == KIND_BRANCH:
+                if flags & a == rd:
+                    if imm == 0:
+                        remaining += 1
+                        self.halted = True
+                        break
+                    pc = (pc + imm) & PC_MASK
+                else:
+                    pc = (pc + 1) & PC_MASK
+            elif kind == KIND_LI:
+                regs[rd] = imm
+                pc = (pc + 1) & PC_MASK
+            elif kind == KIND_CMP:
+                flags = extra[regs[a] << 8 | regs[b]] >> 8
+                pc = (pc + 1) & PC_MASK
+            elif kind == KIND_LOAD:
+                regs[rd] = memory[(regs[a] + imm) & 0x1F]
+                pc = (pc + 1) & PC_MASK
+            else:
+                memory[(regs[a] + imm) & 0x1F] = regs[b]
+                pc = (pc + 1) & PC_MASK
+        executed = max_instructions - remaining
+        self.pc = pc
+        self.flags = flags
+        self.executed += executed
+        return executed
+
+# Instructions whose decoded (kind, rd, a, b, imm) pin down where the
+# assembler places each operand
+LAYOUT_PROBE = (
+    ('add R1, R2, R3', (KIND_ALU, 1, 2, 3, 0)),
+    ('addi R4, 200', (KIND_ALU_IMM, 4, 4, 0, 200)),
+    ('load R5, R6, 7', (KIND_LOAD, 5, 6, 0, 7)),
+    ('store R5, R6, 7', (KIND_STORE, 0, 6, 5, 7)),
+    ('cmp R1, R2', (KIND_CMP, 0, 1, 2, 0)),
+)
+_layout_checked = False
+
+def check_assembler_layout():
+    """
+    Checks that AssemblyTranslator encodes operands where decode() reads
+    them, so that a simulated source runs what the hardware would run.
+
+    :raises ValueError: If a probe instruction decodes to other fields.
+    """
+    global _layout_checked
+    if _layout_checked:
+        return
+    words = AssemblyTranslator.assemble_code('\n'.join(source for source, _ in LAYOUT_PROBE))
+    if words is None:
+        raise ValueError("AssemblyTranslator rejects the layout probe instructions")
+    for word, (source, expected) in zip(words, LAYOUT_PROBE):
+        if decode(word)[:5] != expected:
+            raise ValueError(f"AssemblyTranslator encodes '{source}' as 0x{word:04X}, "
+                             f"which ControlUnit.v does not decode as written")
+    _layout_checked = True
+
+def read_program(path):
+    """
+    Reads a program from a source file (.txt), a $readmemh file (.hex)
+    or a bit-string file (.asm).
+
+    :return: List of machine words, or None if the source has errors.
+    :raises ValueError: For a source, if the assembler layout does not
+                        match the decoder (see check_assembler_layout).
+    """
+    with open(path, 'r') as infile:
+        text = infile.read()
+    if path.endswith('.hex'):
+        return [int(token, 16) for token in text.split() if not token.startswith('//')]
+    if path.endswith('.asm'):
+        return [int(token, 2) for token in text.split()]
+    check_assembler_layout()
+    return AssemblyTranslator.assemble_code(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('program', help="program to run (.txt source, .hex or .asm)")
+    parser.add_argument('--max-instructions', type=int, default=1000000)
+    parser.add_argument('--no-jit', action='store_true',
+                        help="interpret every instruction instead of running compiled basic blocks")
+    parser.add_argument('--timing', action='store_true',
+                        help="estimate clock cycles spent in SPI fetches (see FetchTiming.py)")
+    parser.add_argument('--clock-hz', type=int, default=None,
+                        help="clock frequency for --timing (default: clock_hz from info.yaml)")
+    parser.add_argument('--profile', metavar='JSON', default=None,
+                        help="profile the run and write the statistics as JSON (see Profiler.py)")
+    parser.add_argument('--collapsed', metavar='TXT', default=None,
+                        help="profile the run and write collapsed stacks for flamegraph tools")
+    args = parser.parse_args()
+
+    program = read_program(args.program)
+    if program is None:
+        sys.exit(1)
+    simulator = Simulator(program, jit=not args.no_jit)
+    profile = None
+    if args.profile or args.collapsed:
+        import Profiler
+        profile = Profiler.Profile(simulator)
+        simulator.attach_profile(profile)
+    start = time.perf_counter()
+    executed = simulator.run(args.max_instructions)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'Halted' if simulator.halted else 'Stopped'} at PC={simulator.pc} "
+          f"after {executed} instructions ({executed / max(elapsed, 1e-9):,.0f} instr/s)")
+    print("Registers: " + ' '.join(f"R{i}={value}" for i, value in enumerate(simulator.get_registers())))
+    print("Flags    : " + ' '.join(f"{name}={value}" for name, value in simulator.get_flags().items()))
+    print("Memory   : " + simulator.memory.hex(' '))
+    if args.timing:
+        import FetchTiming
+        clock_hz = args.clock_hz or FetchTiming.read_clock_hz()
+        print(FetchTiming.format_report(FetchTiming.estimate(simulator, clock_hz), clock_hz))
+    if profile is not None:
+        print(profile.format_summary())
+        if args.profile:
+            profile.write_json(args.profile)
+        if args.collapsed:
+            profile.write_collapsed(args.collapsed)
+
+if __name__ == "__main__":
+    main()
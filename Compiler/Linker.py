@@ -0,0 +1,406 @@
+"""
+Test packing: links many small test snippets into one program image.
+
+A snippet is a piece of assembly that runs from the CPU reset state and
+falls through its last instruction, with its expected results in comment
+lines:
+
+    ## add
+    loadi R1, 10
+    loadi R2, 20
+    add R3, R1, R2
+    # expect: R3=30 Z=0 S=0
+
+Expectations name a register R1-R7, a flag Z or S (read back as a byte
+Z | S << 1) or a DataMemory byte mem[N]. Each snippet is run once in the
+ISA model from reset to find what it depends on, then placed in the image
+as
+    prologue  what the snippet reads before writing it, or expects without
+              writing it, is put back in its reset state: 'loadi Rk, 0' for registers, 'store R0' for
+              memory bytes, 'add R0, R0, R0' for the flags (Z only)
+    body      the snippet, unchanged; branches are PC-relative
+    epilogue  every expected value is stored in its own DataMemory slot,
+              taken among the bytes that no snippet of the image touches
+and the image ends with 'jmp 0'. One simulation of the image then checks
+all the snippets at once by reading the 32 bytes of DataMemory; pack()
+spreads a suite over as many images as the slots require.
+
+Usage: python Compiler/Linker.py snippets.txt [--output-dir DIR]
+"""
+
+import argparse
+import os
+import re
+import sys
+from collections import namedtuple
+
+from AssemblyTranslator import BRANCH_OPS, encode_instruction, format_words, parse_code, parse_line
+from Disassembler import branch_offset
+from InstructionSimulator import (
+    DATA_MEMORY_SIZE, FLAG_S, FLAG_Z, KIND_ALU, KIND_ALU_IMM, KIND_BRANCH, KIND_CMP, KIND_LOAD,
+    KIND_STORE, PROGRAM_SIZE, R0_SINK, REGISTER_COUNT, Simulator,
+)
+
+HALT = 'jmp 0'
+# Executed instructions allowed per snippet word before it is considered stuck
+STEP_BUDGET = 64
+# Highest DataMemory address a load/store reaches with base R0 (4-bit offset)
+DIRECT_ADDRESS_LIMIT = 16
+FLAG_BITS = {'Z': FLAG_Z, 'S': FLAG_S}
+FLAGS_KEY = 'flags'
+
+SNIPPET_HEADER = re.compile(r'^\s*##\s*(\S.*?)\s*$')
+EXPECT_LINE = re.compile(r'#\s*expect:(.*)$')
+EXPECTATION = re.compile(r'^(R[1-7]|Z|S|mem\[(\d+)\])=(\w+)$')
+
+Snippet = namedtuple('Snippet', ['name', 'source', 'expected'])
+# What a snippet needs from the image, found by running it in the model
+Analysis = namedtuple('Analysis', ['snippet', 'instructions', 'live_registers', 'live_flags',
+                                   'zeroed', 'touched', 'executed'])
+# One byte of DataMemory to compare: memory[address] & mask == expected
+Check = namedtuple('Check', ['snippet', 'key', 'address', 'expected', 'mask'])
+# layout: (snippet name, first PC, PC past the epilogue) per snippet
+Image = namedtuple('Image', ['words', 'checks', 'layout', 'executed'])
+
+class LinkError(Exception):
+    pass
+
+class CapacityError(LinkError):
+    """ The snippets do not fit in one image: DataMemory slots or program words. """
+
+def parse_expectations(text, name='snippet'):
+    """ Parses 'R3=30 Z=1 mem[5]=123' into {'R3': 30, 'Z': 1, 'mem[5]': 123}. """
+    expected = {}
+    for token in text.split():
+        match = EXPECTATION.match(token)
+        if match is None:
+            raise LinkError(f"{name}: invalid expectation '{token}'")
+        key, address, value = match.groups()
+        try:
+            value = int(value, 0)
+        except ValueError:
+            raise LinkError(f"{name}: invalid value in '{token}'") from None
+        limit = 1 if key in FLAG_BITS else 0xFF
+        if not 0 <= value <= limit:
+            raise LinkError(f"{name}: value out of range in '{token}'")
+        if address is not None and int(address) >= DATA_MEMORY_SIZE:
+            raise LinkError(f"{name}: no DataMemory byte at '{key}'")
+        expected[key] = value
+    return expected
+
+def parse_snippet(name, source):
+    """ Builds a Snippet from source whose '# expect:' lines give the expected values. """
+    expected = {}
+    for line in source.splitlines():
+        match = EXPECT_LINE.search(line)
+        if match:
+            expected.update(parse_expectations(match.group(1), name))
+    if not expected:
+        raise LinkError(f"{name}: no '# expect:' line")
+    return Snippet(name, source, expected)
+
+def parse_snippets(text):
+    """ Splits a suite into snippets, each one starting with a '## name' line. """
+    snippets = []
+    name, lines = None, []
+    for line in text.splitlines():
+        match = SNIPPET_HEADER.match(line)
+        if match:
+            if name is not None:
+                snippets.append(parse_snippet(name, '\n'.join(lines)))
+            name, lines = match.group(1), []
+        elif name is not None:
+            lines.append(line)
+        elif line.split('#', 1)[0].strip():
+            raise LinkError("Code before the first '## name' line")
+    if name is not None:
+        snippets.append(parse_snippet(name, '\n'.join(lines)))
+    return snippets
+
+def analyze(snippet):
+    """
+    Assembles a snippet and runs it from reset in the model, recording
+    the registers, flags and memory bytes it reads before writing them
+    and where it loads and stores.
+
+    :raises LinkError: If the snippet does not assemble, branches outside
+                       of itself, halts or does not reach its end.
+    """
+    name = snippet.name
+    instructions, ok = parse_code(snippet.source)
+    if not ok:
+        raise LinkError(f"{name}: assembly errors")
+    if not instructions:
+        raise LinkError(f"{name}: no instruction")
+    words = [encode_instruction(instruction) for instruction in instructions]
+    size = len(words)
+    for pc, instruction in enumerate(instructions):
+        if instruction[0] in BRANCH_OPS:
+            target = pc + branch_offset(words[pc])
+            if not 0 <= target <= size:
+                raise LinkError(f"{name}: branch at {pc} leaves the snippet")
+
+    simulator = Simulator(words, jit=False)
+    program = simulator._predecoded
+    registers = simulator.registers
+    written, live_registers = {0, R0_SINK}, set()
+    flags_written, live_flags = False, False
+    stored, zeroed, touched = set(), set(), set()
+    budget = STEP_BUDGET * size
+    while simulator.pc != size:
+        if simulator.executed >= budget:
+            raise LinkError(f"{name}: does not reach its end within {budget} instructions")
+        kind, rd, a, b, imm, _ = program[simulator.pc]
+        if kind == KIND_BRANCH:
+            reads = ()
+            if a and not flags_written:
+                live_flags = True
+        elif kind in (KIND_ALU, KIND_CMP, KIND_STORE):
+            reads = (a, b)
+        elif kind in (KIND_ALU_IMM, KIND_LOAD):
+            reads = (a,)
+        else:
+            reads = ()
+        live_registers.update(register for register in reads if register not in written)
+        if kind in (KIND_LOAD, KIND_STORE):
+            address = (registers[a] + imm) % DATA_MEMORY_SIZE
+            touched.add(address)
+            if kind == KIND_STORE:
+                stored.add(address)
+            elif address not in stored:
+                zeroed.add(address)
+        if kind in (KIND_ALU, KIND_ALU_IMM, KIND_CMP):
+            flags_written = True
+        if kind not in (KIND_BRANCH, KIND_CMP, KIND_STORE):
+            written.add(rd)
+        if not simulator._interpret(1):
+            raise LinkError(f"{name}: halts at {simulator.pc}")
+
+    # Expected values the snippet never writes are checked against the reset state
+    for key in snippet.expected:
+        if key.startswith('R') and int(key[1:]) not in written:
+            live_registers.add(int(key[1:]))
+        elif key in FLAG_BITS and not flags_written:
+            live_flags = True
+        elif key.startswith('mem['):
+            address = int(key[4:-1])
+            touched.add(address)
+            if address not in stored:
+                zeroed.add(address)
+    return Analysis(snippet, instructions, sorted(live_registers), live_flags,
+                    sorted(zeroed), touched, simulator.executed)
+
+def _base(address, base_register):
+    """ (base register, offset) that reach a DataMemory address. """
+    if address < DIRECT_ADDRESS_LIMIT:
+        return 'R0', address
+    return f"R{base_register}", address - DIRECT_ADDRESS_LIMIT
+
+def _prologue(analysis):
+    lines = []
+    if analysis.zeroed:
+        # Any register will do as base: the body writes it before reading,
+        # or the register reset below clears it
+        base = analysis.live_registers[0] if analysis.live_registers else 1
+        if analysis.zeroed[-1] >= DIRECT_ADDRESS_LIMIT:
+            lines.append(f"loadi R{base}, {DIRECT_ADDRESS_LIMIT}")
+        for address in analysis.zeroed:
+            lines.append("store R0, {}, {}".format(*_base(address, base)))
+    lines += [f"loadi R{register}, 0" for register in analysis.live_registers]
+    if analysis.live_flags:
+        lines.append("add R0, R0, R0")
+    return lines
+
+def _epilogue(analysis, slots):
+    """
+    Stores the expected values of a snippet.
+
+    :param slots: {expectation key: DataMemory address}
+    :return: (source lines, list of Check)
+    """
+    name = analysis.snippet.name
+    expected = analysis.snippet.expected
+    lines, checks = [], []
+    high = {key: address for key, address in slots.items() if address >= DIRECT_ADDRESS_LIMIT}
+    for key, address in slots.items():
+        if key.startswith('R') and key not in high:
+            lines.append(f"store {key}, R0, {address}")
+
+    # Base register for the slots and bytes past the 4-bit offset: anything
+    # but a register still to be stored; then a scratch register besides it
+    free = [register for register in range(1, REGISTER_COUNT) if f"R{register}" not in high]
+    memory_keys = [key for key in slots if key.startswith('mem[')]
+    if high or any(int(key[4:-1]) >= DIRECT_ADDRESS_LIMIT for key in memory_keys):
+        if not free:
+            raise LinkError(f"{name}: no register left to address DataMemory past {DIRECT_ADDRESS_LIMIT}")
+        base = free.pop(0)
+        lines.append(f"loadi R{base}, {DIRECT_ADDRESS_LIMIT}")
+    else:
+        base = None
+    for key, address in high.items():
+        if key.startswith('R'):
+            lines.append("store {}, {}, {}".format(key, *_base(address, base)))
+    scratch = next(register for register in range(1, REGISTER_COUNT) if register != base)
+    for key in memory_keys:
+        lines.append("load R{}, {}, {}".format(scratch, *_base(int(key[4:-1]), base)))
+        lines.append("store R{}, {}, {}".format(scratch, *_base(slots[key], base)))
+    if FLAGS_KEY in slots:
+        # loadi, load and store leave the flags alone: capture Z | S << 1
+        lines += [f"loadi R{scratch}, 0",
+                  "brnn 2",
+                  f"loadi R{scratch}, {FLAG_S}",
+                  "brnz 2",
+                  f"addi R{scratch}, {FLAG_Z}",
+                  "store R{}, {}, {}".format(scratch, *_base(slots[FLAGS_KEY], base))]
+
+    for key, address in slots.items():
+        if key == FLAGS_KEY:
+            mask = sum(bit for flag, bit in FLAG_BITS.items() if flag in expected)
+            value = sum(bit for flag, bit in FLAG_BITS.items() if expected.get(flag))
+            checks.append(Check(name, '/'.join(flag for flag in FLAG_BITS if flag in expected),
+                                address, value, mask))
+        else:
+            checks.append(Check(name, key, address, expected[key], 0xFF))
+    return lines, checks
+
+def _slot_keys(snippet):
+    """ Expectation keys that get a DataMemory slot, in epilogue order. """
+    keys = [key for key in snippet.expected if key.startswith('R')]
+    keys += [key for key in snippet.expected if key.startswith('mem[')]
+    flags = [key for key in snippet.expected if key in FLAG_BITS]
+    unknown = set(snippet.expected) - set(keys) - set(flags)
+    if unknown:
+        raise LinkError(f"{snippet.name}: cannot check {', '.join(sorted(unknown))}")
+    if flags:
+        keys.append(FLAGS_KEY)
+    return keys
+
+def _parse_generated(lines):
+    instructions = []
+    for line in lines:
+        instruction = parse_line(line)
+        assert not isinstance(instruction, str), instruction
+        instructions.append(instruction)
+    return instructions
+
+def link_analyses(analyses):
+    """
+    Links analyzed snippets into one Image.
+
+    :raises CapacityError: If the result slots or the program do not fit.
+    """
+    touched = set().union(*(analysis.touched for analysis in analyses))
+    free = [address for address in range(DATA_MEMORY_SIZE) if address not in touched]
+    keys = [_slot_keys(analysis.snippet) for analysis in analyses]
+    needed = sum(map(len, keys))
+    if needed > len(free):
+        raise CapacityError(f"{needed} result bytes needed, {len(free)} DataMemory bytes free")
+
+    instructions, checks, layout = [], [], []
+    executed = 1
+    free = iter(free)
+    for analysis, snippet_keys in zip(analyses, keys):
+        start = len(instructions)
+        prologue = _prologue(analysis)
+        epilogue, snippet_checks = _epilogue(analysis, {key: next(free) for key in snippet_keys})
+        instructions += _parse_generated(prologue)
+        instructions += analysis.instructions
+        instructions += _parse_generated(epilogue)
+        layout.append((analysis.snippet.name, start, len(instructions)))
+        checks += snippet_checks
+        # Both flag capture branches may be taken: the count is an upper bound
+        executed += len(prologue) + analysis.executed + len(epilogue)
+    instructions += _parse_generated([HALT])
+    if len(instructions) > PROGRAM_SIZE:
+        raise CapacityError(f"{len(instructions)} instructions, program memory holds {PROGRAM_SIZE}")
+    return Image([encode_instruction(instruction) for instruction in instructions], checks, layout, executed)
+
+def link(snippets):
+    """ Links snippets into a single Image; see link_analyses(). """
+    return link_analyses([analyze(snippet) for snippet in snippets])
+
+def pack(snippets):
+    """
+    Links a suite into as few images as the DataMemory slots allow,
+    keeping the snippets in order.
+
+    :return: A list of Image.
+    """
+    images = []
+    current, image = [], None
+    for snippet in snippets:
+        analysis = analyze(snippet)
+        try:
+            image = link_analyses(current + [analysis])
+            current.append(analysis)
+        except CapacityError:
+            if not current:
+                raise
+            images.append(image)
+            current = [analysis]
+            image = link_analyses(current)
+    if current:
+        images.append(image)
+    return images
+
+def check_memory(image, memory):
+    """
+    Compares DataMemory after a run of the image with the expectations.
+
+    :param memory: The 32 bytes of DataMemory, or None for unreadable bytes.
+    :return: A list of (Check, actual byte) for the checks that fail.
+    """
+    failures = []
+    for check in image.checks:
+        actual = memory[check.address]
+        if actual is None or actual & check.mask != check.expected:
+            failures.append((check, actual))
+    return failures
+
+def format_failure(check, actual):
+    if check.mask != 0xFF and actual is not None:
+        actual = {flag: int(bool(actual & bit)) for flag, bit in FLAG_BITS.items() if check.mask & bit}
+        expected = {flag: int(bool(check.expected & bit)) for flag, bit in FLAG_BITS.items() if check.mask & bit}
+        return f"{check.snippet}: {check.key} {actual} instead of {expected}"
+    return f"{check.snippet}: {check.key}={actual} instead of {check.expected} (mem[{check.address}])"
+
+def run_model(image):
+    """ Runs an image in the ISA model; returns the halted Simulator. """
+    simulator = Simulator(image.words)
+    simulator.run(image.executed + 1)
+    if not simulator.halted:
+        raise LinkError(f"Image did not halt within {image.executed} instructions")
+    return simulator
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs test snippets into program images")
+    parser.add_argument('snippets', help="suite of '## name' snippets with '# expect:' lines")
+    parser.add_argument('--output-dir', help="write image_N.hex files ($readmemh) here")
+    args = parser.parse_args()
+    with open(args.snippets, 'r') as infile:
+        text = infile.read()
+    try:
+        images = pack(parse_snippets(text))
+    except LinkError as error:
+        print(f"Error: {error}")
+        return 1
+
+    failed = 0
+    for number, image in enumerate(images):
+        simulator = run_model(image)
+        failures = check_memory(image, simulator.memory)
+        failed += len(failures)
+        print(f"Image {number}: {len(image.layout)} snippets, {len(image.checks)} checks, "
+              f"{len(image.words)} words, {simulator.executed} instructions")
+        for failure in failures:
+            print("  FAIL " + format_failure(*failure))
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            with open(os.path.join(args.output_dir, f"image_{number}.hex"), 'w') as outfile:
+                outfile.write(format_words(image.words, 'hex'))
+    checks = sum(len(image.checks) for image in images)
+    print(f"{checks - failed}/{checks} checks pass in the model")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,8 @@
-0001000100101010
-0000001000010001
-0010001100100001
-0011010000110010
-0100010101000011
-0101011001010100
-0110011101100100
-0111100001110000
\ No newline at end of file
+0001001000101010
+0000010001001000
+0010011010001000
+0011100011010000
+0100101100011000
+0101110101100000
+0110111001100100
+0111001111000000
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+Execution profiler for the instruction simulator.
+
+Attach a Profile to a Simulator to collect per-PC execution counts,
+taken/not-taken counts of every branch, read/write heatmaps of the 32
+DataMemory bytes and register usage:
+
+    simulator = Simulator(program)
+    profile = Profile(simulator)
+    simulator.attach_profile(profile)
+    simulator.run()
+    profile.write_json('profile.json')
+    profile.write_collapsed('profile.folded')  # for flamegraph.pl / speedscope
+
+Compiled blocks only count their own executions, taken exits and memory
+addresses; everything that follows from the program text (per-PC counts,
+register usage) is derived from those counts when the profile is read.
+"""
+
+import json
+from collections import Counter
+
+from Disassembler import MNEMONICS
+from InstructionSimulator import (
+    BRANCH_CONDITIONS, DATA_MEMORY_SIZE, KIND_ALU, KIND_ALU_IMM, KIND_BRANCH, KIND_CMP, KIND_LOAD,
+    KIND_STORE, OP_JMP, PROGRAM_SIZE, R0_SINK, REGISTER_COUNT,
+)
+
+HOT_LOOPS = 10
+
+def register_usage(decoded):
+    """ (read registers, written registers) of a decoded instruction, R0 writes included. """
+    kind, rd, a, b = decoded[:4]
+    written = () if kind in (KIND_STORE, KIND_CMP, KIND_BRANCH) else (0 if rd == R0_SINK else rd,)
+    if kind in (KIND_ALU, KIND_CMP, KIND_STORE):
+        return (a, b), written
+    if kind in (KIND_ALU_IMM, KIND_LOAD):
+        return (a,), written
+    return (), written
+
+class Profile:
+    """
+    Statistics of everything a Simulator ran while this profile was attached.
+
+    block_counts maps (start, length) to a one-element list incremented by
+    the compiled block; instructions interpreted one at a time count as
+    blocks of length 1. taken counts taken branches per PC, a halting
+    branch included.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.blocks = {}
+        self.block_counts = {}
+        self.taken = [0] * PROGRAM_SIZE
+        self.memory_reads = [0] * DATA_MEMORY_SIZE
+        self.memory_writes = [0] * DATA_MEMORY_SIZE
+
+    def block_counter(self, start, length):
+        return self.block_counts.setdefault((start, length), [0])
+
+    def interpret(self, simulator, max_instructions):
+        """ Profiled counterpart of Simulator._interpret, one instruction at a time. """
+        executed = 0
+        program = simulator._predecoded
+        while executed < max_instructions and not simulator.halted:
+            pc = simulator.pc
+            kind, rd, a, b, imm, extra = program[pc]
+            self.block_counter(pc, 1)[0] += 1
+            if kind == KIND_LOAD:
+                self.memory_reads[(simulator.registers[a] + imm) & 0x1F] += 1
+            elif kind == KIND_STORE:
+                self.memory_writes[(simulator.registers[a] + imm) & 0x1F] += 1
+            elif kind == KIND_BRANCH and simulator.flags & a == rd:
+                self.taken[pc] += 1
+            executed += simulator._interpret(1)
+        return executed
+
+    # ------------------------------------------------------------------
+    # Derived statistics
+    # ------------------------------------------------------------------
+
+    def pc_counts(self):
+        """ Executions per PC; the halting branch counts once although Simulator.executed omits it. """
+        counts = [0] * PROGRAM_SIZE
+        for (start, length), (count, ) in self.block_counts.items():
+            if count:
+                for pc in range(start, start + length):
+                    counts[pc] += count
+        return counts
+
+    def branch_stats(self, counts=None):
+        """ {pc: (mnemonic, taken, not_taken)} for every branch that ran. """
+        counts = counts or self.pc_counts()
+        program = self.simulator.program
+        stats = {}
+        for pc, count in enumerate(counts):
+            opcode = program[pc] >> 12
+            if count and opcode in BRANCH_CONDITIONS:
+                stats[pc] = (MNEMONICS[opcode], self.taken[pc], count - self.taken[pc])
+        return stats
+
+    def _block_registers(self):
+        """
+        For every PC, the distinct registers among R1-R7 used by the static
+        basic block around it (leaders: 0, branch targets and the words
+        after branches), so that pressure does not depend on how the
+        simulator happened to split execution into blocks.
+        """
+        program = self.simulator._predecoded
+        leaders = {0}
+        for pc, (kind, _, _, _, imm, _) in enumerate(program):
+            if kind == KIND_BRANCH:
+                leaders.add((pc + imm) & (PROGRAM_SIZE - 1))
+                leaders.add(pc + 1)
+        pressure = [0] * PROGRAM_SIZE
+        starts = sorted(leader for leader in leaders if leader < PROGRAM_SIZE)
+        for start, end in zip(starts, starts[1:] + [PROGRAM_SIZE]):
+            used = set()
+            for pc in range(start, end):
+                used.update(*register_usage(program[pc]))
+            used.discard(0)
+            pressure[start:end] = [len(used)] * (end - start)
+        return pressure
+
+    def register_stats(self, counts=None):
+        """
+        Register usage: reads and writes per register, and the register
+        pressure as {distinct registers among R1-R7 used by the basic
+        block: instructions executed in such blocks}.
+        """
+        counts = counts or self.pc_counts()
+        reads = [0] * REGISTER_COUNT
+        writes = [0] * REGISTER_COUNT
+        pressure = Counter()
+        program = self.simulator._predecoded
+        block_registers = self._block_registers()
+        for pc, count in enumerate(counts):
+            if not count:
+                continue
+            read, written = register_usage(program[pc])
+            for register in read:
+                reads[register] += count
+            for register in written:
+                writes[register] += count
+            pressure[block_registers[pc]] += count
+        return reads, writes, dict(sorted(pressure.items()))
+
+    def hot_loops(self, counts=None):
+        """
+        Loops closed by a taken backward branch, hottest first, as dicts
+        with the span, the back-edge iterations and the instructions
+        executed inside the span.
+        """
+        counts = counts or self.pc_counts()
+        program = self.simulator._predecoded
+        loops = []
+        for pc, taken in enumerate(self.taken):
+            kind, _, _, _, imm, _ = program[pc]
+            target = (pc + imm) & (PROGRAM_SIZE - 1)
+            if taken and kind == KIND_BRANCH and target < pc:
+                loops.append({'head': target, 'tail': pc, 'iterations': taken,
+                              'instructions': sum(counts[target:pc + 1])})
+        loops.sort(key=lambda loop: loop['instructions'], reverse=True)
+        return loops
+
+    def to_dict(self):
+        counts = self.pc_counts()
+        reads, writes, pressure = self.register_stats(counts)
+        return {
+            'instructions': self.simulator.executed,
+            'pc_counts': {pc: count for pc, count in enumerate(counts) if count},
+            'branches': {pc: {'op': op, 'taken': taken, 'not_taken': not_taken}
+                         for pc, (op, taken, not_taken) in self.branch_stats(counts).items()},
+            'hot_loops': self.hot_loops(counts),
+            'memory': {'reads': self.memory_reads, 'writes': self.memory_writes},
+            'registers': {'reads': reads, 'writes': writes, 'pressure': pressure},
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as outfile:
+            json.dump(self.to_dict(), outfile, indent=1)
+
+    def collapsed_stacks(self):
+        """
+        Collapsed-stack lines ('frame;frame;frame count') for flamegraph
+        tools: every PC sits under the hot loops that contain it, outermost
+        first, and weighs its execution count.
+        """
+        counts = self.pc_counts()
+        program = self.simulator.program
+        loops = sorted(self.hot_loops(counts), key=lambda loop: (loop['head'], -loop['tail']))
+        lines = []
+        for pc, count in enumerate(counts):
+            if not count:
+                continue
+            frames = ['program']
+            frames += [f"loop_{loop['head']:03X}-{loop['tail']:03X}" for loop in loops
+                       if loop['head'] <= pc <= loop['tail']]
+            frames.append(f"{pc:03X}_{MNEMONICS[program[pc] >> 12]}")
+            lines.append(f"{';'.join(frames)} {count}")
+        return lines
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as outfile:
+            outfile.write('\n'.join(self.collapsed_stacks()) + '\n')
+
+    def format_summary(self):
+        counts = self.pc_counts()
+        lines = [f"Profile  : {self.simulator.executed:,} instructions over "
+                 f"{sum(1 for count in counts if count)} PCs"]
+        for loop in self.hot_loops(counts)[:HOT_LOOPS]:
+            lines.append(f"  loop {loop['head']:03X}-{loop['tail']:03X}: {loop['iterations']:,} iterations, "
+                         f"{loop['instructions']:,} instructions")
+        for pc, (op, taken, not_taken) in self.branch_stats(counts).items():
+            if op != MNEMONICS[OP_JMP]:
+                lines.append(f"  {op:<5} @{pc:03X}: {taken:,} taken, {not_taken:,} not taken")
+        lines.append("  RAM reads : " + ' '.join(map(str, self.memory_reads)))
+        lines.append("  RAM writes: " + ' '.join(map(str, self.memory_writes)))
+        return '\n'.join(lines)
@@ -0,0 +1,238 @@
+"""
+Random program fuzzer for the CPU with coverage feedback.
+
+Programs are drawn over all 16 opcodes with the field layouts that
+src/ControlUnit.v decodes (3-bit registers, 8-bit ALU/LI immediates, 4-bit
+load/store offsets and shift amounts, 10-bit branch offsets kept inside
+the program) and with random values in every don't-care bit. Each one is
+screened in a Python model of the ISA; only programs that reach a new
+coverage point are kept, and they are written out in batches for the
+RTL (see test_fuzz_corpus in test/test.py).
+
+A coverage point is (opcode, flags, taken, address):
+    flags    flags written by ALU/CMP instructions, flags tested by
+             conditional branches, None otherwise
+    taken    branch taken or not, None for non-branches
+    address  data memory address of loads and stores, None otherwise
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from InstructionSimulator import (
+    BRANCH_CONDITIONS, DATA_MEMORY_SIZE, FLAG_Z, KIND_ALU, KIND_ALU_IMM, KIND_BRANCH,
+    KIND_CMP, KIND_LOAD, KIND_STORE, OP_ADD, OP_ADDI, OP_AND, OP_BRNS, OP_BRNZ, OP_BRZ,
+    OP_CMP, OP_JMP, OP_L, OP_LI, OP_OR, OP_SHL, OP_SHR, OP_ST, OP_SUB, OP_XOR, PC_MASK,
+    alu_table, decode_table,
+)
+
+HALT = 0x9000  # jmp 0
+FLAG_OPCODES = (OP_ADD, OP_ADDI, OP_SUB, OP_AND, OP_OR, OP_XOR, OP_SHL, OP_SHR, OP_CMP)
+CONDITIONAL_BRANCHES = (OP_BRZ, OP_BRNZ, OP_BRNS)
+BRANCHES = (OP_JMP,) + CONDITIONAL_BRANCHES
+
+DEFAULT_LENGTH = 24
+# Executed instructions allowed per program word before a program is
+# considered stuck in a loop and dropped
+STEP_BUDGET = 8
+BATCH_SIZE = 64
+
+def random_word(rng, opcode, pc, length):
+    """
+    Draws an instruction with the given opcode at pc, inside a program of
+    length words. Fields ControlUnit.v ignores are filled with random bits.
+    """
+    word = opcode << 12 | rng.getrandbits(12)
+    if opcode in BRANCHES:
+        # Any target inside the program, the halt included; bits [11:10]
+        # are not decoded and keep their random value
+        offset = (rng.randrange(length) - pc) & PC_MASK
+        word = word & ~PC_MASK | offset
+    elif opcode in (OP_L, OP_ST) and rng.random() < 0.5:
+        # Base register R0 half of the time, so that low addresses get hit
+        word &= ~(7 << 6)
+    return word
+
+def generate_program(rng, length=DEFAULT_LENGTH):
+    """ Returns a random program of length words, the last one being 'jmp 0'. """
+    words = [random_word(rng, rng.randrange(16), pc, length) for pc in range(length - 1)]
+    words.append(HALT)
+    return words
+
+def coverage_space():
+    """
+    Returns the set of reachable coverage points: flag outcomes come from
+    the ALU tables, branches can see any flags an ALU operation (or reset)
+    leaves behind.
+    """
+    space = set()
+    all_flags = {FLAG_Z}
+    for opcode in FLAG_OPCODES:
+        table = alu_table(OP_SUB if opcode == OP_CMP else OP_ADD if opcode == OP_ADDI else opcode)
+        flags = {value >> 8 for value in table}
+        all_flags |= flags
+        space.update((opcode, value, None, None) for value in flags)
+    for opcode in CONDITIONAL_BRANCHES:
+        mask, expected = BRANCH_CONDITIONS[opcode]
+        space.update((opcode, flags, flags & mask == expected, None) for flags in all_flags)
+    space.add((OP_JMP, None, True, None))
+    space.add((OP_LI, None, None, None))
+    for opcode in (OP_L, OP_ST):
+        space.update((opcode, None, None, address) for address in range(DATA_MEMORY_SIZE))
+    return space
+
+def run_with_coverage(words, max_steps):
+    """
+    Executes a program from reset and collects its coverage points.
+
+    :return: The set of points, or None if the program did not halt within
+             max_steps or ran past its last word.
+    """
+    decoded = decode_table()
+    program = [decoded[word] for word in words]
+    size = len(words)
+    regs = [0] * 9
+    memory = [0] * DATA_MEMORY_SIZE
+    flags = FLAG_Z
+    pc = 0
+    points = set()
+    add = points.add
+    for _ in range(max_steps):
+        if pc >= size:
+            return None
+        kind, rd, a, b, imm, extra = program[pc]
+        opcode = words[pc] >> 12
+        if kind == KIND_ALU:
+            value = extra[regs[a] << 8 | regs[b]]
+            regs[rd] = value & 0xFF
+            flags = value >> 8
+            add((opcode, flags, None, None))
+        elif kind == KIND_ALU_IMM:
+            value = extra[regs[a] << 8 | imm]
+            regs[rd] = value & 0xFF
+            flags = value >> 8
+            add((opcode, flags, None, None))
+        elif kind == KIND_CMP:
+            flags = extra[regs[a] << 8 | regs[b]] >> 8
+            add((opcode, flags, None, None))
+        elif kind == KIND_BRANCH:
+            taken = flags & a == rd
+            add((opcode, None if opcode == OP_JMP else flags, taken, None))
+            if taken:
+                if imm == 0:
+                    return points
+                pc = (pc + imm) & PC_MASK
+                continue
+        elif kind == KIND_LOAD:
+            address = (regs[a] + imm) & 0x1F
+            regs[rd] = memory[address]
+            add((opcode, None, None, address))
+        elif kind == KIND_STORE:
+            address = (regs[a] + imm) & 0x1F
+            memory[address] = regs[b]
+            add((opcode, None, None, address))
+        else:
+            regs[rd] = imm
+            add((opcode, None, None, None))
+        pc += 1
+    return None
+
+class Fuzzer:
+    """
+    Generates programs and keeps the ones that add coverage.
+
+    covered grows monotonically; kept holds the programs that added to it,
+    in the order they were found.
+    """
+
+    def __init__(self, seed=None, length=DEFAULT_LENGTH):
+        self.rng = random.Random(seed)
+        self.length = length
+        self.space = coverage_space()
+        self.covered = set()
+        self.kept = []
+        self.generated = 0
+        self.halting = 0
+
+    def step(self):
+        """ Generates and screens one program; returns True if it was kept. """
+        words = generate_program(self.rng, self.length)
+        self.generated += 1
+        points = run_with_coverage(words, self.length * STEP_BUDGET)
+        if points is None:
+            return False
+        self.halting += 1
+        new = points - self.covered
+        if not new:
+            return False
+        self.covered |= new
+        self.kept.append(words)
+        return True
+
+def write_batch(path, programs, fuzzer):
+    with open(path, 'w') as outfile:
+        json.dump({'length': fuzzer.length, 'coverage': len(fuzzer.covered),
+                   'space': len(fuzzer.space), 'programs': programs}, outfile)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10.0, help="time budget")
+    parser.add_argument('--programs', type=int, default=None, help="stop after this many programs")
+    parser.add_argument('--length', type=int, default=DEFAULT_LENGTH, help="words per program, halt included")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="kept programs per corpus file sent to the RTL")
+    parser.add_argument('--output', default=None,
+                        help="corpus file prefix: writes PREFIX-000.json, PREFIX-001.json...")
+    parser.add_argument('--report-every', type=float, default=1.0, help="seconds between progress lines")
+    args = parser.parse_args()
+    if args.length < 2:
+        parser.error("--length must be at least 2")
+
+    fuzzer = Fuzzer(args.seed, args.length)
+    decode_table()
+    batches = 0
+    sent = 0
+    start = time.perf_counter()
+    next_report = start + args.report_every
+    print(f"Coverage space: {len(fuzzer.space)} points")
+    print(f"{'Time (s)':>8} {'Programs':>9} {'Prog/s':>8} {'Halting':>8} {'Kept':>5} {'Coverage':>14}")
+
+    def report(now):
+        elapsed = now - start
+        covered = len(fuzzer.covered)
+        print(f"{elapsed:>8.1f} {fuzzer.generated:>9,} {fuzzer.generated / max(elapsed, 1e-9):>8,.0f} "
+              f"{fuzzer.halting:>8,} {len(fuzzer.kept):>5} "
+              f"{covered:>5}/{len(fuzzer.space)} {100 * covered / len(fuzzer.space):5.1f}%")
+
+    while True:
+        fuzzer.step()
+        if args.output and len(fuzzer.kept) - sent >= args.batch_size:
+            write_batch(f"{args.output}-{batches:03d}.json", fuzzer.kept[sent:sent + args.batch_size], fuzzer)
+            sent += args.batch_size
+            batches += 1
+        now = time.perf_counter()
+        if now >= next_report:
+            report(now)
+            next_report += args.report_every
+        if (args.programs is not None and fuzzer.generated >= args.programs) or \
+                (args.programs is None and now - start >= args.seconds) or \
+                len(fuzzer.covered) == len(fuzzer.space):
+            break
+    report(time.perf_counter())
+    if args.output and len(fuzzer.kept) > sent:
+        write_batch(f"{args.output}-{batches:03d}.json", fuzzer.kept[sent:], fuzzer)
+        batches += 1
+    if args.output:
+        print(f"Wrote {len(fuzzer.kept)} programs in {batches} batch(es) to {args.output}-*.json")
+
+    missing = sorted(fuzzer.space - fuzzer.covered, key=str)
+    if missing:
+        print(f"Uncovered ({len(missing)}): " + ', '.join(map(str, missing[:20]))
+              + (' ...' if len(missing) > 20 else ''))
+
+if __name__ == "__main__":
+    sys.exit(main())
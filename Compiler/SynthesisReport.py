@@ -0,0 +1,294 @@
+"""
+Cached Yosys synthesis of the CPU, module by module, with an area check.
+
+Every module of src/ is synthesized on its own with the passes of
+yosys_run.ys (proc, opt, fsm, memory, techmap), reading only the files of
+the modules it instantiates, and tt_um_cpu once more as the top of the
+whole hierarchy. 'stat -json' gives the generic cell counts of each run.
+
+A run is fingerprinted by the Yosys version, the script and the content of
+every file it reads, `include`d ones (defines.vh) included; results are
+kept in Output/.synth_cache.json, so only the modules whose sources changed
+go through Yosys again. Stale modules are synthesized in parallel.
+
+The cell counts are compared with Output/area_baseline.json: a module that
+grows by more than --threshold percent fails the run, so that an area
+regression shows up locally before the Tiny Tapeout flow. A module with no
+baseline (or no baseline file at all) fails the run as well, instead of
+passing unchecked. --update-baseline accepts the current counts.
+
+Usage: python Compiler/SynthesisReport.py [--threshold PCT] [--update-baseline] [--jobs N] [--force]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+SYNTHESIS_VERSION = '1'
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SOURCE_DIR = os.path.join(ROOT_DIR, 'src')
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Output')
+CACHE_FILE = '.synth_cache.json'
+BASELINE_FILE = 'area_baseline.json'
+TOP_MODULE = 'tt_um_cpu'
+DEFAULT_THRESHOLD = 2.0
+
+# Same passes as yosys_run.ys
+PASSES = """proc; opt; fsm; opt; memory; opt;
+techmap; opt;"""
+
+# Cell counts of one synthesis run; cell_types maps generic cells ($_AND_, $_DFF_P_...) to counts
+Area = namedtuple('Area', ['cells', 'wires', 'wire_bits', 'memory_bits', 'cell_types'])
+# A Verilog module of src/ and the files that define it and what it instantiates
+Module = namedtuple('Module', ['name', 'file', 'files'])
+
+_COMMENTS = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+_MODULE = re.compile(r'^\s*module\s+(\w+)(.*?)^\s*endmodule\b', re.DOTALL | re.MULTILINE)
+_INCLUDE = re.compile(r'^\s*`include\s+"([^"]+)"', re.MULTILINE)
+
+class SynthesisError(Exception):
+    pass
+
+def find_modules(source_dir=SOURCE_DIR):
+    """
+    Lists the modules of the .v files of source_dir (testbenches aside),
+    each with the sorted files its synthesis reads: its own, those of the
+    modules it instantiates, recursively, and the files they include.
+
+    :return: {module name: Module}
+    """
+    bodies = {}
+    defined_in = {}
+    includes = {}
+    for filename in sorted(os.listdir(source_dir)):
+        if not filename.endswith('.v') or filename.endswith('_tb.v'):
+            continue
+        with open(os.path.join(source_dir, filename), 'r') as infile:
+            text = infile.read()
+        includes[filename] = _INCLUDE.findall(text)
+        for name, body in _MODULE.findall(_COMMENTS.sub('', text)):
+            bodies[name] = body
+            defined_in[name] = filename
+
+    instantiates = {}
+    for name, body in bodies.items():
+        instantiates[name] = {other for other in bodies
+                              if other != name and re.search(rf'\b{other}\b\s*(#|\w)', body)}
+
+    modules = {}
+    for name in bodies:
+        seen, pending = set(), [name]
+        while pending:
+            current = pending.pop()
+            if current not in seen:
+                seen.add(current)
+                pending.extend(instantiates[current])
+        files = {defined_in[current] for current in seen}
+        files |= {included for filename in files for included in includes[filename]}
+        modules[name] = Module(name, defined_in[name], sorted(files))
+    return modules
+
+def synthesis_script(module, source_dir, stat_file):
+    sources = ' '.join(os.path.join(source_dir, filename) for filename in module.files
+                       if filename.endswith('.v'))
+    return (f"read_verilog -sv -I{source_dir} {sources}\n"
+            f"hierarchy -check -top {module.name}\n"
+            f"{PASSES}\n"
+            f"tee -q -o {stat_file} stat -json\n")
+
+def fingerprint(module, source_dir, yosys_version):
+    """ Fingerprints everything a synthesis run depends on. """
+    digest = hashlib.sha256(f'{SYNTHESIS_VERSION}\0{yosys_version}\0{module.name}\0{PASSES}\0'.encode())
+    for filename in module.files:
+        digest.update(f'{filename}\0'.encode())
+        with open(os.path.join(source_dir, filename), 'rb') as infile:
+            digest.update(infile.read())
+    return digest.hexdigest()
+
+def _area(section):
+    return Area(section.get('num_cells', 0), section.get('num_wires', 0), section.get('num_wire_bits', 0),
+                section.get('num_memory_bits', 0), dict(section.get('num_cells_by_type', {})))
+
+def parse_stat(report, top):
+    """
+    Cell counts of the top of a 'stat -json' report: the totals of the
+    whole design below it.
+    """
+    if 'design' in report:
+        return _area(report['design'])
+    for name, section in report.get('modules', {}).items():
+        if name.lstrip('\\') == top:
+            return _area(section)
+    raise SynthesisError(f"No statistics for {top} in the Yosys report")
+
+def yosys_version(yosys='yosys'):
+    if shutil.which(yosys) is None:
+        raise SynthesisError(f"'{yosys}' not found on the PATH")
+    result = subprocess.run([yosys, '-V'], capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+def synthesize(module, source_dir=SOURCE_DIR, yosys='yosys'):
+    """
+    Runs Yosys on one module.
+
+    :return: (Area, seconds)
+    :raises SynthesisError: If Yosys fails, with the end of its log.
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        stat_file = os.path.join(directory, 'stat.json')
+        script_file = os.path.join(directory, 'synth.ys')
+        with open(script_file, 'w') as outfile:
+            outfile.write(synthesis_script(module, source_dir, stat_file))
+        result = subprocess.run([yosys, '-q', '-s', script_file], capture_output=True, text=True)
+        if result.returncode != 0:
+            log = (result.stdout + result.stderr).strip().splitlines()
+            raise SynthesisError(f"{module.name}: Yosys failed\n" + '\n'.join(log[-20:]))
+        with open(stat_file, 'r') as infile:
+            report = json.load(infile)
+    return parse_stat(report, module.name), time.perf_counter() - start
+
+def load_json(path):
+    try:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def save_json(path, data):
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(data, outfile, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def synthesize_all(modules, source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, jobs=None, force=False, yosys='yosys'):
+    """
+    Synthesizes the modules whose fingerprint is not in the cache, in parallel.
+
+    :param modules: Module list, see find_modules().
+    :param force: Synthesize every module of the list regardless of the cache.
+    :return: ({module name: Area}, list of the names actually synthesized)
+    :raises SynthesisError: If a module does not synthesize; the others
+                            are cached all the same.
+    """
+    version = yosys_version(yosys)
+    cache_file = os.path.join(output_dir, CACHE_FILE)
+    # Entries of the other modules stay valid even with force
+    cache = load_json(cache_file)
+    areas, stale = {}, []
+    for module in modules:
+        key = fingerprint(module, source_dir, version)
+        entry = cache.get(module.name)
+        if not force and entry is not None and entry['fingerprint'] == key:
+            areas[module.name] = Area(**entry['area'])
+        else:
+            stale.append((module, key))
+
+    errors = []
+    if stale:
+        jobs = jobs or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=min(jobs, len(stale))) as pool:
+            futures = [pool.submit(synthesize, module, source_dir, yosys) for module, _ in stale]
+            for (module, key), future in zip(stale, futures):
+                try:
+                    area, seconds = future.result()
+                except SynthesisError as error:
+                    errors.append(str(error))
+                    cache.pop(module.name, None)
+                    continue
+                print(f"Synthesized {module.name} ({seconds:.2f} s)")
+                areas[module.name] = area
+                cache[module.name] = {'fingerprint': key, 'area': area._asdict()}
+        os.makedirs(output_dir, exist_ok=True)
+        save_json(cache_file, cache)
+    if errors:
+        raise SynthesisError('\n'.join(errors))
+    return areas, [module.name for module, _ in stale]
+
+def compare(areas, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares cell counts with a baseline.
+
+    :param baseline: {module name: cells}
+    :param threshold: Growth in percent above which a module regresses.
+    :return: (regressions, missing): (module, baseline cells, cells, growth
+             percent) over the threshold, and the modules with no baseline.
+    """
+    regressions = []
+    missing = []
+    for name, area in sorted(areas.items()):
+        reference = baseline.get(name)
+        if not reference:
+            missing.append(name)
+            continue
+        growth = (area.cells - reference) * 100 / reference
+        if growth > threshold:
+            regressions.append((name, reference, area.cells, growth))
+    return regressions, missing
+
+def format_report(areas, baseline):
+    lines = [f"{'Module':<24} {'Cells':>7} {'Baseline':>9} {'Change':>8} {'Wire bits':>10} {'Mem bits':>9}  Largest cell types"]
+    # The top last: its counts include every other module
+    for name in sorted(areas, key=lambda name: (name == TOP_MODULE, name)):
+        area = areas[name]
+        reference = baseline.get(name)
+        change = f"{(area.cells - reference) * 100 / reference:+.1f}%" if reference else 'new'
+        types = sorted(area.cell_types.items(), key=lambda item: -item[1])[:4]
+        lines.append(f"{name:<24} {area.cells:>7} {reference if reference else '-':>9} {change:>8} "
+                     f"{area.wire_bits:>10} {area.memory_bits:>9}  "
+                     + ', '.join(f"{cell_type} {count}" for cell_type, count in types))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached per-module Yosys synthesis and area check")
+    parser.add_argument('modules', nargs='*', help="modules to synthesize (default: every module of src/)")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"allowed cell count growth in percent (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--update-baseline', action='store_true', help="store the current cell counts as the baseline")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="parallel Yosys runs (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="ignore the cache")
+    parser.add_argument('--yosys', default='yosys', help="Yosys executable")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    modules = find_modules()
+    unknown = set(args.modules) - set(modules)
+    if unknown:
+        print(f"Error: unknown module(s) {', '.join(sorted(unknown))}; known: {', '.join(sorted(modules))}")
+        return 1
+    selected = [modules[name] for name in (args.modules or sorted(modules))]
+    try:
+        areas, synthesized = synthesize_all(selected, jobs=args.jobs, force=args.force, yosys=args.yosys)
+    except SynthesisError as error:
+        print(f"Error: {error}")
+        return 1
+
+    baseline_file = os.path.join(OUTPUT_DIR, BASELINE_FILE)
+    baseline = load_json(baseline_file)
+    print(format_report(areas, baseline))
+    print(f"\n{len(synthesized)} synthesized, {len(areas) - len(synthesized)} cached "
+          f"in {time.perf_counter() - start:.2f} s")
+    if args.update_baseline:
+        baseline.update({name: area.cells for name, area in areas.items()})
+        save_json(baseline_file, baseline)
+        print(f"Baseline updated: {baseline_file}")
+        return 0
+    regressions, missing = compare(areas, baseline, args.threshold)
+    for name, reference, cells, growth in regressions:
+        print(f"AREA REGRESSION {name}: {reference} -> {cells} cells ({growth:+.1f}% > {args.threshold}%)")
+    if not os.path.exists(baseline_file):
+        print(f"WARNING: no baseline at {baseline_file}; run with --update-baseline to create it")
+    elif missing:
+        print(f"WARNING: no baseline for {', '.join(missing)}; run with --update-baseline to accept them")
+    return 1 if regressions or missing else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+"""
+Streaming, indexed reader for VCD dumps (cpu_simulation.vcd, simulation.vcd)
+and FST dumps (test/tb.fst, through GTKWave's fst2vcd).
+
+The dump is memory-mapped, never loaded whole. A first pass cuts the value
+changes into blocks of about BLOCK_SIZE bytes, each starting on a
+timestamp, and records for every signal the blocks it changes in and its
+last value in each of them. That index is saved next to the dump
+(<dump>.idx.json) and reused while the dump is unchanged. A query then
+needs a binary search plus a regex scan of at most one block per block
+the signal changes in, so looking up a value takes milliseconds whatever
+the size of the dump, and memory stays bounded by the index.
+
+Times are raw VCD ticks, in units of Waveform.timescale.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx.json'
+BLOCK_SIZE = 1 << 18
+# Blocks read by each worker process of the first pass
+JOB_BLOCKS = 64
+
+# Value change tokens: scalar '1!', vector 'b1010 D', real 'r1.5 D'
+_VECTOR_CHARS = frozenset(b'bBrR')
+
+Signal = namedtuple('Signal', ['name', 'code', 'width'])
+Retired = namedtuple('Retired', ['time', 'pc', 'instruction'])
+
+def to_int(value):
+    """ Converts a VCD value to an int, or None if it is unknown or has x/z bits. """
+    try:
+        return int(value, 2)
+    except (TypeError, ValueError):
+        return None
+
+def fst_to_vcd(path):
+    """
+    Converts an FST dump to a VCD file next to it, reused while it is newer
+    than the dump.
+
+    :return: Path of the VCD file.
+    """
+    vcd_path = path + '.vcd'
+    if os.path.exists(vcd_path) and os.stat(vcd_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+        return vcd_path
+    if shutil.which('fst2vcd') is None:
+        raise RuntimeError(f"Reading '{path}' needs fst2vcd (from GTKWave) on the PATH")
+    subprocess.run(['fst2vcd', '-f', path, '-o', vcd_path], check=True)
+    return vcd_path
+
+def parse_header(data):
+    """
+    Parses the declarations of a VCD file.
+
+    :return: (signals, timescale, data_start) where signals maps the full
+             dotted name of every variable to a Signal.
+    """
+    end = data.find(b'$enddefinitions')
+    if end < 0:
+        raise ValueError("Not a VCD file: no $enddefinitions")
+    end = data.find(b'$end', end + len(b'$enddefinitions'))
+    tokens = data[:end].decode('ascii', 'replace').split()
+    signals = {}
+    scopes = []
+    timescale = ''
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == '$scope':
+            scopes.append(tokens[i + 2])
+            i += 3
+        elif token == '$upscope':
+            scopes.pop()
+        elif token == '$var':
+            _, width, code, reference = tokens[i + 1:i + 5]
+            name = '.'.join(scopes + [reference])
+            signals[name] = Signal(name, code, int(width))
+            i += 4
+        elif token == '$timescale':
+            close = tokens.index('$end', i)
+            timescale = ''.join(tokens[i + 1:close])
+            i = close
+        i += 1
+    return signals, timescale, end + len(b'$end')
+
+def block_bounds(data, data_start, block_size=BLOCK_SIZE):
+    """
+    Cuts the value changes into blocks of about block_size bytes, each but
+    the first starting on a timestamp line.
+
+    :return: List of block start offsets, followed by the end of the data.
+    """
+    bounds = [data_start]
+    size = len(data)
+    while bounds[-1] < size:
+        end = data.find(b'\n#', min(bounds[-1] + block_size, size))
+        bounds.append(size if end < 0 else end + 1)
+    return bounds
+
+def index_blocks(data, bounds):
+    """
+    Reads the blocks between consecutive bounds.
+
+    :return: One (start time, {id code: last value}) pair per block; the
+             first block of a dump starts at time 0.
+    """
+    result = []
+    for start, end in zip(bounds, bounds[1:]):
+        tokens = data[start:end].split()
+        block_time = int(tokens[0][1:]) if data[start:start + 1] == b'#' else 0
+        tokens = iter(tokens)
+        last = {}
+        for token in tokens:
+            first = token[0]
+            if first == 35:  # '#'
+                continue
+            if first in _VECTOR_CHARS:
+                last[next(tokens)] = token[1:]
+            elif first == 36:  # '$': $dumpvars, $end, $comment ... $end
+                if token == b'$comment':
+                    for token in tokens:
+                        if token == b'$end':
+                            break
+            else:
+                last[token[1:]] = token[:1]
+        result.append((block_time, {code.decode('ascii'): value.decode('ascii')
+                                    for code, value in last.items()}))
+    return result
+
+def _index_job(job):
+    path, bounds = job
+    with open(path, 'rb') as infile, \
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return index_blocks(data, bounds)
+
+def build_index(path, data, data_start, block_size=BLOCK_SIZE, jobs=None):
+    """
+    Streams the value changes once and builds the block index, reading
+    groups of blocks in parallel worker processes on large dumps.
+
+    :return: (blocks, changes) where blocks is a list of [offset, time]
+             (the block ends where the next one starts) and changes maps
+             each id code to ([block numbers], [last value in that block]).
+    """
+    bounds = block_bounds(data, data_start, block_size)
+    jobs = jobs or os.cpu_count() or 1
+    groups = [bounds[i:i + JOB_BLOCKS + 1] for i in range(0, len(bounds) - 1, JOB_BLOCKS)]
+    if jobs > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(groups))) as pool:
+            results = list(pool.map(_index_job, [(path, group) for group in groups]))
+    else:
+        results = [index_blocks(data, group) for group in groups]
+
+    blocks = []
+    changes = {}
+    for result in results:
+        for block_time, last in result:
+            number = len(blocks)
+            blocks.append([bounds[number], block_time])
+            for code, value in last.items():
+                entry = changes.get(code)
+                if entry is None:
+                    entry = changes[code] = ([], [])
+                entry[0].append(number)
+                entry[1].append(value)
+    return blocks, changes
+
+class Waveform:
+    """
+    Read-only view of a VCD (or FST) dump with a cached block index.
+
+    Signal names are the dotted hierarchy of the dump ('tb.user_project.pc_current');
+    any unique suffix ('user_project.pc_current', 'spi_cs' if there is only
+    one) is accepted as well.
+    """
+
+    def __init__(self, path, block_size=BLOCK_SIZE, use_cache=True, jobs=None):
+        self.path = path
+        vcd_path = fst_to_vcd(path) if path.endswith('.fst') else path
+        self._file = open(vcd_path, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.signals, self.timescale, data_start = parse_header(self.data)
+        self._patterns = {}
+
+        stat = os.stat(vcd_path)
+        key = {'version': INDEX_VERSION, 'size': stat.st_size,
+               'mtime_ns': stat.st_mtime_ns, 'block_size': block_size}
+        index_path = vcd_path + INDEX_SUFFIX
+        index = load_index(index_path, key) if use_cache else None
+        self.index_built = index is None
+        if index is None:
+            blocks, changes = build_index(vcd_path, self.data, data_start, block_size, jobs)
+            index = dict(key, blocks=blocks, changes=changes)
+            if use_cache:
+                save_index(index_path, index)
+        self._block_offsets = [offset for offset, _ in index['blocks']] + [len(self.data)]
+        self._block_times = [block_time for _, block_time in index['blocks']]
+        self._changes = index['changes']
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def end_time(self):
+        """ Time of the last block start, a lower bound of the dump length. """
+        return self._block_times[-1] if self._block_times else 0
+
+    def find(self, name):
+        """ Returns the Signal called name, or ending with '.' + name. """
+        signal = self.signals.get(name)
+        if signal is not None:
+            return signal
+        matches = [s for full, s in self.signals.items() if full.endswith('.' + name)]
+        # Ports are dumped in every scope they go through: same code, same signal
+        if len({s.code for s in matches}) == 1:
+            return min(matches, key=lambda s: len(s.name))
+        if not matches:
+            raise KeyError(f"No signal '{name}' in {self.path}")
+        raise KeyError(f"Signal name '{name}' is ambiguous: "
+                       + ', '.join(sorted(s.name for s in matches)))
+
+    def _pattern(self, code):
+        pattern = self._patterns.get(code)
+        if pattern is None:
+            escaped = re.escape(code.encode('ascii'))
+            pattern = self._patterns[code] = re.compile(
+                rb'^(?:([01xXzZ])|[bBrR](\S+)[ \t]+)' + escaped + rb'[ \t\r]*$', re.MULTILINE)
+        return pattern
+
+    def _scan(self, code, block, start, end):
+        """ Yields (time, value) of the changes of code in a block between start and end. """
+        data = self.data
+        current_time = self._block_times[block]
+        # Timestamps are looked up backwards from each match, so that the
+        # regex only stops on the lines of this signal
+        searched = self._block_offsets[block] - 1
+        for match in self._pattern(code).finditer(data, self._block_offsets[block],
+                                                  self._block_offsets[block + 1]):
+            timestamp = data.rfind(b'\n#', searched, match.start())
+            if timestamp >= 0:
+                current_time = int(data[timestamp + 2:data.find(b'\n', timestamp + 2)])
+                if current_time > end:
+                    return
+            searched = match.end()
+            if current_time >= start:
+                scalar, vector = match.groups()
+                yield current_time, (scalar or vector).decode('ascii')
+
+    def value_at(self, name, when):
+        """ Value of a signal at a time (after the changes at that time), None before its first one. """
+        code = self.find(name).code
+        block = bisect_right(self._block_times, when) - 1
+        changed_blocks, values = self._changes.get(code, ((), ()))
+        i = bisect_right(changed_blocks, block) - 1
+        if i < 0:
+            return None
+        value = values[i]
+        if changed_blocks[i] == block:
+            value = values[i - 1] if i else None
+            for _, value in self._scan(code, block, 0, when):
+                pass
+        return value
+
+    def changes(self, name, start=0, end=None):
+        """
+        Lists the (time, value) changes of a signal with start <= time <= end,
+        scanning only the blocks the signal changes in.
+        """
+        code = self.find(name).code
+        if end is None:
+            end = float('inf')
+        changed_blocks, _ = self._changes.get(code, ((), ()))
+        # A block can end with changes at the start time of the next one
+        first = bisect_left(self._block_times, start) - 1
+        last = bisect_right(self._block_times, end) - 1
+        result = []
+        for i in range(bisect_left(changed_blocks, max(first, 0)),
+                       bisect_right(changed_blocks, last)):
+            result.extend(self._scan(code, changed_blocks[i], start, end))
+        return result
+
+    def history(self, name, start=0, end=None):
+        """ Like changes(), but starts with the (start, value) in effect at start. """
+        result = self.changes(name, start, end)
+        if start > 0 and (not result or result[0][0] > start):
+            value = self.value_at(name, start)
+            if value is not None:
+                result.insert(0, (start, value))
+        return result
+
+    def edges(self, name, start=0, end=None, kind='both'):
+        """
+        Times of the edges of a 1-bit signal, with Verilog posedge/negedge
+        semantics (x->1 is a rising edge). kind is 'rising', 'falling' or 'both'.
+        """
+        previous = self.value_at(name, start - 1) if start > 0 else None
+        result = []
+        for when, value in self.changes(name, start, end):
+            if value == previous:
+                continue
+            if (value == '1' and kind != 'falling') or (value == '0' and kind != 'rising'):
+                result.append(when)
+            previous = value
+        return result
+
+    def cpu_scope(self):
+        """ Hierarchical name of the CPU instance, found from its mem_ready and pc_current. """
+        scopes = {s.name.rsplit('.', 1)[0] for s in self.signals.values() if s.name.endswith('.mem_ready')}
+        scopes = sorted(scope for scope in scopes if scope + '.pc_current' in self.signals)
+        if not scopes:
+            raise KeyError(f"No CPU (mem_ready and pc_current) in {self.path}")
+        return scopes[0]
+
+    def retired_instructions(self, scope=None, start=0, end=None):
+        """
+        Trace of retired instructions.
+
+        A word is fetched from pc_current when mem_ready rises and retires
+        (writes back) on the edge where mem_ready falls after the next fetch,
+        as in tt_um_cpu. The last fetched word is only listed once its
+        successor has been fetched.
+
+        :return: List of Retired(time, pc, instruction).
+        """
+        scope = scope or self.cpu_scope()
+        fetches = self.edges(scope + '.mem_ready', start, end, 'rising')
+        retires = self.edges(scope + '.mem_ready', start, end, 'falling')
+        pcs = self.history(scope + '.pc_current', start, end)
+        words = self.history(scope + '.instruction', start, end)
+        pc_times = [when for when, _ in pcs]
+        word_times = [when for when, _ in words]
+
+        def sample(changes, times, when):
+            i = bisect_right(times, when) - 1
+            return to_int(changes[i][1]) if i >= 0 else None
+
+        trace = []
+        for fetch, next_fetch in zip(fetches, fetches[1:]):
+            i = bisect_right(retires, next_fetch)
+            if i == len(retires):
+                break
+            trace.append(Retired(retires[i], sample(pcs, pc_times, fetch),
+                                 sample(words, word_times, fetch)))
+        return trace
+
+def load_index(path, key):
+    try:
+        with open(path, 'r') as infile:
+            index = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if any(index.get(name) != value for name, value in key.items()):
+        return None
+    return index
+
+def save_index(path, index):
+    try:
+        with open(path, 'w') as outfile:
+            json.dump(index, outfile, separators=(',', ':'))
+    except OSError as error:
+        print(f"Warning: could not save waveform index: {error}")
+
+def main():
+    import Disassembler
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('dump', help="VCD or FST file")
+    parser.add_argument('--list', action='store_true', help="list the signals of the dump")
+    parser.add_argument('--value', nargs=2, action='append', default=[], metavar=('SIGNAL', 'TIME'),
+                        help="value of a signal at a time")
+    parser.add_argument('--edges', action='append', default=[], metavar='SIGNAL',
+                        help="times of the edges of a 1-bit signal")
+    parser.add_argument('--trace', action='store_true', help="retired-instruction trace of the CPU")
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--end', type=int, default=None)
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the sidecar index")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        waveform = Waveform(args.dump, use_cache=not args.no_cache)
+    except (OSError, ValueError, RuntimeError, subprocess.CalledProcessError) as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{'Indexed' if waveform.index_built else 'Opened'} {args.dump} in {elapsed:.1f} ms "
+          f"({len(waveform.signals)} signals, {len(waveform._block_times)} blocks, timescale {waveform.timescale})")
+
+    with waveform:
+        try:
+            if args.list:
+                for signal in waveform.signals.values():
+                    print(f"{signal.name} [{signal.width}]")
+            for name, when in args.value:
+                start = time.perf_counter()
+                value = waveform.value_at(name, int(when))
+                print(f"{name} @ {when} = {value}  ({(time.perf_counter() - start) * 1000:.2f} ms)")
+            for name in args.edges:
+                start = time.perf_counter()
+                edges = waveform.edges(name, args.start, args.end)
+                print(f"{name}: {len(edges)} edges ({(time.perf_counter() - start) * 1000:.2f} ms)")
+                print(' '.join(map(str, edges)))
+            if args.trace:
+                start = time.perf_counter()
+                trace = waveform.retired_instructions(start=args.start, end=args.end)
+                known = [entry.instruction for entry in trace if entry.instruction is not None]
+                texts = iter(Disassembler.disassemble_array(known))
+                for entry in trace:
+                    pc = '?' if entry.pc is None else entry.pc
+                    if entry.instruction is None:
+                        word = '????'
+                    else:
+                        word = f"{entry.instruction:04X}  {next(texts)}"
+                    print(f"{entry.time:>12}  PC={pc:<5} {word}")
+                print(f"{len(trace)} instructions ({(time.perf_counter() - start) * 1000:.2f} ms)")
+        except KeyError as error:
+            print(f"Error: {error.args[0]}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
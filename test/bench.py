@@ -0,0 +1,44 @@
+# SPDX-FileCopyrightText: © 2024 Tiny Tapeout
+# SPDX-License-Identifier: Apache-2.0
+
+"""Module cocotb du benchmark des simulateurs (voir sim_benchmark.py)
+
+Charge BENCH_PROGRAM dans la Flash, laisse tourner le CPU BENCH_CYCLES
+cycles d'un seul Timer (aucun callback Python par cycle : seul le
+simulateur travaille) et écrit le temps réel dans BENCH_RESULT.
+"""
+
+import json
+import os
+import time
+
+import cocotb
+from cocotb.triggers import ClockCycles, Timer
+
+CLOCK_PERIOD_NS = 20
+RESET_CYCLES = 2
+
+@cocotb.test()
+async def bench_long_program(dut):
+    """Programme en boucle infinie, BENCH_CYCLES cycles d'horloge"""
+    cycles = int(os.environ.get("BENCH_CYCLES", "100000"))
+    with open(os.environ["BENCH_PROGRAM"]) as f:
+        program = json.load(f)
+
+    dut.ena.value = 1
+    dut.ui_in.value = 0
+    dut.rst_n.value = 0
+    memory = dut.flash_sim.memory
+    for addr, word in enumerate(program):
+        memory[addr].value = word
+    await ClockCycles(dut.clk, RESET_CYCLES)
+    dut.rst_n.value = 1
+
+    start = time.perf_counter()
+    await Timer(cycles * CLOCK_PERIOD_NS, unit="ns")
+    seconds = time.perf_counter() - start
+
+    pc = int(dut.user_project.pc_current.value)
+    dut._log.info(f"{cycles} cycles en {seconds:.3f} s, PC={pc}")
+    with open(os.environ["BENCH_RESULT"], "w") as f:
+        json.dump({"cycles": cycles, "seconds": seconds, "pc": pc}, f)
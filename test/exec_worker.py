@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: © 2024 Tiny Tapeout
+# SPDX-License-Identifier: Apache-2.0
+
+"""Worker RTL du service d'exécution (voir Compiler/ExecutionServer.py)
+
+Lancé par le serveur, le script build le tb une seule fois (verrou partagé
+entre workers) puis démarre un simulateur qui ne s'arrête plus : le test
+cocotb exec_worker se connecte au socket du pool et exécute les programmes
+un par un sur le même banc, avec le reset et le chargement Flash par
+backdoor de CpuSession. Les registres, flags et la RAM sont relus en fin
+d'exécution, les cycles sont ceux du RTL.
+
+Usage (par le serveur) : python test/exec_worker.py --sim icarus --socket PATH --token TOKEN
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import cocotb
+from cocotb.triggers import RisingEdge
+from cocotb.utils import get_sim_time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "Compiler"))
+from ExecutionServer import ExecutionError, connect_worker, decode_program, error_result
+
+class Deadline(Exception):
+    """Échéance de la requête atteinte pendant l'exécution"""
+
+async def run_job(dut, job):
+    """Exécute un programme du serveur, retourne le dict de résultat"""
+    # Import ici : test.py n'est chargé que dans le simulateur
+    from test import cpu_session, cycles_since, get_reg, read_ram, run_until_settled
+
+    start = time.perf_counter()
+    deadline = start + job["timeout"]
+    program = decode_program(job["program"])
+    session = cpu_session(dut)
+    await session.reset(list(program))
+    fetches = 0
+
+    def on_fetch(state):
+        nonlocal fetches
+        fetches += 1
+        if time.perf_counter() > deadline:
+            raise Deadline()
+
+    sim_start = get_sim_time('ns')
+    try:
+        result = await run_until_settled(dut, job["max_cycles"], on_fetch)
+        status = "halted" if result.settled else "stopped"
+        cycles, pc = result.cycles, result.pc
+    except Deadline:
+        # Sortir de la phase ReadOnly avant le prochain reset
+        await RisingEdge(dut.clk)
+        status = "timeout"
+        cycles, pc = cycles_since(sim_start), int(dut.user_project.pc_current.value)
+    return {
+        "status": status,
+        "pc": pc,
+        "registers": [0] + [get_reg(dut, num) for num in range(1, 8)],
+        "flags": int(dut.user_project.stored_flags.value),
+        "memory": read_ram(dut),
+        # Comme FetchTiming : le dernier fetch n'a pas encore retiré son instruction
+        "instructions": max(fetches - 1, 0),
+        "fetches": fetches,
+        "cycles": cycles,
+        "seconds": time.perf_counter() - start,
+    }
+
+@cocotb.test()
+async def exec_worker(dut):
+    """Boucle du worker : un programme par ligne reçue, jusqu'à la fermeture du socket"""
+    stream = connect_worker(os.environ["EXEC_SOCKET"], os.environ["EXEC_TOKEN"])
+    # readline() bloque le simulateur entre deux programmes : le temps simulé
+    # n'avance pas pendant l'attente
+    for line in stream:
+        job = json.loads(line)
+        try:
+            result = await run_job(dut, job)
+        except ExecutionError as error:
+            result = error_result(str(error))
+        except Exception as error:
+            # Un programme invalide ne doit pas coûter un redémarrage du simulateur
+            result = error_result(f"{type(error).__name__}: {error}")
+        stream.write(json.dumps(result).encode() + b"\n")
+        stream.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker RTL du service d'exécution")
+    parser.add_argument('--sim', choices=("icarus", "verilator"), default="icarus")
+    parser.add_argument('--socket', required=True)
+    parser.add_argument('--token', required=True)
+    args = parser.parse_args()
+
+    import sim_test
+    from cocotb_tools.runner import get_runner
+
+    # Un seul build pour tous les workers lancés en même temps : les suivants
+    # attendent le verrou et trouvent un build à jour
+    build_dir = sim_test.build_dir(args.sim)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    with open(build_dir / ".exec_build.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        sim_test.build(args.sim)
+
+    worker_dir = build_dir / "exec" / args.token
+    runner = get_runner(args.sim)
+    runner.test(
+        hdl_toplevel="tb",
+        hdl_toplevel_lang="verilog",
+        test_module="exec_worker",
+        build_dir=build_dir,
+        test_dir=worker_dir,
+        results_xml=str(worker_dir / "results.xml"),
+        log_file=worker_dir / "sim.log",
+        plusargs=sim_test.plusargs("none"),
+        extra_env={"EXEC_SOCKET": args.socket, "EXEC_TOKEN": args.token},
+    )
+
+if __name__ == "__main__":
+    main()
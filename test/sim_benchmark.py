@@ -0,0 +1,96 @@
+"""Benchmark Icarus / Verilator : cycles simulés par seconde sur un même programme
+
+Chaque simulateur disponible compile le tb (voir sim_test.build) puis
+exécute bench.py : le CPU tourne BENCH_CYCLES cycles sur une boucle qui ne
+s'arrête jamais. Le temps est mesuré dans la simulation, build et démarrage
+exclus. Les PC finaux doivent être identiques d'un simulateur à l'autre.
+
+Usage : python test/sim_benchmark.py [--cycles N] [--sim icarus verilator]
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import sim_test
+
+sys.path.insert(0, str(sim_test.proj_path / "Compiler"))
+import AssemblyTranslator
+
+# Boucle sans fin : ALU, mémoire et décalages, jamais de JMP 0
+PROGRAM = """
+    loadi R2, 3
+loop:
+    addi R1, 1
+    add R3, R3, R1
+    store R3, R0, 1
+    load R4, R0, 1
+    shl R4, 1
+    cmp R1, R2
+    brnz loop
+    jmp loop
+"""
+
+# Exécutable dont dépend chaque simulateur
+EXECUTABLES = {"icarus": "iverilog", "verilator": "verilator"}
+
+def run_bench(simulator, cycles, program_file):
+    """Build puis bench.py ; retourne (temps de build s, résultat de bench.py)"""
+    start = time.perf_counter()
+    runner = sim_test.build(simulator)
+    build_time = time.perf_counter() - start
+    bench_dir = sim_test.build_dir(simulator) / "bench"
+    result_file = bench_dir / "bench.json"
+    runner.test(
+        hdl_toplevel="tb",
+        hdl_toplevel_lang="verilog",
+        test_module="bench",
+        test_dir=bench_dir,
+        results_xml=str(bench_dir / "results.xml"),
+        log_file=bench_dir / "sim.log",
+        extra_env={
+            "BENCH_CYCLES": str(cycles),
+            "BENCH_PROGRAM": str(program_file),
+            "BENCH_RESULT": str(result_file),
+        },
+    )
+    with open(result_file) as f:
+        return build_time, json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cycles simulés par seconde, Icarus contre Verilator")
+    parser.add_argument('--cycles', type=int, default=200000, help="cycles d'horloge simulés")
+    parser.add_argument('--sim', nargs='+', choices=sim_test.SIMULATORS, default=list(sim_test.SIMULATORS))
+    args = parser.parse_args()
+
+    words, _ = AssemblyTranslator.assemble(PROGRAM)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        program_file = Path(directory) / "program.json"
+        with open(program_file, "w") as f:
+            json.dump(list(words), f)
+        for simulator in args.sim:
+            if shutil.which(EXECUTABLES[simulator]) is None:
+                print(f"{simulator} : {EXECUTABLES[simulator]} introuvable, ignoré")
+                continue
+            results[simulator] = run_bench(simulator, args.cycles, program_file)
+
+    print(f"\n{'Simulateur':<10} {'Build (s)':>9} {'Cycles':>10} {'Réel (s)':>9} {'Cycles/s':>12} {'PC':>5}")
+    for simulator, (build_time, result) in results.items():
+        rate = result["cycles"] / result["seconds"]
+        print(f"{simulator:<10} {build_time:>9.2f} {result['cycles']:>10,} {result['seconds']:>9.2f} "
+              f"{rate:>12,.0f} {result['pc']:>5}")
+    if len(results) == 2:
+        (_, (_, icarus)), (_, (_, verilator)) = results.items()
+        print(f"Accélération : {icarus['seconds'] / verilator['seconds']:.1f}x")
+        if icarus["pc"] != verilator["pc"]:
+            print("⚠️ PC finaux différents entre les simulateurs")
+            return 1
+    return 0 if results else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
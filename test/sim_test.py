@@ -1,42 +1,228 @@
+import argparse
+import ast
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from xml.etree import ElementTree
+
 from cocotb_tools.runner import get_runner
 
-def test_cpu_runner():
-    # Définition des chemins
-    proj_path = Path(os.getcwd()).parent
-    src_path = proj_path / "src"
-    test_path = proj_path / "test"
-
-    # Liste des fichiers Verilog (ordre important pour la compilation)
-    sources = [
-        src_path / "ALU.v",
-        src_path / "BranchUnit.v",
-        src_path / "ControlUnit.v",
-        src_path / "DataMemory.v",
-        src_path / "FlagRegister.v",
-        src_path / "ProgramCounter.v",
-        src_path / "ProgramMemory_SPI.v",
-        src_path / "register_file.v",
-        src_path / "tt_um_cpu.v",
-        test_path / "spi_flash_sim.v",  # ✅ AJOUTER CETTE LIGNE
-        test_path / "tb.v",
-    ]
-
-    # Configuration du simulateur
-    runner = get_runner("icarus")
-    
+# Définition des chemins
+proj_path = Path(__file__).resolve().parent.parent
+src_path = proj_path / "src"
+test_path = proj_path / "test"
+build_path = test_path / "sim_build"
+
+# Liste des fichiers Verilog (ordre important pour la compilation)
+sources = [
+    src_path / "ALU.v",
+    src_path / "BranchUnit.v",
+    src_path / "ControlUnit.v",
+    src_path / "DataMemory.v",
+    src_path / "FlagRegister.v",
+    src_path / "ProgramCounter.v",
+    src_path / "ProgramMemory_SPI.v",
+    src_path / "register_file.v",
+    src_path / "tt_um_cpu.v",
+    test_path / "spi_flash_sim.v",  # ✅ AJOUTER CETTE LIGNE
+    test_path / "tb.v",
+]
+
+TEST_MODULE = "test"
+# Simulateur par défaut, comme SIM dans le Makefile
+SIMULATOR = os.environ.get("SIM", "icarus")
+SIMULATORS = ("icarus", "verilator")
+
+# Verilator compile le modèle en C++ : --timing pour l'horloge de tb.v
+# (#délais), timescale imposée aux sources de src/ qui n'en ont pas,
+# avertissements de lint non bloquants (ex. pin ready_q non connectée) et
+# C++ en -O2 (~40 % plus rapide que le -Os par défaut, voir
+# sim_benchmark.py). --public-flat-rw, ajouté par cocotb, garde
+# flash_sim.memory et regfile.register_tab accessibles en écriture par VPI.
+BUILD_ARGS = {
+    "icarus": [],
+    "verilator": ["--timing", "-Wno-fatal", "-O3", "-CFLAGS", "-O2"],
+}
+TIMESCALE = ("1ns", "1ps")
+
+# Signaux que tb.v peut écrire dans tb.fst (+dump_scope) ; le dump reste
+# fermé hors des fenêtres ouvertes par test.py (voir WaveDump)
+DUMP_SCOPE = os.environ.get("DUMP_SCOPE", "cpu")
+DUMP_SCOPES = ("none", "tb", "pins", "cpu", "regfile", "flash")
+
+def plusargs(scope=DUMP_SCOPE):
+    if scope not in DUMP_SCOPES:
+        raise ValueError(f"Portée de dump inconnue : {scope} (choix : {', '.join(DUMP_SCOPES)})")
+    return [f"+dump_scope={scope}"]
+
+def build_dir(simulator=SIMULATOR):
+    """Icarus garde sim_build/, chaque autre simulateur a son sous-répertoire"""
+    return build_path if simulator == "icarus" else build_path / simulator
+
+def build(simulator=SIMULATOR, waves=False):
+    """Compile le tb une seule fois, partagé par tous les shards"""
+    if simulator not in SIMULATORS:
+        raise ValueError(f"Simulateur inconnu : {simulator} (choix : {', '.join(SIMULATORS)})")
+    runner = get_runner(simulator)
     runner.build(
         sources=sources,
         hdl_toplevel="tb",
         includes=[src_path],
-        build_dir=test_path / "sim_build",
+        build_dir=build_dir(simulator),
+        build_args=BUILD_ARGS[simulator],
+        timescale=TIMESCALE if simulator == "verilator" else None,
+        waves=waves,
     )
+    return runner
+
+def run_tests(simulator=SIMULATOR):
+    """Build puis tous les tests dans un seul simulateur"""
+    runner = build(simulator)
 
     runner.test(
         hdl_toplevel="tb",
-        test_module="test",
+        test_module=TEST_MODULE,
+        plusargs=plusargs(),
     )
 
+def test_cpu_runner():
+    run_tests()
+
+# ============================================================================
+# RÉGRESSION PARALLÈLE
+# ============================================================================
+
+def list_tests(module_path=test_path / f"{TEST_MODULE}.py"):
+    """Noms des fonctions @cocotb.test() du module, dans l'ordre du fichier"""
+    tree = ast.parse(module_path.read_text(encoding="utf-8"))
+    names = []
+    for node in tree.body:
+        if not isinstance(node, ast.AsyncFunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            if isinstance(decorator, ast.Call):
+                decorator = decorator.func
+            if ast.unparse(decorator) == "cocotb.test":
+                names.append(node.name)
+    return names
+
+def read_results(results_file):
+    """Résultats d'un results.xml : {test: (passé, temps réel s, temps simulé ns)}"""
+    results = {}
+    for testcase in ElementTree.parse(results_file).iter("testcase"):
+        failed = testcase.find("failure") is not None or testcase.find("error") is not None
+        results[testcase.get("name")] = (
+            not failed,
+            float(testcase.get("time", 0)),
+            float(testcase.get("sim_time_ns", 0)),
+        )
+    return results
+
+def make_shards(tests, jobs, durations):
+    """Répartit les tests sur `jobs` shards, les plus longs d'abord.
+
+    `durations` vient d'une régression précédente ; un test inconnu compte
+    pour la durée moyenne.
+    """
+    known = [durations[t] for t in tests if t in durations]
+    default = sum(known) / len(known) if known else 1.0
+    shards = [[] for _ in range(min(jobs, len(tests)))]
+    loads = [0.0] * len(shards)
+    for test in sorted(tests, key=lambda t: durations.get(t, default), reverse=True):
+        index = loads.index(min(loads))
+        shards[index].append(test)
+        loads[index] += durations.get(test, default)
+    # Garder l'ordre du fichier à l'intérieur de chaque shard
+    order = {test: n for n, test in enumerate(tests)}
+    return [sorted(shard, key=order.get) for shard in shards]
+
+def run_shard(index, testcases, simulator=SIMULATOR):
+    """Lance un simulateur sur un shard, dans son propre répertoire"""
+    shard_dir = build_dir(simulator) / f"shard{index}"
+    results_file = shard_dir / "results.xml"
+    runner = get_runner(simulator)
+    start = time.perf_counter()
+    try:
+        runner.test(
+            hdl_toplevel="tb",
+            # Runner neuf, sans build() : le langage ne se déduit pas des sources
+            hdl_toplevel_lang="verilog",
+            test_module=TEST_MODULE,
+            testcase=testcases,
+            build_dir=build_dir(simulator),
+            test_dir=shard_dir,
+            results_xml=str(results_file),
+            log_file=shard_dir / "sim.log",
+            plusargs=plusargs(),
+        )
+    except SystemExit:
+        # Le simulateur a planté : les tests absents du results.xml
+        # seront comptés en échec
+        pass
+    return results_file, time.perf_counter() - start
+
+def merge_results(results_files, output_file):
+    """Fusionne les results.xml des shards en un seul fichier"""
+    merged = ElementTree.Element("testsuites", name="results")
+    for results_file in results_files:
+        if results_file.is_file():
+            merged.extend(ElementTree.parse(results_file).getroot().iter("testsuite"))
+    ElementTree.ElementTree(merged).write(output_file, encoding="UTF-8", xml_declaration=True)
+
+def run_regression(jobs, testcases=None, simulator=SIMULATOR):
+    """Build unique puis tests répartis sur `jobs` simulateurs en parallèle.
+
+    Retourne le nombre de tests en échec.
+    """
+    tests = testcases or list_tests()
+    merged_file = build_dir(simulator) / "results.xml"
+    durations = {}
+    if merged_file.is_file():
+        durations = {t: r[1] for t, r in read_results(merged_file).items()}
+
+    start = time.perf_counter()
+    build(simulator)
+    build_time = time.perf_counter() - start
+
+    shards = make_shards(tests, jobs, durations)
+    with ThreadPoolExecutor(len(shards)) as pool:
+        runs = list(pool.map(run_shard, range(len(shards)), shards, [simulator] * len(shards)))
+    wall_time = time.perf_counter() - start
+
+    merge_results([results_file for results_file, _ in runs], merged_file)
+    results = read_results(merged_file)
+
+    print(f"\n{'Test':<32} {'Shard':>5} {'Statut':>6} {'Réel (s)':>9} {'Simulé (µs)':>12}")
+    failed = 0
+    for index, shard in enumerate(shards):
+        for test in shard:
+            passed, seconds, sim_ns = results.get(test, (False, 0.0, 0.0))
+            failed += not passed
+            status = "PASS" if passed else "FAIL"
+            print(f"{test:<32} {index:>5} {status:>6} {seconds:>9.2f} {sim_ns / 1000:>12.1f}")
+
+    test_time = sum(seconds for _, seconds, _ in results.values())
+    print(f"\n{len(tests)} tests, {failed} échec(s), {len(shards)} shard(s), {simulator}")
+    print(f"Build : {build_time:.2f} s, shards : "
+          + ", ".join(f"{seconds:.2f}" for _, seconds in runs) + " s")
+    print(f"Total : {wall_time:.2f} s (somme des tests {test_time:.2f} s)")
+    print(f"Résultats fusionnés : {merged_file}")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Régression cocotb du CPU")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="nombre de simulateurs en parallèle (défaut : un seul simulateur, sans sharding)")
+    parser.add_argument('--sim', choices=SIMULATORS, default=SIMULATOR,
+                        help=f"simulateur (défaut : $SIM ou {SIMULATOR})")
+    parser.add_argument('testcase', nargs='*', help="tests à lancer (défaut : tous)")
+    args = parser.parse_args()
+
+    if args.jobs is None and not args.testcase:
+        run_tests(args.sim)
+        return 0
+    return 1 if run_regression(max(1, args.jobs or 1), args.testcase, args.sim) else 0
+
 if __name__ == "__main__":
-    test_cpu_runner()
\ No newline at end of file
+    raise SystemExit(main())
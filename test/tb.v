@@ -3,22 +3,58 @@
 
 module tb ();
 
+  // Dump piloté par test.py (WaveDump) : rien n'est écrit tant que
+  // dump_enable reste à 0. +dump_scope=<portée> choisit les signaux
+  // (voir DUMP_SCOPES dans sim_test.py), none n'ouvre même pas tb.fst ;
+  // dump_ready indique à test.py que des fenêtres peuvent être écrites.
+  reg dump_enable = 1'b0;
+  reg dump_ready = 1'b0;
+
+`ifndef VERILATOR
+  // Verilator trace lui-même tout le modèle quand WAVES=1 (Makefile ou
+  // sim_test.py) le compile avec --trace : pas de $dumpvars, qui exigerait ce flag
+  reg [8*8-1:0] dump_scope;
   initial begin
-    $dumpfile("tb.fst");
-    $dumpvars(0, tb);
-    #1;
+    if (!$value$plusargs("dump_scope=%s", dump_scope))
+      dump_scope = "cpu";
+    if (dump_scope != "none") begin
+      $dumpfile("tb.fst");
+      case (dump_scope)
+        "tb":      $dumpvars(0, tb);
+        "pins":    $dumpvars(1, tb);
+        "regfile": $dumpvars(0, tb.user_project.regfile);
+        "flash":   $dumpvars(0, tb.flash_sim);
+        default:   $dumpvars(0, tb.user_project);
+      endcase
+      $dumpoff;
+      dump_ready = 1'b1;
+    end
   end
 
+  always @(dump_enable)
+    if (dump_ready) begin
+      if (dump_enable)
+        $dumpon;
+      else
+        $dumpoff;
+    end
+`endif
+
   // Signaux
-  reg clk;
+  reg clk = 1'b0;
   reg rst_n;
   reg ena;
   reg [7:0] ui_in;
-  reg [7:0] uio_in;
+  wire [7:0] uio_in;
   wire [7:0] uo_out;
   wire [7:0] uio_out;
   wire [7:0] uio_oe;
 
+  // Horloge libre 50 MHz, démarrée une seule fois pour toute la session
+  // cocotb (CLOCK_PERIOD_NS dans test.py doit correspondre)
+  localparam CLOCK_PERIOD_NS = 20;
+  always #(CLOCK_PERIOD_NS / 2) clk = ~clk;
+
 `ifdef GL_TEST
   wire VPWR = 1'b1;
   wire VGND = 1'b0;
@@ -51,13 +87,29 @@ module tb ();
       .rst_n  (rst_n)
   );
   
+`ifndef GL_TEST
+  // Sondes pour test.py : registres et RAM lus en un seul accès VPI chacun
+  // (R1 dans les bits de poids faible de probe_regs, ram[0] dans ceux de probe_ram)
+  wire [55:0]  probe_regs;
+  wire [255:0] probe_ram;
+  genvar probe_i;
+  generate
+    for (probe_i = 1; probe_i < 8; probe_i = probe_i + 1) begin : probe_reg
+      assign probe_regs[(probe_i - 1) * 8 +: 8] = user_project.regfile.register_tab[probe_i];
+    end
+    for (probe_i = 0; probe_i < 32; probe_i = probe_i + 1) begin : probe_mem
+      assign probe_ram[probe_i * 8 +: 8] = user_project.data_mem.ram[probe_i];
+    end
+  endgenerate
+`endif
+
   // Simulateur de Flash SPI
   spi_flash_sim flash_sim (
       .spi_cs(spi_cs),
       .spi_sck(spi_sck),
       .spi_mosi(spi_mosi),
       .spi_miso(spi_miso),
-      .pc_current(user_project.pc_current),
+      .pc_current({6'b0, user_project.pc_current}),
       .spi_state(user_project.program_mem.state),
       .bit_cnt(user_project.program_mem.bit_cnt)
   );